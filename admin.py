@@ -4,7 +4,7 @@ from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
 from config import STATE_DB_PATH, get_readonly_conn
-from db import state_conn, init_state_db, rquery, upsert_order_state
+from db import state_conn, init_state_db, rquery, upsert_order_state, get_snapshot_as_of, get_snapshot_history
 
 
 from config import get_readonly_conn
@@ -348,7 +348,23 @@ def order_detail(sordernum):
         (sordernum,)
     ).fetchone()
     conn.close()
-    return render_template("order_detail.html", order=order)
+
+    # ✅ Snapshot time travel: ?run=<run_id> shows what the order looked like at that run
+    as_of_run = (request.args.get("run") or "").strip() or None
+    snapshots = []
+    if order:
+        kinds = [("SO4_LINES", sordernum, "PolyTex SO lines"), ("SO4_HEADER", sordernum, "PolyTex SO header")]
+        if order["job_p4_code"]:
+            kinds.append(("REQ_JOB", order["job_p4_code"], f"PolyTex job {order['job_p4_code']} film requirements"))
+        for kind, key, label in kinds:
+            snapshots.append({
+                "kind": kind,
+                "label": label,
+                "as_of": get_snapshot_as_of(kind, key, as_of_run),
+                "history": get_snapshot_history(kind, key, limit=20),
+            })
+
+    return render_template("order_detail.html", order=order, snapshots=snapshots, as_of_run=as_of_run)
 
 
 
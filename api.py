@@ -1,13 +1,18 @@
 #api.py
 import base64
 import json
-from typing import Optional, Tuple, List, Dict, Any
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Dict, Any, Callable, Iterable
 
 import requests
 
-from config import API_URL, SESSION
-from models import ApiDecodeResult
+from config import API_URL, SESSION, XLINK_MAX_IN_FLIGHT, XLINK_ENTITY_LIMITS
+from radius_codec import RadiusResponse
 from logger import get_logger
+import run_context
 
 log = get_logger("api")
 
@@ -15,133 +20,173 @@ def b64_json(payload: Dict[str, Any]) -> str:
     raw = json.dumps(payload)
     return base64.b64encode(raw.encode()).decode()
 
+# ------------------------------------------------------------
+# In-flight limits (every XLink post holds one total + one entity slot)
+# ------------------------------------------------------------
+_TOTAL_SLOTS = threading.BoundedSemaphore(XLINK_MAX_IN_FLIGHT)
+_ENTITY_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_ENTITY_SLOTS_LOCK = threading.Lock()
+
+
+def _entity_semaphore(entity_name: str) -> Optional[threading.BoundedSemaphore]:
+    limit = XLINK_ENTITY_LIMITS.get(entity_name)
+    if not limit:
+        return None
+    with _ENTITY_SLOTS_LOCK:
+        sem = _ENTITY_SLOTS.get(entity_name)
+        if sem is None:
+            sem = _ENTITY_SLOTS[entity_name] = threading.BoundedSemaphore(limit)
+        return sem
+
+
+@contextmanager
+def entity_slot(entity_name: str):
+    """Blocks until a post to entity_name is allowed (XLINK_ENTITY_LIMITS / XLINK_MAX_IN_FLIGHT)."""
+    sem = _entity_semaphore(entity_name)
+    if sem is not None:
+        sem.acquire()
+    try:
+        with _TOTAL_SLOTS:
+            yield
+    finally:
+        if sem is not None:
+            sem.release()
+
+
+def _debug_enabled(logger) -> bool:
+    try:
+        return logger.isEnabledFor(logging.DEBUG)
+    except Exception:
+        return True
+
+
 def send_post_request(entity_name: str, b64_payload: str, logger) -> requests.Response:
     body = {"efiRadiusRequest": {"entityName": entity_name, "payload": b64_payload}}
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
-    try:
-        decoded = base64.b64decode(b64_payload).decode()
-        logger.debug(f"Sending '{entity_name}' payload: {decoded}")
-    except Exception as e:
-        logger.debug(f"Could not decode payload before send: {e}")
+    # ✅ Only render the payload when DEBUG is on: base64 + utf-8 of a batch payload is not free
+    debug = _debug_enabled(logger)
+    if debug:
+        try:
+            logger.debug(f"Sending '{entity_name}' payload: {base64.b64decode(b64_payload).decode()}")
+        except Exception as e:
+            logger.debug(f"Could not decode payload before send: {e}")
 
-    resp = SESSION.post(API_URL, json=body, headers=headers, timeout=60)
-    logger.debug(f"API Response: {resp.status_code} {resp.text}")
+    try:
+        with entity_slot(entity_name):
+            resp = SESSION.post(API_URL, json=body, headers=headers, timeout=60)
+    finally:
+        # ✅ Even a failed/timed-out post may have changed Radius: drop cached reads
+        run_context.invalidate_for_entity(entity_name)
+    if debug:
+        logger.debug(f"API Response: {resp.status_code} {resp.text}")
     return resp
 
-def decode_generic(resp: requests.Response) -> ApiDecodeResult:
-    status = None
-    entity = ""
-    raw_err = ""
-    messages: List[str] = []
-    decoded_payload = None
+# ------------------------------------------------------------
+# Concurrent client
+# ------------------------------------------------------------
+class XLinkClient:
+    """
+    Thread-pool backed XLink client: submit() returns a Future of
+    (response, decoded) so independent posts overlap on network latency.
+    Posts go through send_post_request, so in-flight limits, logging and
+    run-cache invalidation are the same as for synchronous callers.
+    """
 
-    try:
-        api_json = resp.json()
-        radius = api_json.get("efiRadiusResponse", {})
-        status = radius.get("statusCode")
-        entity = radius.get("entityName", "") or ""
-        raw_err = radius.get("errorMessage", "") or ""
-        b64 = radius.get("payload")
-
-        if b64:
+    def __init__(self, max_in_flight: int = XLINK_MAX_IN_FLIGHT):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_in_flight)), thread_name_prefix="xlink")
+
+    def submit(self, entity_name: str, b64_payload: str, logger=log,
+               decoder: Optional[Callable[[requests.Response], Any]] = None) -> Future:
+        decoder = decoder or decode_generic
+
+        def _call():
+            resp = send_post_request(entity_name, b64_payload, logger)
+            return resp, decoder(resp)
+
+        return self._pool.submit(_call)
+
+    def post_all(self, calls: Iterable[Tuple[str, str]], logger=log,
+                 decoder: Optional[Callable[[requests.Response], Any]] = None) -> List[Any]:
+        """
+        Posts every (entity_name, b64_payload) concurrently and returns the results
+        in call order: (response, decoded), or the exception the post raised.
+        """
+        futures = [self.submit(entity, payload, logger, decoder) for entity, payload in calls]
+        out: List[Any] = []
+        for fut in futures:
             try:
-                decoded = base64.b64decode(b64).decode()
-                decoded_payload = json.loads(decoded)
+                out.append(fut.result())
             except Exception as e:
-                messages.append(f"Failed to decode payload: {e}")
+                out.append(e)
+        return out
 
-    except Exception as e:
-        raw_err = f"Exception parsing API response JSON: {e}"
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
 
-    if raw_err and not messages:
-        messages.append(raw_err)
 
-    return ApiDecodeResult(status, entity, raw_err, messages, decoded_payload)
+_CLIENT: Optional[XLinkClient] = None
+_CLIENT_LOCK = threading.Lock()
 
-def decode_porder_response(resp):
-    """
-    Decode XLinkAPIPOrder response.
-    Handles non-JSON payloads safely and preserves Radius errorMessage.
-    """
-    import json
-    import base64
 
-    body = resp.json()
-    r = body.get("efiRadiusResponse", {})
+def xlink_client() -> XLinkClient:
+    """Process-wide XLinkClient (created on first use)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = XLinkClient()
+        return _CLIENT
 
-    status_code = int(r.get("statusCode", 0) or 0)
-    error_message = r.get("errorMessage") or ""
 
-    messages = []
-    if error_message:
-        messages.append(error_message)
+def close_xlink_client() -> None:
+    global _CLIENT
+    with _CLIENT_LOCK:
+        client, _CLIENT = _CLIENT, None
+    if client is not None:
+        client.close()
 
-    decoded_payload = None
-    raw_payload = r.get("payload")
 
-    if raw_payload:
-        try:
-            txt = base64.b64decode(raw_payload).decode("utf-8", errors="replace").strip()
+def decode_generic(resp: requests.Response) -> RadiusResponse:
+    # ✅ Radius reply parsed once per response (cached on resp); fields are read lazily
+    return RadiusResponse.of(resp)
 
-            # Only attempt JSON decode if it actually looks like JSON
-            if txt.startswith("{") or txt.startswith("["):
-                decoded_payload = json.loads(txt)
-            else:
-                decoded_payload = {"_payload_text": txt}
+def decode_porder_response(resp: requests.Response) -> RadiusResponse:
+    """
+    Decode XLinkAPIPOrder response.
+    Handles non-JSON payloads safely ({"_payload_text": ...}), a missing statusCode
+    reads as 0, and the Radius errorMessage comes first in messages.
+    """
+    out = RadiusResponse.of(resp, status_default=0, text_payload=True)
+    msgs = [out.raw_error] if out.raw_error else []
+    if out.payload_error is not None:
+        msgs.append(f"Failed to decode payload: {out.payload_error}")
+    out.messages = msgs
+    return out
 
-        except Exception as e:
-            messages.append(f"Failed to decode payload: {e}")
-
-    return type("DecodedResponse", (), {
-        "status_code": status_code,
-        "messages": messages,
-        "decoded_payload": decoded_payload,
-        "error_message": error_message,
-        "raw": body,
-    })()
-
-def decode_sorder_response(resp: requests.Response) -> ApiDecodeResult:
-    out = decode_generic(resp)
+def decode_sorder_response(resp: requests.Response) -> RadiusResponse:
+    out = RadiusResponse.of(resp)
     if not out.decoded_payload:
         return out
 
-    msgs: List[str] = []
-    data = out.decoded_payload
     try:
-        for so in data.get("XLSOrders", {}).get("XLSOrder", []):
-            sn = so.get("SOrderNum", "")
-            hdr = so.get("ErrorMessage")
-            if hdr:
-                msgs.append(f"SO {sn}: {hdr.strip()}")
-            for line in so.get("XLSOrderPrice", []):
-                lm = line.get("ErrorMessage")
-                item = line.get("ItemCode", "")
-                if lm:
-                    msgs.append(f"SO {sn} Item {item}: {lm.strip()}")
+        msgs = out.sorder_messages()
     except Exception as e:
-        msgs.append(f"Failed to parse SO messages: {e}")
+        msgs = [f"Failed to parse SO messages: {e}"]
 
     if msgs:
         out.messages = msgs
     return out
 
-def decode_item_response(resp: requests.Response) -> ApiDecodeResult:
+def decode_item_response(resp: requests.Response) -> RadiusResponse:
     # Item responses often place errors on XLItems.XLItem[].ErrorMessage
-    out = decode_generic(resp)
+    out = RadiusResponse.of(resp)
     if not out.decoded_payload:
         return out
 
-    msgs: List[str] = []
-    data = out.decoded_payload
     try:
-        for it in data.get("XLItems", {}).get("XLItem", []):
-            code = it.get("ItemCode", "")
-            em = it.get("ErrorMessage")
-            if em:
-                msgs.append(f"Item {code}: {em.strip()}")
+        msgs = out.item_messages()
     except Exception as e:
-        msgs.append(f"Failed to parse Item messages: {e}")
+        msgs = [f"Failed to parse Item messages: {e}"]
 
     if msgs:
         out.messages = msgs
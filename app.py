@@ -1,12 +1,14 @@
 # lws_workflow/app.py
 import os
 import json
+import socket
 import uuid
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 import requests
-import base64
 import html
 
 
@@ -14,8 +16,14 @@ import html
 from config import (
     ENV,
     MAX_ORDERS_PER_RUN,
+    PHASE1_WORKERS,
+    DEFERRED_RECHECK_SECONDS,
+    DEFERRED_MAX_ATTEMPTS,
+    BATCH_CREATE_ENABLED,
+    RUN_LOCK_TTL_MINUTES,
     get_readonly_conn,
     get_db_conn,
+    radius_pool_stats,
     ADMIN_EMAILS,
     STATE_DB_PATH,
     REQUIRED_DATE_LEAD_DAYS,
@@ -25,6 +33,8 @@ from config import (
 from logger import get_logger
 from emailer import send_email
 from services.hold_reminder import send_hold_reminders_if_needed
+from services import monitor_scheduler
+from services import batch_create
 
 # ---------------- STATE DB ----------------
 from db import (
@@ -34,22 +44,42 @@ from db import (
     close_run,
     mark_run_order,
     upsert_order_state,
+    order_unit_of_work,
+    flush_order_writes,
     rquery,
     is_order_complete,
     state_conn,  # ✅ SQLite connection (phase 2 snapshots / mapping)
     # Phase2 mapping (SQLite)
     upsert_so4_to_po_map,
-    is_order_removed,
+    get_order_status_map,
+    is_phase2_hold_state,
+    is_monitored_state,
     get_order_state_row,
     mark_failure_email_sent,
+    # Deferred verify queue
+    park_deferred_check,
+    get_deferred_attempts,
+    get_deferred_checks,
+    bump_deferred_checks,
+    clear_deferred_check,
+    # Buffered change log
+    change_log_writer,
+    # Versioned Phase 2 snapshots
+    record_snapshot_versions,
+    # Cross-process run lock
+    acquire_run_lock,
+    release_run_lock,
+    renew_run_lock,
+    get_run_lock,
 )
 
 # ---------------- ELIGIBILITY ----------------
-from services.eligibility import find_eligible_sorders
+from services.eligibility import find_eligible_sorders, filter_eligible_sorders
 
 # ---------------- PLANT 4 (POLYTEX) ----------------
 from services.job_p4 import (
     find_existing_job_p4,
+    find_existing_jobs_p4,
     create_job_p4,
     JobHold as JobHoldP4,
 )
@@ -57,22 +87,26 @@ from services.job_p4 import (
 from services.job_requirements import get_job_requirements
 from services.polytex_po import (
     find_existing_po_by_job,
+    find_existing_pos_by_jobs,
     create_polytex_po,
 )
 
 # ---------------- PLANT 2 (STARPAK) ----------------
 from services.starpak_so import (
     find_existing_so_by_po,
+    find_existing_sos_by_pos,
     create_starpak_so,
     get_so_status_p2,
+    get_so_statuses_p2,
 )
 
 from services.job_p2 import (
     find_existing_job_p2,
+    find_existing_jobs_p2,
     create_job_p2,
 )
 
-from services.shipreq_p2 import create_shipreq_for_so_p2
+from services.shipreq_p2 import create_shipreq_for_so_p2, get_so_line_counts_p2
 
 # ---------------- ITEM CREATION (AUTOMATOR) ----------------
 from services.item_creation import create_pt_and_sp_items_from_so_itemcode
@@ -80,17 +114,25 @@ from services.item_creation import create_pt_and_sp_items_from_so_itemcode
 # ---------------- PHASE 2 ----------------
 from services.phase2_qty_changes import (
     detect_so4_qty_changes_or_hold,
+    detect_so4_qty_changes_bulk,
     detect_starpak_reconfirm_or_complete,
+    detect_starpak_reconfirm_or_complete_bulk,
     apply_req_changes_to_po,
-     _get_state_fields
+     _get_state_fields,
+    _get_state_fields_bulk,
 )
 
-from services.phase2_custref_changes import detect_so4_custref_changes_and_update_starpak
+from services.phase2_custref_changes import (
+    detect_so4_custref_changes_and_update_starpak,
+    detect_so4_custref_changes_bulk,
+)
 from services.film_validation_lws import validate_printed_film_base_or_fail
 
 
 
-from exceptions import WorkflowHold
+from exceptions import WorkflowHold, WorkflowDeferred, RunLockLost
+from radius_codec import RadiusResponse
+import run_context
 
 
 
@@ -133,9 +175,8 @@ def _summarize_radius_error_html(raw_text: str) -> str:
     if not raw_text:
         return ""
 
-    try:
-        raw_obj = json.loads(raw_text)
-    except Exception:
+    rr = RadiusResponse.from_text(raw_text)
+    if rr.body is None:
         # Not JSON
         return (
             "<h3 style='margin:16px 0 6px; font-size:15px; color:#111827;'>Raw API Response</h3>"
@@ -145,58 +186,19 @@ def _summarize_radius_error_html(raw_text: str) -> str:
             "</pre>"
         )
 
-    resp = (raw_obj.get("efiRadiusResponse") or {}) if isinstance(raw_obj, dict) else {}
-    entity = resp.get("entityName")
-    status = resp.get("statusCode")
-    err_msg = resp.get("errorMessage")
-    payload_b64 = resp.get("payload")
-
-    payload_obj = None
-    if payload_b64:
-        try:
-            payload_json = base64.b64decode(payload_b64).decode("utf-8", errors="replace")
-            payload_obj = json.loads(payload_json)
-        except Exception:
-            payload_obj = None
+    entity = rr.entity
+    status = rr.envelope.get("statusCode")
+    err_msg = rr.envelope.get("errorMessage")
 
     # Pull common Radius payload fields
+    # payload typically: {"XLSOrders":{"XLSOrder":[{...,"ErrorMessage":"Problem with Line #1","XLSOrderLine":[{...,"ErrorMessage":"Item is inactive"}]}]}}
     header_error = None
     line_errors = []
-
     try:
-        # payload typically: {"XLSOrders":{"XLSOrder":[{...,"ErrorMessage":"Problem with Line #1","XLSOrderLine":[{...,"ErrorMessage":"Item is inactive"}]}]}}
-        order = None
-        if isinstance(payload_obj, dict):
-            if "XLSOrders" in payload_obj:
-                x = payload_obj.get("XLSOrders") or {}
-                xs = x.get("XLSOrder")
-                if isinstance(xs, list) and xs:
-                    order = xs[0]
-                elif isinstance(xs, dict):
-                    order = xs
-            elif "XLSOrder" in payload_obj:
-                xs = payload_obj.get("XLSOrder")
-                if isinstance(xs, list) and xs:
-                    order = xs[0]
-                elif isinstance(xs, dict):
-                    order = xs
-
-        if isinstance(order, dict):
-            header_error = order.get("ErrorMessage") or order.get("errorMessage")
-
-            lines = order.get("XLSOrderLine")
-            if isinstance(lines, dict):
-                lines = [lines]
-            if isinstance(lines, list):
-                for ln in lines:
-                    if not isinstance(ln, dict):
-                        continue
-                    line_errors.append({
-                        "SOrderLineNum": ln.get("SOrderLineNum") or ln.get("SOrderLineNum".lower()),
-                        "ItemCode": ln.get("ItemCode") or ln.get("itemcode"),
-                        "ErrorMessage": ln.get("ErrorMessage") or ln.get("errorMessage"),
-                        "Action": ln.get("Action") or ln.get("action"),
-                    })
+        orders = rr.elements()
+        if orders:
+            header_error = orders[0].get("ErrorMessage") or orders[0].get("errorMessage")
+            line_errors = rr.line_errors(orders[0])
     except Exception:
         pass
 
@@ -278,9 +280,10 @@ def get_phase2_held_orders(limit: int = 5000) -> set[int]:
             pass
 
 
-def get_orders_in_step(step: str, limit: int = 500) -> list[int]:
+def get_orders_in_step(step: str, limit: Optional[int] = 500) -> list[int]:
     """
-    Returns SOs whose lws_order_state.last_step matches exactly the given step.
+    Returns SOs whose lws_order_state.last_step matches exactly the given step
+    (limit=None returns all of them).
     """
     conn = state_conn()
     try:
@@ -293,7 +296,7 @@ def get_orders_in_step(step: str, limit: int = 500) -> list[int]:
              ORDER BY sordernum DESC
              LIMIT ?
             """,
-            (str(step), int(limit)),
+            (str(step), -1 if limit is None else int(limit)),
         )
         rows = cur.fetchall()
         return [int(r[0]) for r in rows] if rows else []
@@ -318,6 +321,7 @@ def force_starpak_so_authorized(rw_conn, so_num: int, logger):
     cur = rw_conn.cursor()
     cur.execute(sql, (so_num,))
     rw_conn.commit()
+    run_context.invalidate_tables("pv_sorder")
     log.info(f"Forced Plant2 SO {so_num} to AUTHORIZED (sorderstat=0).")
 
 
@@ -334,6 +338,7 @@ def set_polytex_po_confirmed(rw_conn, po_num: int, logger):
     cur = rw_conn.cursor()
     cur.execute(sql, (po_num,))
     rw_conn.commit()
+    run_context.invalidate_tables("pv_porder")
     log.info(f"Set PolyTex PO {po_num} to CONFIRMED (porderstat=2).")
 
 
@@ -482,6 +487,9 @@ def fail_order(
     )
     mark_run_order(run_id, sordernum, "FAILED", step)
 
+    # FAILED is always durable before the dedupe read / email bookkeeping below
+    flush_order_writes()
+
     # --------------------------------------------
     # 3) Compute failure signature (dedupe key)
     #    Same SO + same step + same "meaningful error" = same signature
@@ -812,6 +820,7 @@ def apply_price_code_updates(rw_conn, itemcodes: set[str], logger):
             logger.info(f"Updated SalesPriceCode for {item}")
 
     rw_conn.commit()
+    run_context.invalidate_tables("pm_item")
 
 
 # def trigger_xlink_price_update(logger):
@@ -878,6 +887,7 @@ def trigger_xlink_price_update(logger, env="LIVE", company_id=None, run_all=Fals
 
     try:
         r = requests.post(url, json=payload, headers=headers, timeout=timeout)
+        run_context.invalidate_all()  # batch XLink import can touch any item/price table
         r.raise_for_status()
 
         logger.info(
@@ -895,10 +905,117 @@ def trigger_xlink_price_update(logger, env="LIVE", company_id=None, run_all=Fals
 
 
 
+# ------------------------------------------------------------
+# Run-level Radius prefetch (existing Job P4 -> PO -> SO P2 -> Job P2)
+# ------------------------------------------------------------
+def prefetch_radius_links(ro_conn, sorders: list[int]) -> dict:
+    """
+    Resolves the records Phase 1 looks up per order in a handful of set-based queries:
+      job_p4      {so4: jobcode}
+      po_by_job   {jobcode: po}
+      so_by_po    {po: so_p2}
+      job_p2      {so_p2: jobcode}
+    Only positive hits are stored; a miss still falls back to the live lookup in
+    process_one_order (the record may have been created since the prefetch).
+    """
+    links = {"job_p4": {}, "po_by_job": {}, "so_by_po": {}, "job_p2": {}}
+    if not sorders:
+        return links
+
+    links["job_p4"] = find_existing_jobs_p4(ro_conn, sorders)
+    links["po_by_job"] = find_existing_pos_by_jobs(ro_conn, list(links["job_p4"].values()))
+    links["so_by_po"] = find_existing_sos_by_pos(ro_conn, list(links["po_by_job"].values()))
+    links["job_p2"] = find_existing_jobs_p2(ro_conn, list(links["so_by_po"].values()))
+
+    log.info(
+        f"[Prefetch] orders={len(sorders)} job_p4={len(links['job_p4'])} po={len(links['po_by_job'])} "
+        f"so_p2={len(links['so_by_po'])} job_p2={len(links['job_p2'])}"
+    )
+    return links
+
+
+def _prefetched(prefetch: Optional[dict], name: str, key, live_lookup):
+    hit = ((prefetch or {}).get(name) or {}).get(key)
+    if hit is not None:
+        return hit
+    return live_lookup()
+
+
+# ------------------------------------------------------------
+# Deferred verify queue (instead of sleeping inside the order)
+# ------------------------------------------------------------
+def _defer_order(run_id: str, sordernum: int, kind: str, ref, msg: str, prefetch: Optional[dict] = None,
+                 delay_s: Optional[int] = None, step: Optional[str] = None, **ids):
+    """
+    Parks the order until Radius shows `ref` and raises WorkflowDeferred.
+    run_deferred_checks() re-checks parked orders in batch and resumes them.
+    delay_s / step default to DEFERRED_RECHECK_SECONDS / "<kind>_VERIFY_PENDING".
+
+    Returns (no exception) once the order has used up DEFERRED_MAX_ATTEMPTS,
+    so the caller falls back to its old behavior for data that never showed up.
+    """
+    give_up = (prefetch or {}).get("deferred_give_up") or set()
+    if sordernum in give_up or get_deferred_attempts(sordernum, kind) >= DEFERRED_MAX_ATTEMPTS:
+        clear_deferred_check(sordernum)
+        log.warning(f"[Deferred] SO {sordernum}: {kind} still not visible after {DEFERRED_MAX_ATTEMPTS} checks. {msg}")
+        return
+
+    step = step or f"{kind}_VERIFY_PENDING"
+    upsert_order_state(
+        sordernum,
+        "IN_PROGRESS",
+        step,
+        last_run_id=run_id,
+        last_error_summary=msg,
+        **ids,
+    )
+    mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
+    # ✅ Pending step durable before the parked row: maintenance keeps rows of waiting orders only
+    flush_order_writes()
+    delay = DEFERRED_RECHECK_SECONDS if delay_s is None else delay_s
+    attempts = park_deferred_check(sordernum, kind, ref, run_id, delay)
+    raise WorkflowDeferred(f"{msg} Parked for re-check ({attempts}/{DEFERRED_MAX_ATTEMPTS}).", kind=kind, ref=ref)
+
+
+def _batched_create(prefetch: Optional[dict], kind: str, request: dict, run_id: str, sordernum: int, **ids):
+    """
+    Batched create for one order (services/batch_create.py). Returns the created
+    record number, raises the order's own create error, or parks the order until
+    the batch is flushed. Returns None when batching is off or the order has been
+    parked too often; the caller then creates the record itself.
+    """
+    batcher = (prefetch or {}).get("create_batcher")
+    if batcher is None:
+        return None
+
+    key = request[batch_create.KINDS[kind][1]]
+    outcome = batcher.result(kind, key)
+    if isinstance(outcome, Exception):
+        raise outcome
+    if outcome is not None:
+        return outcome
+
+    batcher.add(kind, request)
+    _defer_order(
+        run_id, sordernum, f"{kind}_BATCH", key,
+        f"{kind} create for {key} queued for the next batch.",
+        prefetch, delay_s=0, step=f"{kind}_BATCH_PENDING", **ids,
+    )
+    batcher.discard(kind, key)
+    return None
+
+
 # ------------------------------------------------------------
 # Process ONE LWS Sales Order
 # ------------------------------------------------------------
-def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
+def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int, prefetch: Optional[dict] = None):
+    # ✅ State + run_orders writes are buffered per order and committed together
+    # at step boundaries (after records are created in Radius) and always on exit.
+    with order_unit_of_work(), change_log_writer():
+        return _process_one_order_steps(ro_conn, rw_conn, run_id, sordernum, prefetch)
+
+
+def _process_one_order_steps(ro_conn, rw_conn, run_id: str, sordernum: int, prefetch: Optional[dict] = None):
     if is_order_complete(sordernum):
         log.debug(f"SO {sordernum} already COMPLETE in state DB - skipping")
         mark_run_order(run_id, sordernum, "SKIPPED", "ALREADY_COMPLETE")
@@ -963,11 +1080,16 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
         # STEP 1: JOB CREATION – PLANT 4
         # ----------------------------------------------------
         step = "JOB_P4"
-        job_p4 = find_existing_job_p4(ro_conn, sordernum)
+        job_p4 = _prefetched(
+            prefetch, "job_p4", int(sordernum),
+            lambda: find_existing_job_p4(ro_conn, sordernum),
+        )
 
         if not job_p4:
             try:
-                job_p4 = create_job_p4(sordernum, customer, log)
+                job_p4 = _batched_create(
+                    prefetch, "JOB_P4", dict(sordernum=int(sordernum), customer=customer), run_id, sordernum,
+                ) or create_job_p4(sordernum, customer, log)
             except JobHoldP4 as e:
                 msg = str(e).strip()
                 upsert_order_state(
@@ -989,6 +1111,10 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
         )
         mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
 
+        # Step boundary: job is durable before film validation / Phase2 updates
+        # (they email and update Radius and read this order's state row directly)
+        flush_order_writes()
+
         # ----------------------------------------------------
         # STEP 2: FETCH REQUIREMENTS FROM PV_Req
         # ----------------------------------------------------
@@ -1121,19 +1247,28 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
             # 3a: POLYTEX PO (PLANT 4) – by JobCode
             # ----------------------------------------------
             step = "PO_P4"
-            po_existing = find_existing_po_by_job(ro_conn, job_p4)
+            po_existing = _prefetched(
+                prefetch, "po_by_job", str(job_p4),
+                lambda: find_existing_po_by_job(ro_conn, job_p4),
+            )
             if po_existing:
                 po_num = po_existing
             else:
-                po_num = create_polytex_po(
-                    conn=rw_conn,
-                    jobcode=job_p4,
-                    itemcode=base_item,
-                    qty=qty,
-                    required_date=required_date,
-                    dim_a=dim_a,
-                    logger=log,
+                po_num = _batched_create(
+                    prefetch, "PO_P4",
+                    dict(jobcode=str(job_p4), itemcode=base_item, qty=qty, required_date=required_date, dim_a=dim_a),
+                    run_id, sordernum, job_p4=job_p4,
                 )
+                if po_num is None:
+                    po_num = create_polytex_po(
+                        conn=rw_conn,
+                        jobcode=job_p4,
+                        itemcode=base_item,
+                        qty=qty,
+                        required_date=required_date,
+                        dim_a=dim_a,
+                        logger=log,
+                    )
 
             last_po = po_num
 
@@ -1146,6 +1281,8 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
                 po_p4=po_num,
             )
             mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
+            if not po_existing:
+                flush_order_writes()
 
             # ----------------------------------------------
             # 3b: STARPAK SO (PLANT 2) – AddtCustRef = PO
@@ -1168,31 +1305,49 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
                 raise WorkflowHold(f"StarPak item {fg_item} not APP (status={fg_status}). Waiting for approval.")
 
 
-            so_existing = find_existing_so_by_po(ro_conn, po_num)
+            so_existing = _prefetched(
+                prefetch, "so_by_po", int(po_num),
+                lambda: find_existing_so_by_po(ro_conn, po_num),
+            )
 
             if so_existing:
                 so_num = int(so_existing)
                 log.debug(f"Existing Plant2 SO found for PO {po_num}: SO={so_num} (skip create)")
             else:
-                so_num = create_starpak_so(
-                    conn=rw_conn,
-                    pordernum=po_num,
-                    custref_value=p4_custref,
-                    itemcode_1600=fg_item,
-                    qty=qty,
-                    required_date=required_date,
-                    so_item_type_code=p4_so_item_type_code,
-                    logger=log,
+                so_num = _batched_create(
+                    prefetch, "SO_P2",
+                    dict(
+                        pordernum=int(po_num), custref_value=p4_custref, itemcode_1600=fg_item, qty=qty,
+                        required_date=required_date, so_item_type_code=p4_so_item_type_code,
+                    ),
+                    run_id, sordernum, job_p4=job_p4, po_p4=po_num,
                 )
+                if so_num is None:
+                    so_num = create_starpak_so(
+                        conn=rw_conn,
+                        pordernum=po_num,
+                        custref_value=p4_custref,
+                        itemcode_1600=fg_item,
+                        qty=qty,
+                        required_date=required_date,
+                        so_item_type_code=p4_so_item_type_code,
+                        logger=log,
+                    )
 
             force_starpak_so_authorized(rw_conn, so_num, log)
 
-            so_status = None
-            for _ in range(10):
-                so_status = get_so_status_p2(ro_conn, so_num)
-                if so_status is not None:
-                    break
-                time.sleep(1)
+            # ✅ No per-order polling: read the status once (or take it from the batched
+            # re-check). If Radius doesn't show it yet, park the order and move on.
+            so_status = _prefetched(
+                prefetch, "so_status_p2", int(so_num),
+                lambda: get_so_status_p2(ro_conn, so_num),
+            )
+            if so_status is None:
+                _defer_order(
+                    run_id, sordernum, "SO_P2_STATUS", so_num,
+                    f"StarPak SO {so_num} status not visible yet after force authorize.",
+                    prefetch, job_p4=job_p4, po_p4=po_num, so_p2=so_num,
+                )
 
             log.debug(f"StarPak SO {so_num} status after force authorize: {so_status}")
 
@@ -1246,6 +1401,8 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
                 last_run_id=run_id,
             )
             mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
+            if not so_existing:
+                flush_order_writes()
 
             # ----------------------------------------------
             # 3b-1: SHIPPING REQUEST (PLANT 2)
@@ -1264,7 +1421,14 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
             mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
 
             try:
-                shipreq_num = create_shipreq_for_so_p2(ro_conn, so_num, logger=log)
+                # A batched JOB_P2 create parks the order after this step: the resumed
+                # order reuses the ShipReq instead of racing Radius visibility
+                shipreq_num = _prefetched(
+                    prefetch, "shipreq_p2", int(so_num),
+                    lambda: create_shipreq_for_so_p2(ro_conn, so_num, logger=log, line_retries=1),
+                )
+                if shipreq_num and prefetch and prefetch.get("shipreq_p2") is not None:
+                    prefetch["shipreq_p2"][int(so_num)] = shipreq_num
 
                 if shipreq_num:
                     upsert_order_state(
@@ -1275,12 +1439,19 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
                         so_p2=so_num,
                         shipreq_p2=str(shipreq_num),
                     )
+                    flush_order_writes()
 
             except Exception as e:
                 msg = str(e).strip()
                 low = msg.lower()
 
                 if "no plant2 so lines found" in low or "cannot create shipreq" in low:
+                    # Lines usually show up a few seconds after the SO is created
+                    _defer_order(
+                        run_id, sordernum, "SHIPREQ_LINES", so_num, msg,
+                        prefetch, job_p4=job_p4, po_p4=po_num, so_p2=so_num,
+                    )
+
                     upsert_order_state(
                         sordernum=sordernum,
                         status="HOLD",
@@ -1298,12 +1469,20 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
             # 3c: JOB CREATION – PLANT 2
             # ----------------------------------------------
             step = "JOB_P2"
-            job2_existing = find_existing_job_p2(ro_conn, so_num)
+            job2_existing = _prefetched(
+                prefetch, "job_p2", int(so_num),
+                lambda: find_existing_job_p2(ro_conn, so_num),
+            )
             if job2_existing:
                 job_p2 = job2_existing
             else:
                 try:
-                    job_p2 = create_job_p2(so_num, customer, log)
+                    job_p2 = _batched_create(
+                        prefetch, "JOB_P2", dict(sordernum=int(so_num), customer=customer), run_id, sordernum,
+                        job_p4=job_p4, po_p4=po_num, so_p2=so_num,
+                    ) or create_job_p2(so_num, customer, log)
+                except WorkflowDeferred:
+                    raise
                 except Exception as e:
                     msg = str(e).strip()
                     low = msg.lower()
@@ -1341,6 +1520,8 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
                 last_run_id=run_id,
             )
             mark_run_order(run_id, sordernum, "IN_PROGRESS", step)
+            if not job2_existing:
+                flush_order_writes()
 
         # ----------------------------------------------------
         # FINAL: MARK ORDER COMPLETE
@@ -1363,6 +1544,10 @@ def process_one_order(ro_conn, rw_conn, run_id: str, sordernum: int):
             f"JobP4={job_p4}, PO={last_po}, SO={last_so}, JobP2={last_job_p2}"
         )
 
+    except WorkflowDeferred as e:
+        log.debug(f"Order {sordernum} deferred at {step}: {e}")
+        raise
+
     except WorkflowHold as e:
         msg = str(e)
         log.debug(f"Order {sordernum} put on HOLD at {step}: {msg}")
@@ -1408,11 +1593,191 @@ def get_manual_queue_orders(limit: int = 25) -> list[int]:
 
 
 # ------------------------------------------------------------
-# RUN ONCE (called every 10 mins by scheduler)
+# PHASE 1 EXECUTION (sequential or worker pool)
 # ------------------------------------------------------------
-def run_once():
-    init_state_db()
+def _process_order_outcome(ro_conn, rw_conn, run_id: str, sordernum: int, prefetch: Optional[dict] = None) -> str:
+    """
+    Runs one order and classifies the result: OK / DEFERRED / HOLD / FAILED.
+    process_one_order already records HOLD/FAILED state for the order itself.
+    """
+    try:
+        process_one_order(ro_conn, rw_conn, run_id, sordernum, prefetch=prefetch)
+        return "OK"
+    except WorkflowDeferred:
+        return "DEFERRED"
+    except WorkflowHold:
+        return "HOLD"
+    except Exception as e:
+        log.debug(f"[Phase1] SO {sordernum} failed: {e}")
+        return "FAILED"
+
+
+def run_phase1_orders(
+    ro_conn,
+    rw_conn,
+    run_id: str,
+    sorders: list[int],
+    workers: int = PHASE1_WORKERS,
+    prefetch: Optional[dict] = None,
+) -> dict:
+    """
+    Processes Phase 1 orders and returns {"processed", "held", "failed", "deferred"} counts.
+
+    workers <= 1 keeps the original sequential behavior on the run's connections.
+    workers > 1 uses a bounded thread pool; every worker thread opens its own
+    Radius RO/RW connections (pyodbc connections are not shared across threads)
+    and process_one_order opens its own SQLite handle, so one order's HOLD/FAILED
+    never touches another order. Counters are only aggregated on this thread.
+    """
+    counts = {"processed": 0, "held": 0, "failed": 0, "deferred": 0}
+
+    def _count(outcome: str):
+        counts["processed"] += 1
+        if outcome == "HOLD":
+            counts["held"] += 1
+        elif outcome == "FAILED":
+            counts["failed"] += 1
+        elif outcome == "DEFERRED":
+            counts["deferred"] += 1
+
+    if workers <= 1 or len(sorders) <= 1:
+        for sordernum in sorders:
+            _count(_process_order_outcome(ro_conn, rw_conn, run_id, sordernum, prefetch))
+        return counts
+
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def _worker(sordernum: int) -> str:
+        conns = getattr(local, "conns", None)
+        if conns is None:
+            try:
+                conns = (get_readonly_conn(), get_db_conn())
+            except Exception as e:
+                log.error(f"[Phase1] Worker could not open Radius connections for SO {sordernum}: {e}")
+                return "FAILED"
+            local.conns = conns
+            with opened_lock:
+                opened.append(conns)
+            ctx = run_context.current()
+            if ctx is not None:
+                ctx.bind(conns[0])  # read cache only on the read-only connection
+        return _process_order_outcome(conns[0], conns[1], run_id, sordernum, prefetch)
+
+    pool_size = min(int(workers), len(sorders))
+    log.info(f"[Phase1] Processing {len(sorders)} orders with {pool_size} workers")
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="phase1") as pool:
+            futures = {pool.submit(_worker, so): so for so in sorders}
+            for fut in as_completed(futures):
+                try:
+                    outcome = fut.result()
+                except Exception as e:
+                    log.error(f"[Phase1] Worker crashed for SO {futures[fut]}: {e}")
+                    outcome = "FAILED"
+                _count(outcome)
+    finally:
+        ctx = run_context.current()
+        for ro, rw in opened:
+            if ctx is not None:
+                ctx.unbind(ro)
+            for c in (ro, rw):
+                try:
+                    c.close()
+                except Exception:
+                    pass
+
+    return counts
+
+
+def run_deferred_checks(ro_conn, rw_conn, run_id: str, prefetch: Optional[dict] = None) -> dict:
+    """
+    Re-checks the orders parked during this run with one Radius query per kind
+    (SO status / SO lines) and resumes the ones whose data is visible now.
+
+    Orders still waiting after DEFERRED_MAX_ATTEMPTS are resumed as well so
+    process_one_order applies its fallback (continue without PO confirm /
+    HOLD SHIPREQ_P2_WAIT_LINES). Returns {"resumed", "held", "failed", "waiting"}.
+    """
+    counts = {"resumed": 0, "held": 0, "failed": 0, "waiting": 0}
+
+    prefetch = dict(prefetch or {})
+    status_hints = dict(prefetch.get("so_status_p2") or {})
+    give_up = set(prefetch.get("deferred_give_up") or set())
+    prefetch["so_status_p2"] = status_hints
+    prefetch["deferred_give_up"] = give_up
+
+    batcher = prefetch.get("create_batcher")
+
+    # Every pass either resumes an order or counts an attempt against it
+    # (resumed orders may queue the next batched create, hence the extra passes)
+    for _ in range(DEFERRED_MAX_ATTEMPTS * 2 + 2 + len(batch_create.KINDS)):
+        parked = [r for r in get_deferred_checks() if r.get("run_id") == run_id]
+        if not parked:
+            break
+
+        # ✅ Create everything the parked orders queued, one XLink call per chunk
+        if batcher is not None and batcher.pending_count():
+            batcher.flush(ro_conn, log)
+
+        # One shared wait for the earliest due order (not one sleep per order)
+        wait_s = (datetime.fromisoformat(parked[0]["due_ts"]) - datetime.utcnow()).total_seconds()
+        if wait_s > 0:
+            time.sleep(min(wait_s, DEFERRED_RECHECK_SECONDS))
+
+        status_refs = {int(r["sordernum"]): int(r["ref"]) for r in parked if r["kind"] == "SO_P2_STATUS"}
+        line_refs = {int(r["sordernum"]): int(r["ref"]) for r in parked if r["kind"] == "SHIPREQ_LINES"}
+
+        statuses = get_so_statuses_p2(ro_conn, list(set(status_refs.values()))) if status_refs else {}
+        line_counts = get_so_line_counts_p2(ro_conn, list(set(line_refs.values()))) if line_refs else {}
+        status_hints.update(statuses)
+
+        ready, waiting = [], []
+        for r in parked:
+            so = int(r["sordernum"])
+            if so in status_refs:
+                seen = status_refs[so] in statuses
+            elif so in line_refs:
+                seen = line_refs[so] in line_counts
+            elif batcher is not None and str(r["kind"]).endswith("_BATCH"):
+                seen = batcher.has_result(str(r["kind"])[:-len("_BATCH")], r["ref"])
+            else:
+                seen = True  # unknown kind: let the order decide
+
+            if seen:
+                ready.append(so)
+            elif int(r["attempts"] or 0) >= DEFERRED_MAX_ATTEMPTS:
+                give_up.add(so)
+                ready.append(so)
+            else:
+                waiting.append(so)
+
+        bump_deferred_checks(waiting, DEFERRED_RECHECK_SECONDS)
+        log.info(f"[Deferred] parked={len(parked)} resume={len(ready)} waiting={len(waiting)}")
+
+        if not ready:
+            continue
+
+        for so in ready:
+            clear_deferred_check(so)
+
+        c = run_phase1_orders(ro_conn, rw_conn, run_id, ready, prefetch=prefetch)
+        counts["resumed"] += len(ready)
+        counts["held"] += c["held"]
+        counts["failed"] += c["failed"]
 
+    counts["waiting"] = len([r for r in get_deferred_checks() if r.get("run_id") == run_id])
+    if counts["waiting"]:
+        log.info(f"[Deferred] {counts['waiting']} order(s) still waiting; picked up again next run.")
+    return counts
+
+
+# ------------------------------------------------------------
+# MAINTENANCE (archive / purge / HOLD reminders)
+# ------------------------------------------------------------
+def run_archive_and_purge():
     # ✅ Cleanup: archive old COMPLETE orders so monitoring list stays small
     from db import archive_old_complete_orders
 
@@ -1443,11 +1808,46 @@ def run_once():
     except Exception as e:
         log.warning(f"[MAINT] Purging run history failed (ignored): {e}")
 
+    # ✅ Cleanup: deferred verify rows whose order is no longer waiting
+    try:
+        from db import purge_stale_deferred_checks
+
+        stale = purge_stale_deferred_checks()
+        if stale:
+            log.info(f"[MAINT] Dropped {stale} stale deferred check(s).")
+    except Exception as e:
+        log.warning(f"[MAINT] Purging deferred checks failed (ignored): {e}")
 
+    # ✅ Cleanup: Phase 2 scheduler rows for orders no longer monitored
+    try:
+        from db import purge_monitor_checks
+
+        dropped = purge_monitor_checks()
+        if dropped:
+            log.info(f"[MAINT] Dropped {dropped} monitor schedule row(s).")
+    except Exception as e:
+        log.warning(f"[MAINT] Purging monitor schedule failed (ignored): {e}")
 
+    # ✅ Retention: change-log rollup, archived-order cascade, snapshot history, free pages
+    try:
+        from services.retention import run_retention
+
+        stats = run_retention() or {}
+        cascaded = sum((stats.get("archived_cascade") or {}).values())
+        if stats:
+            log.info(
+                f"[MAINT] Retention: change_log_rolled_up={stats.get('change_log_rolled_up', 0)}, "
+                f"archived_rows={cascaded}, snapshot_versions_trimmed={stats.get('snapshot_versions_trimmed', 0)}, "
+                f"pages_reclaimed={stats.get('reclaimed_pages', 0)}, free_pages={stats.get('free_pages', 0)}."
+            )
+    except Exception as e:
+        log.warning(f"[MAINT] Retention failed (ignored): {e}")
+
+
+def run_hold_reminders():
     # =====================================================
     # ✅ STEP 5: HOLD Aging reminders + escalation
-    # Runs every time scheduler calls run_once()
+    # Runs every time scheduler calls run_once() (daemon: its own schedule)
     # =====================================================
     try:
         reminder_count, escalated_count = send_hold_reminders_if_needed()
@@ -1459,189 +1859,272 @@ def run_once():
         log.warning(f"[HOLD Reminder] Failed (ignored): {e}")
 
 
-    run_id = str(uuid.uuid4())
-    start_ts = datetime.now(timezone.utc).isoformat()
-
-    mark_run(
-        run_id=run_id,
-        start_ts=start_ts,
-        env=ENV,
-        log_file_path="logs/lws_workflow.log",
-    )
-
-    eligible = processed = failed = held = 0
+def run_maintenance():
+    run_archive_and_purge()
+    run_hold_reminders()
 
 
-    ro_conn = get_readonly_conn()
-    rw_conn = get_db_conn()
-    sqlite_conn = state_conn()
-    
+# =====================================================
+# 🔴 PHASE 2A – MONITOR COMPLETED ORDERS FOR SO4 QTY CHANGES
+# =====================================================
+def _phase2a_check_order(
+    ro_conn,
+    rw_conn,
+    sqlite_conn,
+    run_id: str,
+    so4: int,
+    lines: Optional[list] = None,
+    qty_changed: bool = True,
+    custref_check: bool = True,
+) -> bool:
+    """
+    Phase 2A for one monitored SO (qty monitor + CustRef monitor).
+    Returns True when the qty monitor raised a HOLD for this SO.
 
+    lines/qty_changed come from detect_so4_qty_changes_bulk; when the bulk diff
+    found nothing new for this SO the per-line qty detector is skipped.
+    custref_check=False leaves CustRef to run_phase2a's bulk monitor.
+    """
     try:
-        # =====================================================
-        # 🔴 PHASE 2A – MONITOR COMPLETED ORDERS FOR SO4 QTY CHANGES
-        # =====================================================
-        held_sos = set()
-
-        from db import get_orders_to_monitor
+        # ✅ GUARD: Phase2A must NOT overwrite StarPak HOLD states
+        state = _get_state_fields(sqlite_conn, int(so4))
+        if state and state.get("last_step") in (
+            "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
+            "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
+            "P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM",
+        ):
+            log.debug(
+                f"[Phase2A] SO {so4} already in StarPak HOLD ({state.get('last_step')}), skipping Phase2A."
+            )
+            return False
 
-        monitor_sos = set(get_orders_to_monitor(200))
-        log.debug(f"[Phase2A Monitor] checking {len(monitor_sos)} orders: {list(monitor_sos)[:10]}")
+        if lines is None:
+            lines = get_so_line_items_p4(ro_conn, so4)
+        if not lines:
+            return False
 
+        qty_hold_triggered = False
 
-        for so4 in monitor_sos:
-            try:
-                # ✅ GUARD: Phase2A must NOT overwrite StarPak HOLD states
-                state = _get_state_fields(sqlite_conn, int(so4))
-                if state and state.get("last_step") in (
-                    "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
-                    "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
-                    "P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM",
-                ):
-                    log.debug(
-                        f"[Phase2A] SO {so4} already in StarPak HOLD ({state.get('last_step')}), skipping Phase2A."
-                    )
-                    continue
+        # ✅ Qty Monitor (may HOLD)
+        try:
+            if qty_changed:
+                detect_so4_qty_changes_or_hold(
+                    sqlite_conn=sqlite_conn,
+                    run_id=run_id,
+                    so4_sordernum=so4,
+                    so_lines=lines,
+                    logger=log,
+                )
+        except WorkflowHold:
+            qty_hold_triggered = True
+            raise   # keep behavior unchanged (still HOLD)
 
-                lines = get_so_line_items_p4(ro_conn, so4)
-                if not lines:
-                    continue
+        finally:
+            # ✅ CustRef monitor runs regardless (even when qty HOLD happens)
+            if custref_check:
+                try:
+                    state = _get_state_fields(sqlite_conn, int(so4))
+                    log.debug(f"[Phase2 CustRef DEBUG] checking so4={so4} state={dict(state) if state else None}")
 
-                qty_hold_triggered = False
+                    so_p2 = (
+                        state.get("so_p2_num")
+                        or state.get("so_p2")
+                        if state else None
+                    )
 
-                # ✅ Qty Monitor (may HOLD)
-                try:
-                    detect_so4_qty_changes_or_hold(
+                    detect_so4_custref_changes_and_update_starpak(
                         sqlite_conn=sqlite_conn,
+                        ro_conn=ro_conn,
+                        rw_conn=rw_conn,
                         run_id=run_id,
                         so4_sordernum=so4,
-                        so_lines=lines,
-                        logger=log,
+                        so_p2=so_p2,
+                        force_authorize_func=force_starpak_so_authorized,
+                        logger=log
                     )
-                except WorkflowHold:
-                    qty_hold_triggered = True
-                    raise   # keep behavior unchanged (still HOLD)
-
-                finally:
-                    # ✅ CustRef monitor runs regardless (even when qty HOLD happens)
-                    try:
-                        state = _get_state_fields(sqlite_conn, int(so4))
-                        log.debug(f"[Phase2 CustRef DEBUG] checking so4={so4} state={dict(state) if state else None}")
-
-                        so_p2 = (
-                            state.get("so_p2_num")
-                            or state.get("so_p2")
-                            if state else None
-                        )
+                except Exception as e:
+                    log.warning(f"[Phase2 CustRef] Failed (ignored): {e}")
 
-                        detect_so4_custref_changes_and_update_starpak(
-                            sqlite_conn=sqlite_conn,
-                            ro_conn=ro_conn,
-                            rw_conn=rw_conn,
-                            run_id=run_id,
-                            so4_sordernum=so4,
-                            so_p2=so_p2,
-                            force_authorize_func=force_starpak_so_authorized,
-                            logger=log
-                        )
-                    except Exception as e:
-                        log.warning(f"[Phase2 CustRef] Failed (ignored): {e}")
+    except WorkflowHold as e:
+        # ✅ NEW GUARD: do not overwrite COMPLETE
+        state = _get_state_fields(sqlite_conn, int(so4))
+        if state and state.get("status") == "COMPLETE":
+            log.debug(f"[Phase2A] SO {so4} already COMPLETE, skipping HOLD overwrite.")
+            return True
+
+        # ✅ existing guard (keep this)
+        if state and state.get("last_step") in (
+            "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
+            "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
+        ):
+            log.debug(f"[Phase2A] SO {so4} already in StarPak HOLD state ({state.get('last_step')}), skipping overwrite.")
+            return True
+
+        # IMPORTANT: Phase2B needs job_p4_code to detect PV_Req changes after reconfirm
+        from services.job_p4 import find_existing_job_p4
+        job_p4 = find_existing_job_p4(ro_conn, so4)
 
+        upsert_order_state(
+            sordernum=so4,
+            status="HOLD",
+            last_step="SO4_QTY_CHANGED_WAIT_RECONFIRM",
+            last_run_id=run_id,
+            last_error_summary=str(e),
+            job_p4=str(job_p4) if job_p4 else None,   # ✅ store job code
+        )
 
+        mark_run_order(run_id, so4, "HOLD", "SO4_QTY_CHANGED_WAIT_RECONFIRM")
+        return True
 
+    return False
 
-            except WorkflowHold as e:
-                held_sos.add(so4)
-                held += 1
 
-                # ✅ NEW GUARD: do not overwrite COMPLETE
-                state = _get_state_fields(sqlite_conn, int(so4))
-                if state and state.get("status") == "COMPLETE":
-                    log.debug(f"[Phase2A] SO {so4} already COMPLETE, skipping HOLD overwrite.")
-                    continue
+def run_phase2a(ro_conn, rw_conn, sqlite_conn, run_id: str, monitor_sos) -> set:
+    """Runs Phase 2A over monitor_sos and returns the SOs held this run."""
+    held_sos = set()
+    monitor_sos = [int(so) for so in monitor_sos or []]
+    if not monitor_sos:
+        return held_sos
 
-                # ✅ existing guard (keep this)
-                if state and state.get("last_step") in (
-                    "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
-                    "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
-                ):
-                    log.debug(f"[Phase2A] SO {so4} already in StarPak HOLD state ({state.get('last_step')}), skipping overwrite.")
-                    continue
+    # ✅ One Radius query + one SQLite diff for the whole watch list
+    lines_by_so, changed_sos = detect_so4_qty_changes_bulk(sqlite_conn, ro_conn, monitor_sos, log)
 
-                # ✅ DO NOT overwrite if already in manual complete HOLD state
-                state = _get_state_fields(sqlite_conn, int(so4))
-                if state and state.get("last_step") in (
-                    "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
-                    "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
-                ):
-                    log.debug(f"[Phase2A] SO {so4} already in StarPak HOLD state ({state.get('last_step')}), skipping overwrite.")
-                    continue
+    # Same SOs the per-order CustRef monitor would see: has SO4 lines, not in a StarPak HOLD
+    states = _get_state_fields_bulk(sqlite_conn, monitor_sos)
+    custref_sos = [
+        so4 for so4 in monitor_sos
+        if lines_by_so.get(so4)
+        and (states.get(so4) or {}).get("last_step") not in (
+            "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
+            "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
+            "P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM",
+        )
+    ]
+
+    for so4 in monitor_sos:
+        # ✅ change-log rows for this SO are written in one executemany
+        with change_log_writer():
+            if _phase2a_check_order(
+                ro_conn, rw_conn, sqlite_conn, run_id, so4,
+                lines=lines_by_so.get(so4, []),
+                qty_changed=so4 in changed_sos,
+                custref_check=False,
+            ):
+                held_sos.add(so4)
 
-                # IMPORTANT: Phase2B needs job_p4_code to detect PV_Req changes after reconfirm
-                from services.job_p4 import find_existing_job_p4
-                job_p4 = find_existing_job_p4(ro_conn, so4)
+    # ✅ CustRef monitor for all of them at once (two header queries, only real diffs update StarPak)
+    try:
+        states = _get_state_fields_bulk(sqlite_conn, custref_sos)
+        results = detect_so4_custref_changes_bulk(
+            sqlite_conn=sqlite_conn,
+            ro_conn=ro_conn,
+            rw_conn=rw_conn,
+            run_id=run_id,
+            so_p2_by_so4={so4: (states.get(so4) or {}).get("so_p2") for so4 in custref_sos},
+            force_authorize_func=force_starpak_so_authorized,
+            logger=log,
+        )
+        for so4, res in results.items():
+            if isinstance(res, Exception):
+                log.warning(f"[Phase2 CustRef] Failed for SO {so4} (ignored): {res}")
+    except Exception as e:
+        log.warning(f"[Phase2 CustRef] Failed (ignored): {e}")
 
-                upsert_order_state(
-                    sordernum=so4,
-                    status="HOLD",
-                    last_step="SO4_QTY_CHANGED_WAIT_RECONFIRM",
-                    last_run_id=run_id,
-                    last_error_summary=str(e),
-                    job_p4=str(job_p4) if job_p4 else None,   # ✅ store job code
-                )
+    # ✅ Version the snapshots the checks above created/moved (next run skips on equal hash)
+    try:
+        versions = record_snapshot_versions(sqlite_conn, "SO4_LINES", monitor_sos, run_id)
+        versions += record_snapshot_versions(sqlite_conn, "SO4_HEADER", custref_sos, run_id)
+        if versions:
+            log.debug(f"[Phase2A] Recorded {versions} snapshot version(s).")
+    except Exception as e:
+        log.warning(f"[Phase2A] Recording snapshot versions failed (ignored): {e}")
+
+    return held_sos
+
+
+# =====================================================
+# 🟠 PHASE 2B – MONITOR HOLD ORDERS WAITING FOR POLYTEX RECONFIRM
+# If SO4 was changed and job was reconfirmed, PV_Req qty will change.
+# We detect that and then update PO + StarPak SO.
+# =====================================================
+def run_phase2b(ro_conn, rw_conn, sqlite_conn, run_id: str) -> tuple[int, int]:
+    """Returns (held, failed) counts."""
+    held = failed = 0
+
+    cur = sqlite_conn.cursor()
+    cur.execute("""
+        SELECT sordernum, job_p4_code
+        FROM lws_order_state
+        WHERE status = 'HOLD'
+          AND last_step = 'SO4_QTY_CHANGED_WAIT_RECONFIRM'
+        ORDER BY updated_ts DESC
+    """)
+    hold_polytex = cur.fetchall()
+
+    waiting = []
+    for row in hold_polytex:
+        so4 = int(row["sordernum"])
+        job_p4 = row["job_p4_code"]
 
-                mark_run_order(run_id, so4, "HOLD", "SO4_QTY_CHANGED_WAIT_RECONFIRM")
+        if not job_p4:
+            from services.job_p4 import find_existing_job_p4
+            job_p4 = find_existing_job_p4(ro_conn, so4)
+            if not job_p4:
+                log.warning(f"Phase2B: SO {so4} HOLD but job_p4_code missing and could not be found.")
+                continue
 
+            # Save it so next run doesn't need to re-find
+            upsert_order_state(
+                sordernum=so4,
+                status="HOLD",
+                last_step="SO4_QTY_CHANGED_WAIT_RECONFIRM",
+                last_run_id=run_id,
+                job_p4=str(job_p4),
+                last_error_summary="Recovered missing job_p4_code for Phase2B processing.",
+            )
 
+        waiting.append((so4, str(job_p4).strip()))
 
-        # =====================================================
-        # 🟠 PHASE 2B – MONITOR HOLD ORDERS WAITING FOR POLYTEX RECONFIRM
-        # If SO4 was changed and job was reconfirmed, PV_Req qty will change.
-        # We detect that and then update PO + StarPak SO.
-        # =====================================================
-        cur = sqlite_conn.cursor()
-        cur.execute("""
-            SELECT sordernum, job_p4_code
-            FROM lws_order_state
-            WHERE status = 'HOLD'
-              AND last_step = 'SO4_QTY_CHANGED_WAIT_RECONFIRM'
-            ORDER BY updated_ts DESC
-            LIMIT 200
-        """)
-        hold_polytex = cur.fetchall()
+    if not waiting:
+        return held, failed
 
-        from services.job_requirements import get_job_requirements
-        from services.phase2_qty_changes import apply_req_changes_to_po
-        
+    # ✅ Priority order + time budget; what doesn't fit waits for the next run
+    totals = {"held": 0, "failed": 0}
 
+    def _batch(batch):
+        h, f = _phase2b_check_batch(ro_conn, rw_conn, sqlite_conn, run_id, batch)
+        totals["held"] += h
+        totals["failed"] += f
 
-        for row in hold_polytex:
-            so4 = int(row["sordernum"])
-            job_p4 = row["job_p4_code"]
+    waiting = monitor_scheduler.prioritize("2B", waiting, so_of=lambda w: w[0])
+    monitor_scheduler.run_batched("2B", waiting, _batch, so_of=lambda w: w[0])
+    return totals["held"], totals["failed"]
 
-            if not job_p4:
-                from services.job_p4 import find_existing_job_p4
-                job_p4 = find_existing_job_p4(ro_conn, so4)
-                if not job_p4:
-                    log.warning(f"Phase2B: SO {so4} HOLD but job_p4_code missing and could not be found.")
-                    continue
 
-                # Save it so next run doesn't need to re-find
-                upsert_order_state(
-                    sordernum=so4,
-                    status="HOLD",
-                    last_step="SO4_QTY_CHANGED_WAIT_RECONFIRM",
-                    last_run_id=run_id,
-                    job_p4=str(job_p4),
-                    last_error_summary="Recovered missing job_p4_code for Phase2B processing.",
-                )
+def _phase2b_check_batch(ro_conn, rw_conn, sqlite_conn, run_id: str, waiting: list) -> tuple[int, int]:
+    """Phase 2B for a batch of (so4, job_p4) pairs. Returns (held, failed) counts."""
+    from services.phase2_qty_changes import apply_req_changes_to_po, find_changed_req_jobs
 
+    held = failed = 0
 
-            try:
-                # Pull current PV_Req rows for this PolyTex job (your JOB_REQ_SQL already filters P4-FILM)
-                from services.phase2_qty_changes import get_p4_film_requirements
+    # ✅ One PV_Req query + one snapshot diff for every waiting job;
+    # only jobs whose RequiredQty moved (or have no baseline yet) go further
+    try:
+        reqs_by_job, changed_jobs = find_changed_req_jobs(
+            sqlite_conn, ro_conn, [job for _, job in waiting], log
+        )
+    except Exception as e:
+        log.error(f"Phase2B: bulk PV_Req check failed: {e}")
+        return held, len(waiting)
+
+    for so4, job_p4 in waiting:
+        if job_p4 not in changed_jobs:
+            log.debug(f"[Phase2B] WAITING_POLYTEX_RECONFIRM: so4={so4} job={job_p4} (PV_Req unchanged)")
+            continue
 
-                reqs = get_p4_film_requirements(ro_conn, str(job_p4))
+        with change_log_writer():
+            try:
+                reqs = reqs_by_job.get(job_p4, [])
                 log.info(
                     f"[Phase2B FETCH] so4={so4} job={job_p4} rows={len(reqs)} "
                     f"groups={sorted({(r.get('ReqGroupCode') or r.get('reqgroupcode')) for r in (reqs or [])})}"
@@ -1676,38 +2159,74 @@ def run_once():
                 failed += 1
                 log.error(f"Phase2B: SO {so4} error while checking PV_Req changes: {e}")
 
-        
-        
-        
-        # =====================================================
-        # PHASE 2C – RELEASE ORDERS AFTER STARPAK RECONFIRM
-        # Condition: StarPak SO qty == StarPak JOB qty
-        # =====================================================
+    try:
+        record_snapshot_versions(sqlite_conn, "REQ_JOB", [job for _, job in waiting], run_id)
+    except Exception as e:
+        log.warning(f"[Phase2B] Recording snapshot versions failed (ignored): {e}")
 
-        log.debug("Phase2C block started...")
+    return held, failed
 
-        pending_release = (
-            get_orders_in_step("P2_SO_QTY_UPDATED_WAIT_RECONFIRM", limit=200)
-            + get_orders_in_step("P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED", limit=200)
-            + get_orders_in_step("P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM", limit=200)
-        )
 
+# =====================================================
+# PHASE 2C – RELEASE ORDERS AFTER STARPAK RECONFIRM
+# Condition: StarPak SO qty == StarPak JOB qty
+# =====================================================
+def run_phase2c(ro_conn, rw_conn, sqlite_conn, run_id: str) -> None:
+    log.debug("Phase2C block started...")
 
-        log.debug(f"Phase2C pending_release orders: {pending_release}")
+    pending_release = (
+        get_orders_in_step("P2_SO_QTY_UPDATED_WAIT_RECONFIRM", limit=None)
+        + get_orders_in_step("P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED", limit=None)
+        + get_orders_in_step("P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM", limit=None)
+    )
+
+
+    log.debug(f"Phase2C pending_release orders: {pending_release}")
+
+    # ✅ Priority order + time budget; what doesn't fit waits for the next run
+    pending_release = monitor_scheduler.prioritize("2C", pending_release)
+    monitor_scheduler.run_batched(
+        "2C", pending_release,
+        lambda batch: _phase2c_check_batch(ro_conn, rw_conn, sqlite_conn, run_id, batch),
+    )
 
-        for so4 in pending_release:
+
+def _phase2c_check_batch(ro_conn, rw_conn, sqlite_conn, run_id: str, pending_release: list) -> None:
+    """Phase 2C for a batch of SOs waiting for the StarPak reconfirm."""
+    # ✅ Evaluate every pending order from three set-based Radius queries;
+    # fall back to the per-order reference check if the batch load fails
+    try:
+        bulk_results = detect_starpak_reconfirm_or_complete_bulk(
+            sqlite_conn=sqlite_conn,
+            ro_conn=ro_conn,
+            rw_conn=rw_conn,
+            run_id=run_id,
+            so4_list=pending_release,
+            logger=log,
+        )
+    except Exception as e:
+        log.warning(f"Phase2C: batch check failed, falling back to per-order checks: {e}")
+        bulk_results = None
+
+    for so4 in pending_release:
+        with change_log_writer():
             try:
                 # ✅ Always record that Phase2C evaluated this order in THIS run
                 mark_run_order(run_id, so4, "IN_PROGRESS", "PHASE2C_CHECK")
 
-                released = detect_starpak_reconfirm_or_complete(
-                    sqlite_conn=sqlite_conn,
-                    ro_conn=ro_conn,
-                    rw_conn=rw_conn, 
-                    run_id=run_id,
-                    so4_sordernum=so4,
-                    logger=log,
-                )
+                if bulk_results is not None and int(so4) in bulk_results:
+                    released = bulk_results[int(so4)]
+                    if isinstance(released, Exception):
+                        raise released
+                else:
+                    released = detect_starpak_reconfirm_or_complete(
+                        sqlite_conn=sqlite_conn,
+                        ro_conn=ro_conn,
+                        rw_conn=rw_conn,
+                        run_id=run_id,
+                        so4_sordernum=so4,
+                        logger=log,
+                    )
 
                 # ✅ If COMPLETE, record it
                 if released:
@@ -1725,63 +2244,246 @@ def run_once():
                 log.warning(f"Phase2C: error while checking reconfirm for SO {so4}: {e}")
 
 
+# ------------------------------------------------------------
+# PHASE 1 candidate filtering
+# ------------------------------------------------------------
+def filter_phase1_candidates(sorders: list[int], held_sos: set) -> list[int]:
+    # ✅ One bulk state lookup for every candidate (instead of per-SO queries)
+    status_map = get_order_status_map(sorders)
+
+    def _status(so) -> str:
+        return ((status_map.get(int(so)) or {}).get("status") or "").strip().upper()
+
+    # Block Phase2 holds (from previous runs) + holds found this run
+    sorders = [so for so in sorders if not is_phase2_hold_state(status_map.get(int(so)))]
+    sorders = [so for so in sorders if so not in held_sos]
+
+    # Keep Phase1 behavior: never reprocess COMPLETE
+    sorders = [so for so in sorders if _status(so) != "COMPLETE"]
+
+    # Never process REMOVED (even if manual queued or eligible from Radius)
+    skipped = [so for so in sorders if _status(so) == "REMOVED"]
+    sorders = [so for so in sorders if _status(so) != "REMOVED"]
+    if skipped:
+        log.info(f"[REMOVED] Skipping removed orders: {skipped}")
+
+    return sorders
+
+
+# ------------------------------------------------------------
+# RUN ONCE (called every 10 mins by scheduler)
+# ------------------------------------------------------------
+def run_once(
+    orders: Optional[list[int]] = None,
+    qty_change_orders: Optional[list[int]] = None,
+    include_maintenance: bool = True,
+):
+    """
+    Scheduled run (no arguments): maintenance, Phase 2A/2B/2C monitor sweep,
+    then Phase 1 for every eligible SO. The daemon passes include_maintenance=False
+    and schedules maintenance as its own job.
+
+    Targeted run (outbox listener): only the given SOs are processed; global
+    maintenance, the monitor sweep and the full eligibility query are skipped.
+      orders            (NEW_ORDER)  -> Phase 1
+      qty_change_orders (QTY_CHANGE) -> Phase 2A if the SO is monitored, else Phase 1
+
+    Only one run at a time across processes (scheduled task, daemon, listener):
+    if another run holds the run lock this call logs and returns False.
+    The lease is renewed between phases and Phase 2 batches; if a renewal finds
+    the lock gone to another run, this run stops there and returns False.
+    """
+    init_state_db()
+
+    lock_owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    lock_ttl_s = RUN_LOCK_TTL_MINUTES * 60
+    if not acquire_run_lock(lock_owner, lock_ttl_s):
+        log.warning(f"[RunLock] Another run is still active ({get_run_lock()}), skipping this run.")
+        return False
+
+    def keepalive():
+        if not renew_run_lock(lock_owner, lock_ttl_s):
+            raise RunLockLost(f"Run lock lost to {get_run_lock()}")
+
+    try:
+        _run_once(orders, qty_change_orders, include_maintenance, keepalive)
+    except RunLockLost as e:
+        log.error(f"[RunLock] {e}; stopping this run.")
+        return False
+    finally:
+        release_run_lock(lock_owner)
+    return True
+
+
+def _run_once(
+    orders: Optional[list[int]],
+    qty_change_orders: Optional[list[int]],
+    include_maintenance: bool,
+    keepalive=lambda: None,
+):
+    targeted = orders is not None or qty_change_orders is not None
+
+    if include_maintenance and not targeted:
+        run_maintenance()
+        keepalive()
+
+
+    run_id = str(uuid.uuid4())
+    start_ts = datetime.now(timezone.utc).isoformat()
+
+    mark_run(
+        run_id=run_id,
+        start_ts=start_ts,
+        env=ENV,
+        log_file_path="logs/lws_workflow.log",
+    )
+
+    eligible = processed = failed = held = 0
+
+
+    ro_conn = get_readonly_conn()
+    rw_conn = get_db_conn()
+    sqlite_conn = state_conn()
+
+    # ✅ Run-scoped Radius read cache (read-only connection only)
+    run_ctx = run_context.start_run_context(run_id)
+    run_ctx.bind(ro_conn)
+    monitor_scheduler.start_run(keepalive=keepalive)
+    deferred_waiting = 0
+    poll = None
+    qty_unmonitored = []
+
+    try:
+        if targeted:
+            # =====================================================
+            # 🎯 TARGETED RUN – only the SOs reported by the outbox
+            # =====================================================
+            new_sos = [int(so) for so in (orders or [])]
+            qty_sos = [int(so) for so in (qty_change_orders or [])]
+            log.info(f"[Targeted Run] NEW_ORDER={new_sos} QTY_CHANGE={qty_sos}")
+
+            qty_state = get_order_status_map(qty_sos)
+            phase2a_sos = [so for so in qty_sos if is_monitored_state(qty_state.get(so))]
+
+            held_sos = run_phase2a(ro_conn, rw_conn, sqlite_conn, run_id, phase2a_sos)
+            held += len(held_sos)
+
+            # Not monitored yet (still in Phase 1) -> Phase 1 detects the qty change itself
+            candidates = list(dict.fromkeys(new_sos + [so for so in qty_sos if so not in phase2a_sos]))
+            sorders = filter_eligible_sorders(ro_conn, candidates)
 
+        else:
+            from db import get_orders_to_monitor, get_so4_needing_baseline
+            from services.change_poller import poll_changed_so4, commit_marks
+
+            monitor_sos = set(get_orders_to_monitor())
+
+            # ✅ Only SOs with a QTY_CHANGE event or touched in Radius since the last watermark
+            #    (+ not yet baselined, + not checked within the staleness bound) need Phase 2A;
+            #    a periodic full sweep reconciles the rest
+            poll = poll_changed_so4(ro_conn)
+            if poll and poll["so4"] is not None:
+                phase2a_sos = monitor_sos & (
+                    poll["so4"]
+                    | get_so4_needing_baseline(sqlite_conn, list(monitor_sos))
+                    | monitor_scheduler.stale_sos("2A", monitor_sos)
+                    | monitor_scheduler.pending_sos("2A", monitor_sos)
+                )
+                log.info(f"[Phase2A Monitor] {len(phase2a_sos)} of {len(monitor_sos)} monitored orders changed since last poll")
+            else:
+                phase2a_sos = monitor_sos
+            log.debug(f"[Phase2A Monitor] checking {len(phase2a_sos)} orders: {list(phase2a_sos)[:10]}")
+
+            # ✅ Priority order + time budget; what doesn't fit waits for the next run
+            phase2a_sos = monitor_scheduler.prioritize("2A", phase2a_sos, hot=(poll or {}).get("qty_lines") or ())
+            held_sos = set()
+            checked = monitor_scheduler.run_batched(
+                "2A", phase2a_sos,
+                lambda batch: held_sos.update(run_phase2a(ro_conn, rw_conn, sqlite_conn, run_id, batch)),
+            )
+            held += len(held_sos)
+            # Events of SOs outside Phase 2A stay Pending until Phase 1 has run
+            commit_marks(poll, skipped=set(phase2a_sos) - set(checked), handled=phase2a_sos)
+            keepalive()
 
-        # =====================================================
-        # 🔵 EXISTING LOGIC – DO NOT CHANGE (Phase 1 core)
-        # =====================================================
-        since = compute_eligibility_since()
+            p2b_held, p2b_failed = run_phase2b(ro_conn, rw_conn, sqlite_conn, run_id)
+            held += p2b_held
+            failed += p2b_failed
+            keepalive()
 
-        # ---- TEST ----
-        # sorders = [250001]
+            run_phase2c(ro_conn, rw_conn, sqlite_conn, run_id)
+            keepalive()
 
-        # ---- PROD ----
-        # ✅ Manual queued orders (Admin Run Now) ALWAYS go first
-        manual_sos = get_manual_queue_orders(limit=25)
-        if manual_sos:
-            log.debug(f"[Manual Queue] {len(manual_sos)} manual order(s) queued: {manual_sos}")
+            # =====================================================
+            # 🔵 EXISTING LOGIC – DO NOT CHANGE (Phase 1 core)
+            # =====================================================
+            since = compute_eligibility_since()
 
-        # ---- PROD ----
-        sorders = find_eligible_sorders(ro_conn, MAX_ORDERS_PER_RUN)
+            # ---- TEST ----
+            # sorders = [250001]
 
-        # ✅ Force manual orders into the run list (front of list)
-        # Remove duplicates and preserve priority
-        sorders = manual_sos + [so for so in sorders if so not in manual_sos]
+            # ---- PROD ----
+            # ✅ Manual queued orders (Admin Run Now) ALWAYS go first
+            manual_sos = get_manual_queue_orders(limit=25)
+            if manual_sos:
+                log.debug(f"[Manual Queue] {len(manual_sos)} manual order(s) queued: {manual_sos}")
 
-        # ✅ Always include manual orders even if eligible list is full
-        sorders = sorders[:MAX_ORDERS_PER_RUN]
+            # ---- PROD ----
+            sorders = find_eligible_sorders(ro_conn, MAX_ORDERS_PER_RUN)
 
+            # ✅ QTY_CHANGE events for SOs not monitored yet -> Phase 1 (same as a targeted run)
+            qty_unmonitored = [so for so in ((poll or {}).get("qty_lines") or {}) if so not in monitor_sos]
+            if qty_unmonitored:
+                sorders += [so for so in filter_eligible_sorders(ro_conn, qty_unmonitored) if so not in sorders]
 
+            # ✅ Force manual orders into the run list (front of list)
+            # Remove duplicates and preserve priority
+            sorders = manual_sos + [so for so in sorders if so not in manual_sos]
 
-        # Block Phase2 holds (from previous runs) + holds found this run
-        phase2_blocked = get_phase2_held_orders()
-        sorders = [so for so in sorders if so not in phase2_blocked]
-        sorders = [so for so in sorders if so not in held_sos]
+            # ✅ Always include manual orders even if eligible list is full
+            sorders = sorders[:MAX_ORDERS_PER_RUN]
 
-        # Keep Phase1 behavior: never reprocess COMPLETE
-        sorders = [so for so in sorders if not is_order_complete(so)]
 
-        # Never process REMOVED (even if manual queued or eligible from Radius)
-        before = list(sorders)
-        sorders = [so for so in sorders if not is_order_removed(so)]
-        skipped = [so for so in before if so not in sorders]
-        if skipped:
-            log.info(f"[REMOVED] Skipping removed orders: {skipped}")
+        sorders = filter_phase1_candidates(sorders, held_sos)
 
         eligible = len(sorders)
 
-        for sordernum in sorders:
-            processed += 1
-            try:
-                process_one_order(ro_conn, rw_conn, run_id, sordernum)
-            except WorkflowHold:
-                held += 1
-            except Exception:
-                failed += 1
+        # ✅ Resolve existing Radius records for all candidates up front
+        try:
+            prefetch = prefetch_radius_links(ro_conn, sorders)
+        except Exception as e:
+            log.warning(f"[Prefetch] Failed (falling back to per-order lookups): {e}")
+            prefetch = None
+
+        # ✅ New records for this run's orders are created in batches (see services/batch_create.py)
+        if BATCH_CREATE_ENABLED:
+            prefetch = dict(prefetch or {})
+            prefetch["create_batcher"] = batch_create.CreateBatcher()
+            prefetch["shipreq_p2"] = {}
+
+        keepalive()
+        counts = run_phase1_orders(ro_conn, rw_conn, run_id, sorders, prefetch=prefetch)
+        processed += counts["processed"]
+        held += counts["held"]
+        failed += counts["failed"]
+
+        if qty_unmonitored:
+            from services.change_poller import ack_events
+
+            ack_events(poll, qty_unmonitored)
+
+        # ✅ Orders parked waiting for Radius (new SO status / lines): batched re-check
+        if counts["deferred"]:
+            keepalive()
+            deferred = run_deferred_checks(ro_conn, rw_conn, run_id, prefetch)
+            held += deferred["held"]
+            failed += deferred["failed"]
+            deferred_waiting = deferred["waiting"]
 
 
 
     finally:
+        cache_stats = run_context.end_run_context(run_ctx)
         try:
             ro_conn.close()
         except Exception:
@@ -1796,7 +2498,18 @@ def run_once():
             pass
 
     end_ts = datetime.now(timezone.utc).isoformat()
-    close_run(run_id, end_ts, eligible, processed, failed)
+    skipped = monitor_scheduler.skipped_counts()
+    close_run(
+        run_id, end_ts, eligible, processed, failed, held=held,
+        skipped=sum(skipped.values()), deferred=deferred_waiting,
+    )
+    if skipped:
+        log.info(f"[Scheduler] Left for the next run: {skipped}")
+
+    log.info(f"[RunCache] {cache_stats}")
+
+    for pool_stats in radius_pool_stats():
+        log.info(f"[POOL] {pool_stats}")
 
     log.debug(
         f"Run {run_id} finished | "
@@ -1,4 +1,5 @@
 import os
+import threading
 from datetime import datetime, timezone
 import pyodbc
 import requests
@@ -34,6 +35,88 @@ RUN_EVERY_MINUTES = int(os.getenv("RUN_EVERY_MINUTES", "30"))
 ELIGIBLE_LOOKBACK_MINUTES = int(os.getenv("ELIGIBLE_LOOKBACK_MINUTES", "120"))  # buffer window
 MAX_ORDERS_PER_RUN = int(os.getenv("MAX_ORDERS_PER_RUN", "200"))
 
+# Phase 1 concurrency: number of orders processed in parallel (1 = sequential)
+# Each worker gets its own Radius RO/RW connections and SQLite handle.
+PHASE1_WORKERS = max(1, int(os.getenv("PHASE1_WORKERS", "1")))
+
+# Deferred verification: a new Plant 2 SO whose status/lines are not visible yet
+# is parked and re-checked in batch later in the run instead of sleeping per order.
+DEFERRED_RECHECK_SECONDS = int(os.getenv("DEFERRED_RECHECK_SECONDS", "2"))
+DEFERRED_MAX_ATTEMPTS = int(os.getenv("DEFERRED_MAX_ATTEMPTS", "5"))
+# Maintenance never drops a parked row touched within this window (a run may be parking it right now)
+DEFERRED_PURGE_GRACE_MINUTES = int(os.getenv("DEFERRED_PURGE_GRACE_MINUTES", "60"))
+
+# Batched creates: Phase 1 orders that need a new record queue it and park (deferred
+# queue); the records are then created BATCH_CREATE_SIZE orders per XLink call.
+BATCH_CREATE_ENABLED = os.getenv("BATCH_CREATE_ENABLED", "1") == "1"
+BATCH_CREATE_SIZE = max(1, int(os.getenv("BATCH_CREATE_SIZE", "20")))
+
+# Phase 2A incremental polling: only SO4s Radius touched since the last
+# LastUpdatedDateTime high-water mark (minus an overlap) are re-checked,
+# with a periodic full sweep as a safety net.
+WATERMARK_POLLING_ENABLED = os.getenv("WATERMARK_POLLING_ENABLED", "1") == "1"
+WATERMARK_OVERLAP_MINUTES = int(os.getenv("WATERMARK_OVERLAP_MINUTES", "10"))
+WATERMARK_FULL_SWEEP_MINUTES = int(os.getenv("WATERMARK_FULL_SWEEP_MINUTES", "360"))
+
+# Phase 2 monitor scheduler: each phase gets a wall-clock budget (0 = no limit) and
+# works through its list by priority in batches; whatever is left waits for the next
+# run. Orders not checked for PHASE2_MAX_STALENESS_MINUTES always go first.
+PHASE2A_BUDGET_SECONDS = int(os.getenv("PHASE2A_BUDGET_SECONDS", "300"))
+PHASE2B_BUDGET_SECONDS = int(os.getenv("PHASE2B_BUDGET_SECONDS", "180"))
+PHASE2C_BUDGET_SECONDS = int(os.getenv("PHASE2C_BUDGET_SECONDS", "180"))
+PHASE2_BATCH_SIZE = max(1, int(os.getenv("PHASE2_BATCH_SIZE", "50")))
+PHASE2_MAX_STALENESS_MINUTES = int(os.getenv("PHASE2_MAX_STALENESS_MINUTES", "120"))
+
+# Cross-process run lock lease, renewed between phases and Phase 2 batches
+# (a crashed run frees the lock after this long)
+RUN_LOCK_TTL_MINUTES = int(os.getenv("RUN_LOCK_TTL_MINUTES", "90"))
+
+# Radius ODBC connection pool (separate read-only and read-write pools)
+RADIUS_POOL_ENABLED = os.getenv("RADIUS_POOL_ENABLED", "1") == "1"
+RADIUS_POOL_MIN = int(os.getenv("RADIUS_POOL_MIN", "1"))
+RADIUS_POOL_MAX = int(os.getenv("RADIUS_POOL_MAX", str(max(8, PHASE1_WORKERS + 2))))
+RADIUS_POOL_MAX_AGE_SECONDS = int(os.getenv("RADIUS_POOL_MAX_AGE_SECONDS", "1800"))
+
+# XLink adapter in-flight limits: total concurrent posts (also the HTTP connection
+# pool size) and per-entity caps, e.g. "AdvancedOrderProcessing=2,XLinkAPISOrder=4".
+# Entities not listed only share the total.
+XLINK_MAX_IN_FLIGHT = max(1, int(os.getenv("XLINK_MAX_IN_FLIGHT", str(max(8, PHASE1_WORKERS)))))
+XLINK_ENTITY_LIMITS = {
+    k.strip(): max(1, int(v))
+    for k, v in (
+        pair.split("=", 1)
+        for pair in os.getenv(
+            "XLINK_ENTITY_LIMITS",
+            "AdvancedOrderProcessing=2,XLinkAPIPOrder=4,XLinkAPISOrder=4,XLinkAPIShipReq=4",
+        ).split(",")
+        if "=" in pair
+    )
+}
+RADIUS_POOL_WAIT_SECONDS = int(os.getenv("RADIUS_POOL_WAIT_SECONDS", "60"))
+RADIUS_POOL_PING_SQL = os.getenv(
+    "RADIUS_POOL_PING_SQL",
+    'SELECT 1 FROM "SYSPROGRESS"."SYSCALCTABLE"',
+)
+
+# Daemon (daemon.py) job intervals; run_once itself uses RUN_EVERY_MINUTES
+DAEMON_MAINTENANCE_MINUTES = int(os.getenv("DAEMON_MAINTENANCE_MINUTES", "60"))
+DAEMON_HOLD_REMINDER_MINUTES = int(os.getenv("DAEMON_HOLD_REMINDER_MINUTES", "60"))
+DAEMON_OUTBOX_POLL_SECONDS = int(os.getenv("DAEMON_OUTBOX_POLL_SECONDS", "30"))
+DAEMON_OUTBOX_ENABLED = os.getenv("DAEMON_OUTBOX_ENABLED", "1") == "1"
+
+# LWS_Workflow_Outbox (trigger-fed change events). OUTBOX_BACKEND=sqlite uses the
+# lws_workflow_outbox stand-in table in the state DB for local testing.
+OUTBOX_BACKEND = os.getenv("OUTBOX_BACKEND", "sqlserver").lower()
+OUTBOX_SQL_SERVER = os.getenv("OUTBOX_SQL_SERVER", "PRO2SQL")
+OUTBOX_DB_NAME = os.getenv("OUTBOX_DB_NAME", "VisionIIProd")
+OUTBOX_DB_USER = os.getenv("OUTBOX_DB_USER", "odbcuser")
+OUTBOX_DB_PASS = os.getenv("OUTBOX_DB_PASS", "odbcpass")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+
+# Phase 2A takes pending QTY_CHANGE outbox events as its change signal
+# (the periodic full sweep still reconciles everything else)
+PHASE2A_OUTBOX_ENABLED = os.getenv("PHASE2A_OUTBOX_ENABLED", "1") == "1"
+
 # Lead time: StarPak needs printed film shipped to PolyTex
 REQUIRED_DATE_LEAD_DAYS = int(os.getenv("REQUIRED_DATE_LEAD_DAYS", "15"))
 
@@ -112,25 +195,84 @@ LOG_LEVEL = "INFO"   # change to "DEBUG" when needed
 
 # Local state DB (SQLite) - ALWAYS under project folder
 STATE_DB_PATH = os.path.join(BASE_DIR, "state.db")
+STATE_DB_CACHE_KB = int(os.getenv("STATE_DB_CACHE_KB", "16384"))             # page cache per connection
+STATE_DB_BUSY_TIMEOUT_MS = int(os.getenv("STATE_DB_BUSY_TIMEOUT_MS", "30000"))  # wait for writers instead of failing
+
+# State DB retention (run by the maintenance job after archiving).
+# Deletes run in chunks of RETENTION_DELETE_CHUNK rows, one short transaction each.
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "1") == "1"
+RETENTION_CHANGE_LOG_DAYS = int(os.getenv("RETENTION_CHANGE_LOG_DAYS", "180"))            # older rows of unmonitored orders -> rollup
+RETENTION_ARCHIVED_GRACE_DAYS = int(os.getenv("RETENTION_ARCHIVED_GRACE_DAYS", "7"))      # snapshots kept this long after archiving
+RETENTION_SNAPSHOT_VERSIONS_DAYS = int(os.getenv("RETENTION_SNAPSHOT_VERSIONS_DAYS", "90"))
+RETENTION_SNAPSHOT_VERSIONS_KEEP = max(1, int(os.getenv("RETENTION_SNAPSHOT_VERSIONS_KEEP", "10")))  # newest versions always kept
+RETENTION_DELETE_CHUNK = max(1, int(os.getenv("RETENTION_DELETE_CHUNK", "500")))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "2000"))                # pages freed per maintenance pass (0 = off)
+RETENTION_CONVERT_AUTO_VACUUM = os.getenv("RETENTION_CONVERT_AUTO_VACUUM", "0") == "1"   # one-time full VACUUM of an old state.db
 
 # Eligibility start date (change anytime)
 LWS_ELIGIBILITY_START_DATE = "12/26/2025"
 
 
 # -------------- DB Helpers --------------
-def get_db_conn() -> pyodbc.Connection:
+def _radius_connect(autocommit: bool) -> pyodbc.Connection:
     return pyodbc.connect(
         f"DSN={DSN};UID={DB_USER};PWD={DB_PASS}",
-        autocommit=False,
+        autocommit=autocommit,
         timeout=30,
     )
 
+
+_RADIUS_POOLS = {}
+_RADIUS_POOLS_LOCK = threading.Lock()
+
+
+def _radius_pool(kind: str):
+    """Lazily creates the 'ro' / 'rw' pool (db_pool imports logger, which imports config)."""
+    pool = _RADIUS_POOLS.get(kind)
+    if pool is not None:
+        return pool
+
+    with _RADIUS_POOLS_LOCK:
+        pool = _RADIUS_POOLS.get(kind)
+        if pool is None:
+            from db_pool import ConnectionPool
+
+            autocommit = (kind == "ro")
+            pool = ConnectionPool(
+                name=kind,
+                connect_func=lambda: _radius_connect(autocommit),
+                min_size=RADIUS_POOL_MIN,
+                max_size=RADIUS_POOL_MAX,
+                max_age_s=RADIUS_POOL_MAX_AGE_SECONDS,
+                wait_timeout_s=RADIUS_POOL_WAIT_SECONDS,
+                ping_sql=RADIUS_POOL_PING_SQL,
+            )
+            _RADIUS_POOLS[kind] = pool
+    return pool
+
+
+def get_db_conn() -> pyodbc.Connection:
+    if not RADIUS_POOL_ENABLED:
+        return _radius_connect(autocommit=False)
+    return _radius_pool("rw").acquire()
+
 def get_readonly_conn() -> pyodbc.Connection:
-    return pyodbc.connect(
-        f"DSN={DSN};UID={DB_USER};PWD={DB_PASS}",
-        autocommit=True,
-        timeout=30,
-    )
+    if not RADIUS_POOL_ENABLED:
+        return _radius_connect(autocommit=True)
+    return _radius_pool("ro").acquire()
+
+
+def radius_pool_stats() -> list[dict]:
+    """Checkout/wait stats for each Radius pool created in this process."""
+    return [p.stats() for _, p in sorted(_RADIUS_POOLS.items())]
+
+
+def close_radius_pools() -> None:
+    with _RADIUS_POOLS_LOCK:
+        pools = list(_RADIUS_POOLS.values())
+        _RADIUS_POOLS.clear()
+    for p in pools:
+        p.close()
 
 # -------------- HTTP Session --------------
 SESSION = requests.Session()
@@ -140,8 +282,9 @@ retries = Retry(
     status_forcelist=[502, 503, 504],
     allowed_methods=["POST"],
 )
-SESSION.mount("http://", HTTPAdapter(max_retries=retries))
-SESSION.mount("https://", HTTPAdapter(max_retries=retries))
+# ✅ One pooled connection per in-flight post (urllib3 keeps 10 by default)
+SESSION.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=max(10, XLINK_MAX_IN_FLIGHT)))
+SESSION.mount("https://", HTTPAdapter(max_retries=retries, pool_maxsize=max(10, XLINK_MAX_IN_FLIGHT)))
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,149 @@
+# lws_workflow/daemon.py
+"""
+Long-running LWS workflow process.
+
+run_lws_workflow.bat starts a new interpreter for every cycle (imports, state DB
+migrations, Radius connects). This keeps ONE process alive instead and runs the
+work as independent periodic jobs:
+
+  workflow      run_once()                every RUN_EVERY_MINUTES
+  outbox        targeted runs from outbox every DAEMON_OUTBOX_POLL_SECONDS
+  maintenance   archive + purge           every DAEMON_MAINTENANCE_MINUTES
+  reminders     HOLD aging reminders      every DAEMON_HOLD_REMINDER_MINUTES
+
+workflow and outbox share a lock so two runs never overlap (run_once also takes
+the state DB run lock, which keeps other processes out); maintenance and
+reminders run on their own threads and never block order processing.
+Ctrl+C / SIGTERM stops scheduling, lets running jobs finish, then closes the
+Radius pools and state DB connections.
+"""
+import signal
+import threading
+import time
+
+from config import (
+    ENV,
+    RUN_EVERY_MINUTES,
+    DAEMON_MAINTENANCE_MINUTES,
+    DAEMON_HOLD_REMINDER_MINUTES,
+    DAEMON_OUTBOX_POLL_SECONDS,
+    DAEMON_OUTBOX_ENABLED,
+    close_radius_pools,
+)
+from api import close_xlink_client
+from db import init_state_db, STATE_STORE
+from logger import get_logger
+
+log = get_logger("daemon")
+
+
+class PeriodicJob:
+    """Runs func every interval_s seconds on its own thread until stop_event is set."""
+
+    def __init__(self, name: str, interval_s: float, func, stop_event: threading.Event, lock=None):
+        self.name = name
+        self.interval_s = max(1.0, float(interval_s))
+        self.func = func
+        self.stop_event = stop_event
+        self.lock = lock
+        self.runs = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._loop, name=f"job-{name}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def join(self, timeout: float = None) -> None:
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        t0 = time.monotonic()
+        try:
+            if self.lock is not None:
+                with self.lock:
+                    if self.stop_event.is_set():
+                        return
+                    self.func()
+            else:
+                self.func()
+            self.runs += 1
+        except Exception as e:
+            self.failures += 1
+            log.exception(f"[Daemon] Job {self.name} failed: {e}")
+        finally:
+            log.debug(f"[Daemon] Job {self.name} took {time.monotonic() - t0:.1f}s")
+
+    def _loop(self) -> None:
+        next_run = time.monotonic()
+        while not self.stop_event.is_set():
+            wait_s = next_run - time.monotonic()
+            if wait_s > 0 and self.stop_event.wait(wait_s):
+                break
+
+            self._run()
+
+            # Fixed cadence; if a run overran, skip the missed slots instead of bunching up
+            next_run += self.interval_s
+            now = time.monotonic()
+            if next_run < now:
+                next_run = now + self.interval_s
+
+
+def _outbox_job():
+    from services.lws_outbox_listener import poll_outbox_once
+
+    poll_outbox_once()
+
+
+def main() -> None:
+    from app import run_once, run_archive_and_purge, run_hold_reminders
+
+    stop_event = threading.Event()
+
+    def _request_stop(signum, frame):
+        if not stop_event.is_set():
+            log.info(f"[Daemon] Signal {signum} received, finishing current jobs...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+    if hasattr(signal, "SIGBREAK"):  # Windows Ctrl+Break / service stop
+        signal.signal(signal.SIGBREAK, _request_stop)
+
+    init_state_db()
+
+    run_lock = threading.Lock()
+    jobs = [
+        PeriodicJob("workflow", RUN_EVERY_MINUTES * 60, lambda: run_once(include_maintenance=False), stop_event, run_lock),
+        PeriodicJob("maintenance", DAEMON_MAINTENANCE_MINUTES * 60, run_archive_and_purge, stop_event),
+        PeriodicJob("reminders", DAEMON_HOLD_REMINDER_MINUTES * 60, run_hold_reminders, stop_event),
+    ]
+    if DAEMON_OUTBOX_ENABLED:
+        jobs.append(PeriodicJob("outbox", DAEMON_OUTBOX_POLL_SECONDS, _outbox_job, stop_event, run_lock))
+
+    log.info(
+        f"[Daemon] Started ENV={ENV} jobs="
+        + ", ".join(f"{j.name}/{int(j.interval_s)}s" for j in jobs)
+    )
+
+    for job in jobs:
+        job.start()
+
+    # Main thread only waits for a stop signal (signals are delivered here)
+    while not stop_event.wait(1.0):
+        pass
+
+    for job in jobs:
+        job.join()
+
+    close_radius_pools()
+    close_xlink_client()
+    STATE_STORE.close_all()
+    log.info(
+        "[Daemon] Stopped. "
+        + ", ".join(f"{j.name}: runs={j.runs} failures={j.failures}" for j in jobs)
+    )
+
+
+if __name__ == "__main__":
+    main()
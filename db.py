@@ -1,13 +1,23 @@
 # db.py
 
+import hashlib
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Any, List, Dict, Optional, Tuple
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import json
 import pyodbc
 
-from config import STATE_DB_PATH, ELIGIBLE_LOOKBACK_MINUTES
+from config import (
+    STATE_DB_PATH,
+    ELIGIBLE_LOOKBACK_MINUTES,
+    STATE_DB_CACHE_KB,
+    STATE_DB_BUSY_TIMEOUT_MS,
+    DEFERRED_PURGE_GRACE_MINUTES,
+)
 from logger import get_logger
+import run_context
 
 log = get_logger("db")
 
@@ -77,11 +87,14 @@ def _table_columns(cur: sqlite3.Cursor, table: str) -> set[str]:
     return {row[1] for row in cur.fetchall()}
 
 
-def _ensure_column(cur: sqlite3.Cursor, table: str, column: str, col_type: str) -> None:
+def _ensure_column(cur: sqlite3.Cursor, table: str, column: str, col_type: str) -> bool:
+    """Adds the column if missing. Returns True when it was just added."""
     cols = _table_columns(cur, table)
     if column not in cols:
         log.info(f"DB MIGRATION: adding column {table}.{column} {col_type}")
         cur.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {col_type}')
+        return True
+    return False
 
 
 def get_order_status(sordernum: int) -> Optional[str]:
@@ -93,6 +106,59 @@ def get_order_status(sordernum: int) -> Optional[str]:
     conn.close()
     return (row["status"] if row and row["status"] else None)
 
+def _chunks(values: List[Any], size: int):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def get_order_status_map(sordernums: List[int], chunk_size: int = 500) -> Dict[int, Dict[str, Optional[str]]]:
+    """
+    Bulk classify SOs in one query per chunk (SQLite caps bound parameters).
+    Returns {sordernum: {"status": ..., "last_step": ...}} for SOs that exist in lws_order_state;
+    SOs with no state row are simply absent.
+    """
+    nums = sorted({int(x) for x in (sordernums or [])})
+    if not nums:
+        return {}
+
+    out: Dict[int, Dict[str, Optional[str]]] = {}
+    conn = state_conn()
+    try:
+        for chunk in _chunks(nums, chunk_size):
+            marks = ",".join("?" for _ in chunk)
+            rows = conn.execute(
+                f"SELECT sordernum, status, last_step FROM lws_order_state WHERE sordernum IN ({marks})",
+                tuple(chunk),
+            ).fetchall()
+            for r in rows:
+                out[int(r["sordernum"])] = {"status": r["status"], "last_step": r["last_step"]}
+    finally:
+        conn.close()
+    return out
+
+
+def is_phase2_hold_state(state: Optional[Dict[str, Optional[str]]]) -> bool:
+    """Phase2 HOLD steps that Phase1 must not re-complete (same rule as get_phase2_held_orders)."""
+    if not state:
+        return False
+    status = (state.get("status") or "").strip().upper()
+    step = (state.get("last_step") or "").strip()
+    return status == "HOLD" and (step.startswith("SO4_QTY_CHANGED_") or step.startswith("P2_"))
+
+
+def is_monitored_state(state: Optional[Dict[str, Optional[str]]]) -> bool:
+    """Same rule as get_orders_to_monitor(): orders Phase 2A watches for SO4 changes."""
+    if not state:
+        return False
+    status = (state.get("status") or "").strip().upper()
+    step = (state.get("last_step") or "").strip()
+    return status in ("COMPLETE", "HOLD") and (
+        step.startswith("SO4_QTY_CHANGED_")
+        or step.startswith("P2_")
+        or step in ("COMPLETE", "SO4_CUSTREF_UPDATED_STARPAK")
+    )
+
+
 def get_order_state_row(sordernum: int) -> Optional[sqlite3.Row]:
     conn = state_conn()
     row = conn.execute(
@@ -123,19 +189,65 @@ def is_order_complete(sordernum: int) -> bool:
     return (s or "").strip().upper() == "COMPLETE"
 
 
-def rquery(conn: pyodbc.Connection, sql: str, params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
+def rquery(
+    conn: pyodbc.Connection,
+    sql: str,
+    params: Tuple[Any, ...] = (),
+    cache_if: Optional[Callable[[List[Dict[str, Any]]], bool]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    cache_if(rows) -> False keeps a result out of the run cache, for reads that
+    poll until Radius has caught up (e.g. SO lines still without an ItemCode).
+    """
+    # ✅ Run-scoped read cache (only for read-only connections bound by run_once)
+    ctx = run_context.current()
+    if ctx is not None and ctx.is_bound(conn):
+        rows, generation = ctx.get(sql, params)
+        if rows is not None:
+            return rows
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = fetchall_dict(cur)
+        if cache_if is None or cache_if(rows):
+            ctx.put(sql, params, rows, generation)
+        return rows
+
     cur = conn.cursor()
     cur.execute(sql, params)
     return fetchall_dict(cur)
 
 
+def rquery_in(
+    conn: pyodbc.Connection,
+    sql_template: str,
+    values: List[Any],
+    params_before: Tuple[Any, ...] = (),
+    chunk_size: int = 200,
+    cache_if: Optional[Callable[[List[Dict[str, Any]]], bool]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Set-based rquery: runs sql_template once per chunk of values.
+    sql_template must contain "{marks}" where the IN (...) placeholders go, e.g.
+        WHERE so."SOrderNum" IN ({marks})
+    params_before are bound ahead of the IN values; cache_if is applied per chunk.
+    """
+    vals = list(dict.fromkeys(values or []))  # de-dupe, keep order
+    out: List[Dict[str, Any]] = []
+    for chunk in _chunks(vals, chunk_size):
+        marks = ",".join("?" for _ in chunk)
+        out.extend(rquery(conn, sql_template.format(marks=marks), tuple(params_before) + tuple(chunk), cache_if))
+    return out
+
+
 def rexec(conn: pyodbc.Connection, sql: str, params: Tuple[Any, ...] = ()) -> int:
     cur = conn.cursor()
     cur.execute(sql, params)
+    run_context.invalidate_for_sql(sql)
     return cur.rowcount
 
 
-def get_orders_to_monitor(limit: int = 200):
+def get_orders_to_monitor(limit: Optional[int] = None):
+    """Every monitored SO (limit=None); the Phase 2 scheduler decides what runs this time."""
     conn = state_conn()
     rows = conn.execute("""
         SELECT sordernum
@@ -150,7 +262,7 @@ def get_orders_to_monitor(limit: int = 200):
           )
         ORDER BY updated_ts DESC
         LIMIT ?
-    """, (limit,)).fetchall()
+    """, (-1 if limit is None else int(limit),)).fetchall()
     conn.close()
     return [r["sordernum"] for r in rows]
 
@@ -261,10 +373,119 @@ def purge_old_run_history(sqlite_conn: sqlite3.Connection, days_old: int = 90) -
 
 
 # ---------- Local State DB ----------
+class _StateConnection(sqlite3.Connection):
+    """
+    Long-lived state DB connection owned by StateStore (one per thread).
+
+    Callers keep the old open/commit/close pattern. close() only releases this
+    caller's hold; if the transaction was opened during that hold and is still
+    uncommitted, it is rolled back (what a real close used to do), so a failed
+    helper's writes are not committed by the next holder. The connection stays
+    open for the next caller.
+    """
+
+    def close(self) -> None:
+        holds = getattr(self, "_holds", None)
+        # hold stack: whether a transaction was already open when each hold began
+        opened_here = not holds.pop() if holds else True
+        if opened_here and self.in_transaction:
+            self.rollback()
+
+    def close_for_real(self) -> None:
+        super().close()
+
+
+class StateStore:
+    """
+    Owns thread-local SQLite connections to STATE_DB_PATH.
+
+    WAL journal mode lets the admin UI read while the workflow writes,
+    synchronous=NORMAL drops the per-commit fsync (still crash safe in WAL),
+    and connections live for the thread instead of per helper call.
+    """
+
+    def __init__(self, path: str, cache_kb: int, busy_timeout_ms: int):
+        self.path = path
+        self.cache_kb = int(cache_kb)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = {}   # thread ident -> (thread, connection)
+
+    def _open(self) -> _StateConnection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            factory=_StateConnection,
+            check_same_thread=False,  # only so close_all() can close it; never shared across threads
+        )
+        conn.row_factory = sqlite3.Row
+        # New files free pages incrementally (services/retention.py); must precede WAL,
+        # an existing file keeps its mode until a full VACUUM (RETENTION_CONVERT_AUTO_VACUUM)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_kb}")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn._holds = []
+        return conn
+
+    def _prune_dead_threads(self) -> None:
+        # Phase 1 worker threads come and go; close what they left behind
+        with self._lock:
+            dead = [k for k, (t, _) in self._conns.items() if not t.is_alive()]
+            stale = [self._conns.pop(k)[1] for k in dead]
+        for conn in stale:
+            try:
+                conn.close_for_real()
+            except Exception:
+                pass
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._prune_dead_threads()
+            conn = self._open()
+            self._local.conn = conn
+            t = threading.current_thread()
+            with self._lock:
+                self._conns[t.ident] = (t, conn)
+
+        conn._holds.append(conn.in_transaction)
+        return conn
+
+    def close_thread(self) -> None:
+        """Closes this thread's connection (next connection() call reopens)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._conns.pop(threading.get_ident(), None)
+        try:
+            conn.close_for_real()
+        except Exception:
+            pass
+
+    def close_all(self) -> None:
+        """Closes every connection (process shutdown)."""
+        with self._lock:
+            conns = [c for _, c in self._conns.values()]
+            self._conns.clear()
+        self._local = threading.local()
+        for conn in conns:
+            try:
+                conn.close_for_real()
+            except Exception:
+                pass
+
+
+STATE_STORE = StateStore(STATE_DB_PATH, STATE_DB_CACHE_KB, STATE_DB_BUSY_TIMEOUT_MS)
+
+
 def state_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(STATE_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return STATE_STORE.connection()
 
 
 # ----------------------------
@@ -274,7 +495,27 @@ def _now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def init_state_db() -> None:
+_STATE_DB_READY = False
+_STATE_DB_INIT_LOCK = threading.Lock()
+
+
+def init_state_db(force: bool = False) -> None:
+    """
+    Creates / migrates the state DB schema. Runs once per process
+    (long-running processes call this every cycle); force=True re-runs it.
+    """
+    global _STATE_DB_READY
+    if _STATE_DB_READY and not force:
+        return
+
+    with _STATE_DB_INIT_LOCK:
+        if _STATE_DB_READY and not force:
+            return
+        _init_state_db_schema()
+        _STATE_DB_READY = True
+
+
+def _init_state_db_schema() -> None:
     conn = state_conn()
     cur = conn.cursor()
 
@@ -356,6 +597,8 @@ def init_state_db() -> None:
     # ---- MIGRATIONS / SAFE UPGRADES ----
     _ensure_column(cur, "lws_order_state", "shipreq_p2", "TEXT")
     _ensure_column(cur, "workflow_runs", "held_count", "INTEGER")
+    _ensure_column(cur, "workflow_runs", "skipped_count", "INTEGER")   # Phase 2 work left for a later run (time budget)
+    _ensure_column(cur, "workflow_runs", "deferred_count", "INTEGER")  # Phase 1 orders still waiting on Radius at run end
     _ensure_column(cur, "lws_order_state", "custref_p4", "TEXT")
     _ensure_column(cur, "lws_order_state", "last_failed_sig", "TEXT")
     _ensure_column(cur, "lws_order_state", "last_failed_email_ts", "TEXT")
@@ -438,6 +681,30 @@ def init_state_db() -> None:
     )
     """)
 
+    # ✅ Numeric copy of new_value (same as CAST(new_value AS REAL)) so the dedupe probe can use an index
+    if _ensure_column(cur, "order_change_log", "new_value_num", "REAL"):
+        cur.execute("""
+        UPDATE order_change_log
+        SET new_value_num = CAST(new_value AS REAL)
+        WHERE new_value IS NOT NULL
+        """)
+
+    # ✅ Per-order summary of order_change_log rows removed by retention
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS order_change_log_rollup (
+        so4_sordernum   INTEGER NOT NULL,
+        change_type     TEXT NOT NULL,
+        row_count       INTEGER NOT NULL,
+        first_ts        TEXT,
+        last_ts         TEXT,
+        last_old_value  TEXT,
+        last_new_value  TEXT,
+        last_run_id     TEXT,
+        updated_ts      TEXT NOT NULL,
+        PRIMARY KEY (so4_sordernum, change_type)
+    )
+    """)
+
     cur.execute("""
     CREATE TABLE IF NOT EXISTS req_snapshot_keyed (
         jobcode      TEXT NOT NULL,
@@ -450,12 +717,270 @@ def init_state_db() -> None:
     )
     """)
 
+    # ✅ Local stand-in for dbo.LWS_Workflow_Outbox (OUTBOX_BACKEND=sqlite)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS lws_workflow_outbox (
+        outbox_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+        change_type   TEXT NOT NULL,
+        compnum       INTEGER NOT NULL,
+        plantcode     TEXT NOT NULL,
+        sordernum     INTEGER NOT NULL,
+        sorderlinenum INTEGER,
+        occurred_at   TEXT NOT NULL,
+        status        TEXT NOT NULL DEFAULT 'Pending',
+        processed_at  TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_lws_workflow_outbox_status ON lws_workflow_outbox(status, outbox_id)")
+
+    # ✅ Incremental polling high-water marks (per Radius source)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_watermarks (
+        source      TEXT PRIMARY KEY,
+        high_water  TEXT,
+        updated_ts  TEXT NOT NULL
+    )
+    """)
+
+    # ✅ Versioned Phase 2 snapshots: current content hash per order/job + append-only history
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS snapshot_hash (
+        kind          TEXT NOT NULL,
+        entity_key    TEXT NOT NULL,
+        content_hash  TEXT NOT NULL,
+        version       INTEGER NOT NULL,
+        updated_ts    TEXT NOT NULL,
+        PRIMARY KEY (kind, entity_key)
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS snapshot_versions (
+        kind          TEXT NOT NULL,
+        entity_key    TEXT NOT NULL,
+        version       INTEGER NOT NULL,
+        content_hash  TEXT NOT NULL,
+        content_json  TEXT NOT NULL,
+        run_id        TEXT,
+        created_ts    TEXT NOT NULL,
+        PRIMARY KEY (kind, entity_key, version)
+    )
+    """)
+
+    # ✅ Phase 2 scheduler: when each monitored SO was last checked, per phase
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS monitor_checks (
+        phase            TEXT NOT NULL,
+        sordernum        INTEGER NOT NULL,
+        last_checked_ts  TEXT NOT NULL,
+        PRIMARY KEY (phase, sordernum)
+    )
+    """)
+    # 1 = left unchecked by a run that moved past its change (budget): next run checks it first
+    _ensure_column(cur, "monitor_checks", "pending", "INTEGER")
+
+    # ✅ Cross-process run lock (scheduled task, daemon and listener never overlap)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS run_lock (
+        name         TEXT PRIMARY KEY,
+        owner        TEXT NOT NULL,
+        acquired_ts  TEXT NOT NULL,
+        expires_ts   TEXT NOT NULL
+    )
+    """)
+
+    # ✅ Orders parked while waiting for Radius to show a just-created record
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS deferred_checks (
+        sordernum   INTEGER PRIMARY KEY,
+        kind        TEXT NOT NULL,
+        ref         TEXT,
+        run_id      TEXT,
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        due_ts      TEXT NOT NULL,
+        created_ts  TEXT NOT NULL,
+        updated_ts  TEXT NOT NULL
+    )
+    """)
+
     conn.commit()
     conn.close()
 
     ensure_state_indexes()
 
 
+# ============================================================
+# ORDER STATE WRITES (lws_order_state + run_orders)
+# ============================================================
+_UPSERT_ORDER_STATE_SQL = """
+INSERT INTO lws_order_state (
+    sordernum, last_seen_ts, status, last_step,
+    last_run_id, polytex_item_code,
+    job_p4_code, po_p4_num, so_p2_num, shipreq_p2, job_p2_code, custref_p4,
+    last_error_summary,
+    last_api_entity, last_api_status, last_api_error_message, last_api_messages, last_api_raw,
+    updated_ts, hold_since_ts
+) VALUES (
+    :sordernum, :now, :status, :last_step,
+    :last_run_id, :polytex_item_code,
+    :job_p4, :po_p4, :so_p2, :shipreq_p2, :job_p2, :custref_p4,
+    :last_error_summary,
+    :last_api_entity, :last_api_status, :last_api_error_message, :last_api_messages_json, :last_api_raw,
+    :now, :hold_since
+)
+ON CONFLICT(sordernum) DO UPDATE SET
+    last_seen_ts=excluded.last_seen_ts,
+    status=excluded.status,
+    last_step=excluded.last_step,
+    last_run_id=COALESCE(excluded.last_run_id, lws_order_state.last_run_id),
+    polytex_item_code=COALESCE(excluded.polytex_item_code, lws_order_state.polytex_item_code),
+    job_p4_code=COALESCE(excluded.job_p4_code, lws_order_state.job_p4_code),
+    po_p4_num=COALESCE(excluded.po_p4_num, lws_order_state.po_p4_num),
+    so_p2_num=COALESCE(excluded.so_p2_num, lws_order_state.so_p2_num),
+    shipreq_p2=COALESCE(excluded.shipreq_p2, lws_order_state.shipreq_p2),
+    job_p2_code=COALESCE(excluded.job_p2_code, lws_order_state.job_p2_code),
+    custref_p4=COALESCE(excluded.custref_p4, lws_order_state.custref_p4),
+
+    last_error_summary=excluded.last_error_summary,
+    last_api_entity=excluded.last_api_entity,
+    last_api_status=excluded.last_api_status,
+    last_api_error_message=excluded.last_api_error_message,
+    last_api_messages=excluded.last_api_messages,
+    last_api_raw=excluded.last_api_raw,
+
+    -- ✅ HOLD Aging tracking
+    -- - While HOLD: hold_since_ts is set only once
+    -- - Leaving HOLD (hold_reset): clear hold_since_ts and reminder/escalation timestamps
+    hold_since_ts=CASE
+        WHEN :hold_reset THEN :hold_since
+        ELSE COALESCE(lws_order_state.hold_since_ts, :hold_since)
+    END,
+    last_hold_reminder_ts=CASE WHEN :hold_reset THEN NULL ELSE lws_order_state.last_hold_reminder_ts END,
+    hold_escalated_ts=CASE WHEN :hold_reset THEN NULL ELSE lws_order_state.hold_escalated_ts END,
+
+    updated_ts=excluded.updated_ts
+"""
+
+_UPSERT_RUN_ORDER_SQL = """
+INSERT INTO run_orders (run_id, sordernum, status, last_step, updated_ts)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(run_id, sordernum) DO UPDATE SET
+    status=excluded.status,
+    last_step=excluded.last_step,
+    updated_ts=excluded.updated_ts
+"""
+
+# Columns merged with COALESCE (a later None keeps the earlier value)
+_STATE_COALESCE_KEYS = (
+    "last_run_id", "polytex_item_code", "job_p4", "po_p4",
+    "so_p2", "shipreq_p2", "job_p2", "custref_p4",
+)
+
+
+class OrderUnitOfWork:
+    """
+    Buffers upsert_order_state / mark_run_order writes for the current thread
+    and writes them in ONE transaction on flush().
+
+    Successive writes for the same order are merged exactly like the SQL upsert
+    would apply them (last status/step wins, id columns COALESCE, HOLD aging
+    only resets if the order left HOLD in between).
+    """
+
+    def __init__(self):
+        self.states: Dict[int, Dict[str, Any]] = {}
+        self.run_orders: Dict[Tuple[str, int], Tuple[str, str, str]] = {}
+
+    def add_state(self, row: Dict[str, Any]) -> None:
+        so = int(row["sordernum"])
+        prev = self.states.get(so)
+        if prev is None:
+            self.states[so] = row
+            return
+
+        merged = dict(row)
+        for k in _STATE_COALESCE_KEYS:
+            if merged.get(k) is None:
+                merged[k] = prev.get(k)
+
+        if merged["is_hold"] and prev["is_hold"]:
+            # still the same HOLD stretch: keep when it started
+            merged["hold_reset"] = prev["hold_reset"]
+            merged["hold_since"] = prev["hold_since"]
+        else:
+            merged["hold_reset"] = merged["hold_reset"] or prev["hold_reset"] or not prev["is_hold"]
+
+        self.states[so] = merged
+
+    def add_run_order(self, run_id: str, sordernum: int, status: str, last_step: str, ts: str) -> None:
+        self.run_orders[(run_id, int(sordernum))] = (status, last_step, ts)
+
+    def flush(self) -> None:
+        if not self.states and not self.run_orders:
+            return
+
+        states, self.states = list(self.states.values()), {}
+        run_orders, self.run_orders = self.run_orders, {}
+
+        conn = state_conn()
+        try:
+            if states:
+                conn.executemany(_UPSERT_ORDER_STATE_SQL, states)
+            if run_orders:
+                conn.executemany(_UPSERT_RUN_ORDER_SQL, [
+                    (run_id, so, status, step, ts)
+                    for (run_id, so), (status, step, ts) in run_orders.items()
+                ])
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_UOW = threading.local()
+
+
+def _current_uow() -> Optional[OrderUnitOfWork]:
+    return getattr(_UOW, "current", None)
+
+
+@contextmanager
+def order_unit_of_work():
+    """
+    Per-order write batching:
+
+        with order_unit_of_work():
+            ... upsert_order_state(...) / mark_run_order(...) are buffered ...
+            flush_order_writes()   # step boundary: make progress durable
+        # always flushed on exit (COMPLETE, HOLD, FAILED or exception)
+
+    Nested use joins the outer unit of work.
+    """
+    if _current_uow() is not None:
+        yield _current_uow()
+        return
+
+    uow = OrderUnitOfWork()
+    _UOW.current = uow
+    try:
+        yield uow
+    except BaseException:
+        _UOW.current = None
+        try:
+            uow.flush()
+        except Exception as e:
+            log.error(f"[STATE] Failed to flush buffered order state: {e}")
+        raise
+    else:
+        _UOW.current = None
+        uow.flush()
+
+
+def flush_order_writes() -> None:
+    """Commits buffered order-state writes now (no-op outside order_unit_of_work)."""
+    uow = _current_uow()
+    if uow is not None:
+        uow.flush()
+
+
 def upsert_order_state(
     sordernum: int,
     status: str,
@@ -476,68 +1001,39 @@ def upsert_order_state(
     last_api_raw: Optional[str] = None,
 ) -> None:
     now = datetime.utcnow().isoformat()
-    conn = state_conn()
-    cur = conn.cursor()
-
-    # ============================================================
-    # ✅ HOLD Aging tracking (portable / SQL Server friendly)
-    # - When status becomes HOLD: set hold_since_ts only once
-    # - When leaving HOLD: clear hold_since_ts and reminder/escalation timestamps
-    # ============================================================
-    if str(status).upper() == "HOLD":
-        cur.execute("""
-            UPDATE lws_order_state
-               SET hold_since_ts = COALESCE(hold_since_ts, ?)
-             WHERE sordernum = ?
-        """, (now, sordernum))
-    else:
-        cur.execute("""
-            UPDATE lws_order_state
-               SET hold_since_ts = NULL,
-                   last_hold_reminder_ts = NULL,
-                   hold_escalated_ts = NULL
-             WHERE sordernum = ?
-        """, (sordernum,))
-
-    cur.execute("""
-    INSERT INTO lws_order_state (
-        sordernum, last_seen_ts, status, last_step,
-        last_run_id, polytex_item_code,
-        job_p4_code, po_p4_num, so_p2_num, shipreq_p2, job_p2_code, custref_p4,
-        last_error_summary,
-        last_api_entity, last_api_status, last_api_error_message, last_api_messages, last_api_raw,
-        updated_ts
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ON CONFLICT(sordernum) DO UPDATE SET
-        last_seen_ts=excluded.last_seen_ts,
-        status=excluded.status,
-        last_step=excluded.last_step,
-        last_run_id=COALESCE(excluded.last_run_id, lws_order_state.last_run_id),
-        polytex_item_code=COALESCE(excluded.polytex_item_code, lws_order_state.polytex_item_code),
-        job_p4_code=COALESCE(excluded.job_p4_code, lws_order_state.job_p4_code),
-        po_p4_num=COALESCE(excluded.po_p4_num, lws_order_state.po_p4_num),
-        so_p2_num=COALESCE(excluded.so_p2_num, lws_order_state.so_p2_num),
-        shipreq_p2=COALESCE(excluded.shipreq_p2, lws_order_state.shipreq_p2),
-        job_p2_code=COALESCE(excluded.job_p2_code, lws_order_state.job_p2_code),
-        custref_p4=COALESCE(excluded.custref_p4, lws_order_state.custref_p4),
-
-        last_error_summary=excluded.last_error_summary,
-        last_api_entity=excluded.last_api_entity,
-        last_api_status=excluded.last_api_status,
-        last_api_error_message=excluded.last_api_error_message,
-        last_api_messages=excluded.last_api_messages,
-        last_api_raw=excluded.last_api_raw,
-
-        updated_ts=excluded.updated_ts
-    """, (
-        sordernum, now, status, last_step,
-        last_run_id, polytex_item_code,
-        job_p4, po_p4, so_p2, shipreq_p2, job_p2, custref_p4,
-        last_error_summary,
-        last_api_entity, last_api_status, last_api_error_message, last_api_messages_json, last_api_raw,
-        now
-    ))
+    is_hold = str(status).upper() == "HOLD"
+
+    row = {
+        "sordernum": sordernum,
+        "now": now,
+        "status": status,
+        "last_step": last_step,
+        "last_run_id": last_run_id,
+        "polytex_item_code": polytex_item_code,
+        "job_p4": job_p4,
+        "po_p4": po_p4,
+        "so_p2": so_p2,
+        "shipreq_p2": shipreq_p2,
+        "job_p2": job_p2,
+        "custref_p4": custref_p4,
+        "last_error_summary": last_error_summary,
+        "last_api_entity": last_api_entity,
+        "last_api_status": last_api_status,
+        "last_api_messages_json": last_api_messages_json,
+        "last_api_error_message": last_api_error_message,
+        "last_api_raw": last_api_raw,
+        "is_hold": is_hold,
+        "hold_reset": not is_hold,
+        "hold_since": now if is_hold else None,
+    }
+
+    uow = _current_uow()
+    if uow is not None:
+        uow.add_state(row)
+        return
 
+    conn = state_conn()
+    conn.execute(_UPSERT_ORDER_STATE_SQL, row)
     conn.commit()
     conn.close()
 
@@ -638,32 +1134,516 @@ def mark_run(run_id: str, start_ts: str, env: str, log_file_path: str) -> None:
     conn.close()
 
 
-def close_run(run_id: str, end_ts: str, eligible: int, processed: int, failed: int) -> None:
+def close_run(
+    run_id: str,
+    end_ts: str,
+    eligible: int,
+    processed: int,
+    failed: int,
+    held: Optional[int] = None,
+    skipped: Optional[int] = None,
+    deferred: Optional[int] = None,
+) -> None:
     conn = state_conn()
     conn.execute("""
     UPDATE workflow_runs
-    SET end_ts=?, eligible_count=?, processed_count=?, failed_count=?
+    SET end_ts=?, eligible_count=?, processed_count=?, failed_count=?,
+        held_count=COALESCE(?, held_count),
+        skipped_count=COALESCE(?, skipped_count),
+        deferred_count=COALESCE(?, deferred_count)
     WHERE run_id=?
-    """, (end_ts, eligible, processed, failed, run_id))
+    """, (end_ts, eligible, processed, failed, held, skipped, deferred, run_id))
     conn.commit()
     conn.close()
 
 
 def mark_run_order(run_id: str, sordernum: int, status: str, last_step: str) -> None:
     now = datetime.utcnow().isoformat()
+
+    uow = _current_uow()
+    if uow is not None:
+        uow.add_run_order(run_id, sordernum, status, last_step, now)
+        return
+
     conn = state_conn()
-    conn.execute("""
-    INSERT INTO run_orders (run_id, sordernum, status, last_step, updated_ts)
-    VALUES (?, ?, ?, ?, ?)
-    ON CONFLICT(run_id, sordernum) DO UPDATE SET
-        status=excluded.status,
-        last_step=excluded.last_step,
-        updated_ts=excluded.updated_ts
-    """, (run_id, sordernum, status, last_step, now))
+    conn.execute(_UPSERT_RUN_ORDER_SQL, (run_id, sordernum, status, last_step, now))
     conn.commit()
     conn.close()
 
 
+# ============================================================
+# DEFERRED CHECKS (verify queue)
+# ============================================================
+def park_deferred_check(sordernum: int, kind: str, ref: Any, run_id: str, delay_s: int) -> int:
+    """
+    Parks an order until Radius shows the record `ref` (kind = what we wait for).
+    Re-parking for the same kind counts another attempt. Returns the attempt count.
+    """
+    now = datetime.utcnow()
+    due = (now + timedelta(seconds=max(0, int(delay_s)))).isoformat()
+    conn = state_conn()
+    try:
+        conn.execute("""
+        INSERT INTO deferred_checks (sordernum, kind, ref, run_id, attempts, due_ts, created_ts, updated_ts)
+        VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT(sordernum) DO UPDATE SET
+            attempts=CASE WHEN deferred_checks.kind = excluded.kind THEN deferred_checks.attempts + 1 ELSE 1 END,
+            kind=excluded.kind,
+            ref=excluded.ref,
+            run_id=excluded.run_id,
+            due_ts=excluded.due_ts,
+            updated_ts=excluded.updated_ts
+        """, (int(sordernum), kind, None if ref is None else str(ref), run_id, due, now.isoformat(), now.isoformat()))
+        conn.commit()
+        row = conn.execute("SELECT attempts FROM deferred_checks WHERE sordernum=?", (int(sordernum),)).fetchone()
+        return int(row["attempts"]) if row else 1
+    finally:
+        conn.close()
+
+
+def get_deferred_attempts(sordernum: int, kind: str) -> int:
+    conn = state_conn()
+    try:
+        row = conn.execute(
+            "SELECT attempts FROM deferred_checks WHERE sordernum=? AND kind=?",
+            (int(sordernum), kind),
+        ).fetchone()
+        return int(row["attempts"]) if row else 0
+    finally:
+        conn.close()
+
+
+def get_deferred_checks(sordernums: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Parked orders (optionally limited to sordernums), earliest due first."""
+    conn = state_conn()
+    try:
+        rows = conn.execute("SELECT * FROM deferred_checks ORDER BY due_ts").fetchall()
+    finally:
+        conn.close()
+    wanted = None if sordernums is None else {int(x) for x in sordernums}
+    return [dict(r) for r in rows if wanted is None or int(r["sordernum"]) in wanted]
+
+
+def bump_deferred_checks(sordernums: List[int], delay_s: int) -> None:
+    """Re-check found nothing yet: count the attempt and push the due time out."""
+    if not sordernums:
+        return
+    now = datetime.utcnow()
+    due = (now + timedelta(seconds=max(0, int(delay_s)))).isoformat()
+    conn = state_conn()
+    try:
+        conn.executemany(
+            "UPDATE deferred_checks SET attempts=attempts+1, due_ts=?, updated_ts=? WHERE sordernum=?",
+            [(due, now.isoformat(), int(so)) for so in sordernums],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def clear_deferred_check(sordernum: int) -> None:
+    conn = state_conn()
+    try:
+        conn.execute("DELETE FROM deferred_checks WHERE sordernum=?", (int(sordernum),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_stale_deferred_checks(grace_minutes: int = DEFERRED_PURGE_GRACE_MINUTES) -> int:
+    """
+    Drops parked rows for orders that are no longer waiting (resumed by a normal run, HOLD, removed...).
+    An order is waiting while it is IN_PROGRESS on a *_VERIFY_PENDING (verify) or *_BATCH_PENDING
+    (batched create) step; rows touched in the last grace_minutes always stay, because the
+    maintenance job can run while run_once is parking orders.
+    """
+    cutoff = (datetime.utcnow() - timedelta(minutes=max(0, int(grace_minutes)))).isoformat()
+    conn = state_conn()
+    try:
+        cur = conn.execute("""
+        DELETE FROM deferred_checks
+        WHERE COALESCE(updated_ts, created_ts, '') < ?
+          AND sordernum NOT IN (
+            SELECT sordernum FROM lws_order_state
+            WHERE status='IN_PROGRESS'
+              AND (last_step LIKE '%_VERIFY_PENDING' OR last_step LIKE '%_BATCH_PENDING')
+          )
+        """, (cutoff,))
+        conn.commit()
+        return int(cur.rowcount or 0)
+    finally:
+        conn.close()
+
+
+# ============================================================
+# SNAPSHOT VERSIONS (content hash per order/job + time travel)
+# ============================================================
+# kind -> (SQL over the mutable snapshot table keyed by "k", columns that
+#          decide "changed" (the same columns are hashed from the Radius fetch),
+#          key type of the snapshot table)
+SNAPSHOT_KINDS = {
+    "SO4_LINES": ("""
+        SELECT so4_sordernum AS k, so4_linenum, itemcode, orderedqty, reqdate
+        FROM so4_line_snapshot
+        WHERE so4_sordernum IN ({marks})
+    """, ("so4_linenum", "orderedqty"), int),
+    "SO4_HEADER": ("""
+        SELECT so4_sordernum AS k, custref
+        FROM so4_header_snapshot
+        WHERE so4_sordernum IN ({marks})
+    """, ("custref",), int),
+    "REQ_JOB": ("""
+        SELECT jobcode AS k, reqgroupcode, itemcode, requiredqty, requireddate
+        FROM req_snapshot_keyed
+        WHERE jobcode IN ({marks})
+    """, ("reqgroupcode", "itemcode", "requiredqty"), str),
+}
+
+
+def snapshot_content_hash(rows: List[Tuple[Any, ...]]) -> str:
+    """Order-independent hash of snapshot rows (floats to 4 dp, strings trimmed)."""
+    def _norm(v):
+        if v is None:
+            return ""
+        if isinstance(v, float):
+            return f"{v:.4f}"
+        return str(v).strip()
+
+    parts = sorted("|".join(_norm(v) for v in row) for row in rows)
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_snapshot_hashes(sqlite_conn: sqlite3.Connection, kind: str, keys: List[Any]) -> Dict[str, str]:
+    """{entity_key: content_hash} for keys that have a recorded version."""
+    out: Dict[str, str] = {}
+    ks = [str(k) for k in keys or []]
+    for chunk in _chunks(ks, 500):
+        marks = ",".join("?" for _ in chunk)
+        rows = sqlite_conn.execute(f"""
+            SELECT entity_key, content_hash FROM snapshot_hash
+            WHERE kind=? AND entity_key IN ({marks})
+        """, (kind, *chunk)).fetchall()
+        out.update({r["entity_key"]: r["content_hash"] for r in rows})
+    return out
+
+
+def record_snapshot_versions(sqlite_conn: sqlite3.Connection, kind: str, keys: List[Any], run_id: Optional[str]) -> int:
+    """
+    Re-reads the mutable snapshot rows for keys and appends a version for every
+    key whose content hash moved. Returns the number of new versions.
+    """
+    sql, hashed_cols, key_type = SNAPSHOT_KINDS[kind]
+    ks = list(dict.fromkeys(str(k) for k in keys or []))
+    if not ks:
+        return 0
+
+    rows_by_key: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in _chunks(ks, 500):
+        marks = ",".join("?" for _ in chunk)
+        for r in sqlite_conn.execute(sql.format(marks=marks), [key_type(k) for k in chunk]).fetchall():
+            d = dict(r)
+            rows_by_key.setdefault(str(d.pop("k")), []).append(d)
+
+    current = {}
+    for chunk in _chunks(ks, 500):
+        marks = ",".join("?" for _ in chunk)
+        for r in sqlite_conn.execute(f"""
+            SELECT entity_key, content_hash, version FROM snapshot_hash
+            WHERE kind=? AND entity_key IN ({marks})
+        """, (kind, *chunk)).fetchall():
+            current[r["entity_key"]] = (r["content_hash"], int(r["version"]))
+
+    now = _now_utc_iso()
+    versions, heads = [], []
+    for key, rows in rows_by_key.items():
+        h = snapshot_content_hash([tuple(r.get(c) for c in hashed_cols) for r in rows])
+        old_hash, old_version = current.get(key, (None, 0))
+        if h == old_hash:
+            continue
+        rows.sort(key=lambda r: json.dumps(r, sort_keys=True, default=str))
+        versions.append((kind, key, old_version + 1, h, json.dumps(rows, default=str), run_id, now))
+        heads.append((kind, key, h, old_version + 1, now))
+
+    if versions:
+        sqlite_conn.executemany("""
+            INSERT OR IGNORE INTO snapshot_versions(kind, entity_key, version, content_hash, content_json, run_id, created_ts)
+            VALUES(?,?,?,?,?,?,?)
+        """, versions)
+        sqlite_conn.executemany("""
+            INSERT INTO snapshot_hash(kind, entity_key, content_hash, version, updated_ts)
+            VALUES(?,?,?,?,?)
+            ON CONFLICT(kind, entity_key) DO UPDATE SET
+                content_hash=excluded.content_hash,
+                version=excluded.version,
+                updated_ts=excluded.updated_ts
+        """, heads)
+        sqlite_conn.commit()
+    return len(versions)
+
+
+def invalidate_snapshot_hash(sqlite_conn: sqlite3.Connection, kind: str, key: Any) -> None:
+    """
+    The mutable snapshot of key was rewritten: its recorded hash no longer describes
+    it, so hash short-circuits must diff again. The version number is kept, so the
+    next record_snapshot_versions() appends the next version.
+    """
+    sqlite_conn.execute(
+        "UPDATE snapshot_hash SET content_hash='' WHERE kind=? AND entity_key=? AND content_hash<>''",
+        (kind, str(key)),
+    )
+
+
+def _snapshot_version_row(r) -> Dict[str, Any]:
+    d = dict(r)
+    d["rows"] = json.loads(d.pop("content_json") or "[]")
+    return d
+
+
+def get_snapshot_history(kind: str, key: Any, limit: int = 50) -> List[Dict[str, Any]]:
+    """Newest first: [{"version", "content_hash", "rows", "run_id", "created_ts"}]."""
+    conn = state_conn()
+    try:
+        rows = conn.execute("""
+            SELECT version, content_hash, content_json, run_id, created_ts
+            FROM snapshot_versions
+            WHERE kind=? AND entity_key=?
+            ORDER BY version DESC
+            LIMIT ?
+        """, (kind, str(key), int(limit))).fetchall()
+        return [_snapshot_version_row(r) for r in rows]
+    finally:
+        conn.close()
+
+
+def get_snapshot_as_of(kind: str, key: Any, run_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    What the snapshot looked like at the end of run_id (None = latest):
+    the newest version recorded by that run or before it finished.
+    """
+    conn = state_conn()
+    try:
+        cutoff = None
+        if run_id:
+            run = conn.execute(
+                "SELECT start_ts, end_ts FROM workflow_runs WHERE run_id=?", (run_id,)
+            ).fetchone()
+            if not run:
+                return None
+            cutoff = run["end_ts"] or _now_utc_iso()
+
+        row = conn.execute("""
+            SELECT version, content_hash, content_json, run_id, created_ts
+            FROM snapshot_versions
+            WHERE kind=? AND entity_key=?
+              AND (? IS NULL OR run_id=? OR created_ts <= ?)
+            ORDER BY version DESC
+            LIMIT 1
+        """, (kind, str(key), cutoff, run_id, cutoff)).fetchone()
+        return _snapshot_version_row(row) if row else None
+    finally:
+        conn.close()
+
+
+# ============================================================
+# PHASE 2 SCHEDULER (last check per phase + run lock)
+# ============================================================
+def get_monitor_schedule(phase: str, so_list: List[int]) -> Dict[int, Dict[str, Any]]:
+    """{so: {"last_checked_ts", "hold_since_ts"}} for the given SOs (missing keys = never checked)."""
+    out: Dict[int, Dict[str, Any]] = {}
+    sos = [int(x) for x in so_list or []]
+    conn = state_conn()
+    try:
+        for chunk in _chunks(sos, 500):
+            marks = ",".join("?" for _ in chunk)
+            rows = conn.execute(f"""
+                SELECT s.sordernum, s.hold_since_ts, m.last_checked_ts
+                FROM lws_order_state s
+                LEFT JOIN monitor_checks m
+                  ON m.phase = ? AND m.sordernum = s.sordernum
+                WHERE s.sordernum IN ({marks})
+            """, (str(phase), *chunk)).fetchall()
+            for r in rows:
+                out[int(r["sordernum"])] = {
+                    "last_checked_ts": r["last_checked_ts"],
+                    "hold_since_ts": r["hold_since_ts"],
+                }
+        return out
+    finally:
+        conn.close()
+
+
+def mark_monitor_checked(phase: str, so_list: List[int]) -> None:
+    sos = [int(x) for x in so_list or []]
+    if not sos:
+        return
+    now = _now_utc_iso()
+    conn = state_conn()
+    try:
+        conn.executemany("""
+        INSERT INTO monitor_checks(phase, sordernum, last_checked_ts, pending)
+        VALUES(?,?,?,0)
+        ON CONFLICT(phase, sordernum) DO UPDATE SET last_checked_ts=excluded.last_checked_ts, pending=0
+        """, [(str(phase), so, now) for so in sos])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def mark_monitor_pending(phase: str, so_list: List[int]) -> None:
+    """SOs a run had to check but left for later: they stay pending until mark_monitor_checked()."""
+    sos = [int(x) for x in so_list or []]
+    if not sos:
+        return
+    conn = state_conn()
+    try:
+        conn.executemany("""
+        INSERT INTO monitor_checks(phase, sordernum, last_checked_ts, pending)
+        VALUES(?,?,'',1)
+        ON CONFLICT(phase, sordernum) DO UPDATE SET pending=1
+        """, [(str(phase), so) for so in sos])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_monitor_pending(phase: str) -> set:
+    conn = state_conn()
+    try:
+        rows = conn.execute(
+            "SELECT sordernum FROM monitor_checks WHERE phase=? AND pending=1", (str(phase),)
+        ).fetchall()
+        return {int(r["sordernum"]) for r in rows}
+    finally:
+        conn.close()
+
+
+def purge_monitor_checks() -> int:
+    """Drops scheduler rows for SOs that are no longer monitored (COMPLETE/HOLD)."""
+    conn = state_conn()
+    try:
+        cur = conn.execute("""
+        DELETE FROM monitor_checks
+        WHERE sordernum NOT IN (
+            SELECT sordernum FROM lws_order_state WHERE status IN ('COMPLETE','HOLD')
+        )
+        """)
+        conn.commit()
+        return int(cur.rowcount or 0)
+    finally:
+        conn.close()
+
+
+def acquire_run_lock(owner: str, ttl_s: int, name: str = "workflow") -> bool:
+    """
+    Takes the named lock unless another owner holds an unexpired lease.
+    A crashed holder's lease simply expires after ttl_s.
+    """
+    now = datetime.now(timezone.utc)
+    conn = state_conn()
+    try:
+        cur = conn.execute("""
+        INSERT INTO run_lock(name, owner, acquired_ts, expires_ts)
+        VALUES(?,?,?,?)
+        ON CONFLICT(name) DO UPDATE SET
+            owner=excluded.owner,
+            acquired_ts=excluded.acquired_ts,
+            expires_ts=excluded.expires_ts
+        WHERE run_lock.expires_ts < excluded.acquired_ts OR run_lock.owner = excluded.owner
+        """, (name, owner, now.isoformat(), (now + timedelta(seconds=max(1, int(ttl_s)))).isoformat()))
+        conn.commit()
+        return int(cur.rowcount or 0) > 0
+    finally:
+        conn.close()
+
+
+def renew_run_lock(owner: str, ttl_s: int, name: str = "workflow") -> bool:
+    """Extends owner's lease; False when the lease is gone or another owner took it over."""
+    expires = datetime.now(timezone.utc) + timedelta(seconds=max(1, int(ttl_s)))
+    conn = state_conn()
+    try:
+        cur = conn.execute(
+            "UPDATE run_lock SET expires_ts=? WHERE name=? AND owner=?",
+            (expires.isoformat(), name, owner),
+        )
+        conn.commit()
+        return int(cur.rowcount or 0) > 0
+    finally:
+        conn.close()
+
+
+def get_run_lock(name: str = "workflow") -> Optional[Dict[str, Any]]:
+    conn = state_conn()
+    try:
+        row = conn.execute("SELECT owner, acquired_ts, expires_ts FROM run_lock WHERE name=?", (name,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def release_run_lock(owner: str, name: str = "workflow") -> None:
+    conn = state_conn()
+    try:
+        conn.execute("DELETE FROM run_lock WHERE name=? AND owner=?", (name, owner))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ============================================================
+# SYNC WATERMARKS (incremental Phase 2 polling)
+# ============================================================
+def get_watermarks() -> Dict[str, Dict[str, Any]]:
+    """{source: {"high_water", "updated_ts"}}"""
+    conn = state_conn()
+    try:
+        rows = conn.execute("SELECT source, high_water, updated_ts FROM sync_watermarks").fetchall()
+        return {r["source"]: {"high_water": r["high_water"], "updated_ts": r["updated_ts"]} for r in rows}
+    finally:
+        conn.close()
+
+
+def set_watermarks(marks: Dict[str, Optional[str]]) -> None:
+    """Saves several marks in one transaction (None keeps the previous high_water)."""
+    if not marks:
+        return
+    now = _now_utc_iso()
+    conn = state_conn()
+    try:
+        conn.executemany("""
+        INSERT INTO sync_watermarks(source, high_water, updated_ts)
+        VALUES(?,?,?)
+        ON CONFLICT(source) DO UPDATE SET
+            high_water=COALESCE(excluded.high_water, sync_watermarks.high_water),
+            updated_ts=excluded.updated_ts
+        """, [(src, hw, now) for src, hw in marks.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_so4_needing_baseline(sqlite_conn: sqlite3.Connection, so4_list: List[int]) -> set:
+    """
+    Monitored SO4s Phase 2A has not baselined yet (no line snapshot, or a Plant2 SO
+    but no header snapshot). These must be checked even if Radius did not touch them.
+    """
+    out = set()
+    sos = [int(x) for x in so4_list or []]
+    for chunk in _chunks(sos, 500):
+        marks = ",".join("?" for _ in chunk)
+        rows = sqlite_conn.execute(f"""
+            SELECT s.sordernum
+            FROM lws_order_state s
+            WHERE s.sordernum IN ({marks})
+              AND (
+                    NOT EXISTS (SELECT 1 FROM so4_line_snapshot l WHERE l.so4_sordernum = s.sordernum)
+                 OR (s.so_p2_num IS NOT NULL
+                     AND NOT EXISTS (SELECT 1 FROM so4_header_snapshot h WHERE h.so4_sordernum = s.sordernum))
+              )
+        """, chunk).fetchall()
+        out.update(int(r["sordernum"]) for r in rows)
+    return out
+
+
 def last_run_start_ts() -> Optional[str]:
     conn = state_conn()
     row = conn.execute("SELECT start_ts FROM workflow_runs ORDER BY start_ts DESC LIMIT 1").fetchone()
@@ -679,6 +1659,7 @@ def compute_eligibility_since() -> str:
 def execute(conn, sql: str, params: tuple = ()):
     cur = conn.cursor()
     cur.execute(sql, params)
+    run_context.invalidate_for_sql(sql)
     return cur.rowcount
 
 
@@ -719,6 +1700,8 @@ def ensure_state_indexes() -> None:
     CREATE INDEX IF NOT EXISTS idx_order_change_log_so ON order_change_log(so4_sordernum, created_ts);
     CREATE INDEX IF NOT EXISTS idx_order_change_log_run_id ON order_change_log(run_id);
     CREATE INDEX IF NOT EXISTS idx_order_change_log_created_ts ON order_change_log(created_ts);
+    CREATE INDEX IF NOT EXISTS idx_order_change_log_dedupe
+        ON order_change_log(so4_sordernum, so4_linenum, change_type, new_value_num);
     CREATE INDEX IF NOT EXISTS idx_lws_order_state_last_failed_sig ON lws_order_state(last_failed_sig);
 
     """)
@@ -750,9 +1733,46 @@ def upsert_so4_line_snapshot(sqlite_conn: sqlite3.Connection, so_num: int, line_
           reqdate=excluded.reqdate,
           updated_ts=excluded.updated_ts
     """, (so_num, line_num, itemcode, float(orderedqty or 0), reqdate, _now_utc_iso()))
+    invalidate_snapshot_hash(sqlite_conn, "SO4_LINES", int(so_num))
     sqlite_conn.commit()
 
 
+def diff_so4_line_snapshots(sqlite_conn: sqlite3.Connection, lines: List[Tuple[int, int, float]]) -> List[Dict[str, Any]]:
+    """
+    Set-wise compare of current SO4 lines [(so, line, orderedqty)] with so4_line_snapshot.
+    Loads the lines into a temp table and returns only new or qty-changed lines:
+      {"so4_sordernum", "so4_linenum", "orderedqty", "old_qty" (None when new)}
+    """
+    sqlite_conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS tmp_so4_lines (
+            so4_sordernum INTEGER NOT NULL,
+            so4_linenum   INTEGER NOT NULL,
+            orderedqty    REAL,
+            PRIMARY KEY (so4_sordernum, so4_linenum)
+        )
+    """)
+    try:
+        sqlite_conn.execute("DELETE FROM tmp_so4_lines")
+        sqlite_conn.executemany(
+            "INSERT OR REPLACE INTO tmp_so4_lines(so4_sordernum, so4_linenum, orderedqty) VALUES (?,?,?)",
+            [(int(so), int(ln), float(qty or 0)) for (so, ln, qty) in lines],
+        )
+        rows = sqlite_conn.execute("""
+            SELECT t.so4_sordernum, t.so4_linenum, t.orderedqty,
+                   CASE WHEN s.so4_sordernum IS NULL THEN NULL ELSE COALESCE(s.orderedqty, 0) END AS old_qty
+            FROM tmp_so4_lines t
+            LEFT JOIN so4_line_snapshot s
+              ON s.so4_sordernum = t.so4_sordernum
+             AND s.so4_linenum   = t.so4_linenum
+            WHERE s.so4_sordernum IS NULL
+               OR COALESCE(s.orderedqty, 0) != t.orderedqty
+        """).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        sqlite_conn.execute("DELETE FROM tmp_so4_lines")
+        sqlite_conn.commit()
+
+
 def get_req_snapshot(sqlite_conn: sqlite3.Connection, requirement_id: int):
     return sqlite_conn.execute("""
         SELECT * FROM req_snapshot WHERE requirement_id=?
@@ -793,28 +1813,157 @@ def get_po_map(sqlite_conn: sqlite3.Connection, so_num: int, line_num: int):
     """, (int(so_num), int(line_num))).fetchone()
 
 
+_INSERT_CHANGE_LOG_SQL = """
+    INSERT INTO order_change_log(
+      run_id, so4_sordernum, so4_linenum, change_type, old_value, new_value, new_value_num, details_json, created_ts
+    )
+    VALUES(?,?,?,?,?,?,CAST(? AS REAL),?,?)
+"""
+
+
+def _as_real(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ChangeLogWriter:
+    """
+    Buffers insert_change_log rows for the current thread; flush() writes them
+    with one executemany + commit. logged() lets the dedupe check see rows that
+    are still buffered.
+    """
+
+    def __init__(self):
+        self.rows: List[Tuple[Any, ...]] = []
+        self._keys = set()
+
+    def add(self, row: Tuple[Any, ...]) -> None:
+        self.rows.append(row)
+        _, so, line, change_type, _, new_value, _, _, _ = row
+        num = _as_real(new_value)
+        if num is None and new_value is not None:
+            num = ("text", new_value)  # never matches a numeric/NULL probe
+        self._keys.add((so, line, change_type, num))
+
+    def logged(self, so: int, line: int, change_type: str, new_value: Optional[float]) -> bool:
+        return (so, line, change_type, new_value) in self._keys
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self._keys = set()
+
+        conn = state_conn()
+        try:
+            conn.executemany(_INSERT_CHANGE_LOG_SQL, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_CHANGE_LOG = threading.local()
+
+
+def _current_change_log() -> Optional[ChangeLogWriter]:
+    return getattr(_CHANGE_LOG, "current", None)
+
+
+@contextmanager
+def change_log_writer():
+    """
+    Per-order change-log batching:
+
+        with change_log_writer():
+            ... insert_change_log(...) rows are buffered ...
+        # always flushed on exit (including on exception)
+
+    Readers of order_change_log call flush_change_log() first. Nested use
+    joins the outer writer.
+    """
+    if _current_change_log() is not None:
+        yield _current_change_log()
+        return
+
+    writer = ChangeLogWriter()
+    _CHANGE_LOG.current = writer
+    try:
+        yield writer
+    except BaseException:
+        _CHANGE_LOG.current = None
+        try:
+            writer.flush()
+        except Exception as e:
+            log.error(f"[STATE] Failed to flush buffered change log: {e}")
+        raise
+    else:
+        _CHANGE_LOG.current = None
+        writer.flush()
+
+
+def flush_change_log() -> None:
+    """Writes buffered change-log rows now (no-op outside change_log_writer)."""
+    writer = _current_change_log()
+    if writer is not None:
+        writer.flush()
+
+
 def insert_change_log(sqlite_conn: sqlite3.Connection, run_id: str,
                       so_num: int, line_num: int, change_type: str,
                       old_value: Any = None, new_value: Any = None,
                       details: Optional[dict] = None):
-    sqlite_conn.execute("""
-        INSERT INTO order_change_log(
-          run_id, so4_sordernum, so4_linenum, change_type, old_value, new_value, details_json, created_ts
-        )
-        VALUES(?,?,?,?,?,?,?,?)
-    """, (
+    new_text = None if new_value is None else str(new_value)
+    row = (
         run_id,
         int(so_num) if so_num is not None else None,
         int(line_num) if line_num is not None else None,
         str(change_type),
         None if old_value is None else str(old_value),
-        None if new_value is None else str(new_value),
+        new_text,
+        new_text,
         json.dumps(details or {}),
-        _now_utc_iso()
-    ))
+        _now_utc_iso(),
+    )
+
+    writer = _current_change_log()
+    if writer is not None:
+        writer.add(row)
+        return
+
+    sqlite_conn.execute(_INSERT_CHANGE_LOG_SQL, row)
     sqlite_conn.commit()
 
 
+def change_already_logged(sqlite_conn: sqlite3.Connection, so_num: int, line_num: int,
+                          change_type: str, new_value: Optional[float]) -> bool:
+    """
+    True if order_change_log (or the active writer's buffer) already has this
+    change_type for this order/line and numeric new_value. One probe of
+    idx_order_change_log_dedupe.
+    """
+    so, line = int(so_num), int(line_num)
+    num = None if new_value is None else float(new_value)
+
+    writer = _current_change_log()
+    if writer is not None and writer.logged(so, line, str(change_type), num):
+        return True
+
+    row = sqlite_conn.execute("""
+        SELECT 1
+          FROM order_change_log
+         WHERE so4_sordernum = ?
+           AND so4_linenum   = ?
+           AND change_type   = ?
+           AND new_value_num IS ?
+         LIMIT 1
+    """, (so, line, str(change_type), num)).fetchone()
+    return row is not None
+
+
 def get_req_snapshot_keyed(sqlite_conn: sqlite3.Connection, jobcode: str, reqgroupcode: str, itemcode: str):
     return sqlite_conn.execute("""
         SELECT * FROM req_snapshot_keyed
@@ -834,8 +1983,45 @@ def upsert_req_snapshot_keyed(sqlite_conn: sqlite3.Connection, jobcode: str, req
           updated_ts=excluded.updated_ts
     """, (str(jobcode), str(reqgroupcode), str(itemcode),
           float(requiredqty or 0), str(requireddate), _now_utc_iso()))
+    invalidate_snapshot_hash(sqlite_conn, "REQ_JOB", str(jobcode))
     sqlite_conn.commit()
 
+def diff_req_snapshot_keyed(sqlite_conn: sqlite3.Connection, reqs: List[Tuple[str, str, str, float]]) -> set:
+    """
+    Set-wise compare of current PV_Req rows [(jobcode, reqgroupcode, itemcode, requiredqty)]
+    with req_snapshot_keyed. Returns the jobcodes that have a row without a snapshot
+    or whose RequiredQty moved (same 0.0001 tolerance as apply_req_changes_to_po).
+    """
+    sqlite_conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS tmp_req_keyed (
+            jobcode      TEXT NOT NULL,
+            reqgroupcode TEXT NOT NULL,
+            itemcode     TEXT NOT NULL,
+            requiredqty  REAL
+        )
+    """)
+    try:
+        sqlite_conn.execute("DELETE FROM tmp_req_keyed")
+        sqlite_conn.executemany(
+            "INSERT INTO tmp_req_keyed(jobcode, reqgroupcode, itemcode, requiredqty) VALUES (?,?,?,?)",
+            [(str(j), str(g), str(i), float(q or 0)) for (j, g, i, q) in reqs],
+        )
+        rows = sqlite_conn.execute("""
+            SELECT DISTINCT t.jobcode
+            FROM tmp_req_keyed t
+            LEFT JOIN req_snapshot_keyed s
+              ON s.jobcode      = t.jobcode
+             AND s.reqgroupcode = t.reqgroupcode
+             AND s.itemcode     = t.itemcode
+            WHERE s.jobcode IS NULL
+               OR ABS(COALESCE(s.requiredqty, 0) - t.requiredqty) > 0.0001
+        """).fetchall()
+        return {r["jobcode"] for r in rows}
+    finally:
+        sqlite_conn.execute("DELETE FROM tmp_req_keyed")
+        sqlite_conn.commit()
+
+
 def get_so4_header_snapshot(sqlite_conn: sqlite3.Connection, so_num: int):
     return sqlite_conn.execute("""
         SELECT * FROM so4_header_snapshot
@@ -0,0 +1,279 @@
+# lws_workflow/db_pool.py
+"""
+Radius ODBC connection pool.
+
+Connecting to the Progress DSN is one of the slowest parts of a run, so
+config.get_db_conn() / get_readonly_conn() hand out connections from a pool
+instead of opening a new one every time.
+
+Callers do not change: the pooled connection behaves like a pyodbc connection
+and close() returns it to the pool (rolling back any uncommitted work first,
+which matches what a real close() does).
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from logger import get_logger
+
+log = get_logger("db_pool")
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection became available within the wait timeout."""
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pyodbc connection checked out from a ConnectionPool.
+    Everything except close() is forwarded to the real connection.
+    """
+
+    def __init__(self, pool: "ConnectionPool", raw, created_at: float):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def close(self) -> None:
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._raw, self._created_at)
+
+    def __del__(self):
+        # Safety net: a caller that forgets close() must not leak a pool slot
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pyodbc connections.
+
+    - min_size connections are opened on first use and kept warm
+    - max_size caps open connections; callers wait up to wait_timeout_s
+    - idle connections are pinged before hand-out (ping_sql)
+    - connections older than max_age_s are recycled
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connect_func: Callable,
+        min_size: int = 1,
+        max_size: int = 8,
+        max_age_s: int = 1800,
+        wait_timeout_s: int = 60,
+        ping_sql: Optional[str] = None,
+    ):
+        self.name = name
+        self._connect = connect_func
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.max_age_s = int(max_age_s)
+        self.wait_timeout_s = int(wait_timeout_s)
+        self.ping_sql = ping_sql
+
+        self._cond = threading.Condition()
+        self._idle = []      # [(raw, created_at)]  (LIFO: most recently used first)
+        self._total = 0      # idle + checked out
+        self._warmed = False
+        self._closed = False
+
+        # stats
+        self._checkouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._timeouts = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+
+    # ----------------------------
+    # Internal helpers
+    # ----------------------------
+    def _expired(self, created_at: float) -> bool:
+        return self.max_age_s > 0 and (time.monotonic() - created_at) >= self.max_age_s
+
+    def _discard(self, raw) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _ping(self, raw) -> bool:
+        if not self.ping_sql:
+            return True
+        try:
+            cur = raw.cursor()
+            try:
+                cur.execute(self.ping_sql)
+                cur.fetchone()
+            finally:
+                cur.close()
+            return True
+        except Exception as e:
+            log.debug(f"[POOL {self.name}] ping failed: {e}")
+            return False
+
+    def _open_new(self):
+        raw = self._connect()
+        with self._cond:
+            self._created += 1
+        return raw, time.monotonic()
+
+    def _warm(self) -> None:
+        """Opens min_size connections once so the first callers don't pay the connect cost."""
+        with self._cond:
+            if self._warmed:
+                return
+            self._warmed = True
+            need = max(0, self.min_size - self._total)
+            self._total += need
+
+        for _ in range(need):
+            try:
+                raw, created_at = self._open_new()
+            except Exception as e:
+                log.warning(f"[POOL {self.name}] warm-up connect failed (ignored): {e}")
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                continue
+            with self._cond:
+                self._idle.append((raw, created_at))
+                self._cond.notify()
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def acquire(self) -> PooledConnection:
+        if self._closed:
+            raise RuntimeError(f"Connection pool {self.name} is closed")
+
+        self._warm()
+
+        t0 = time.monotonic()
+        deadline = t0 + self.wait_timeout_s
+
+        while True:
+            candidate = None
+            open_new = False
+
+            with self._cond:
+                while True:
+                    while self._idle:
+                        raw, created_at = self._idle.pop()
+                        if self._expired(created_at):
+                            self._total -= 1
+                            self._recycled += 1
+                            self._discard(raw)
+                            continue
+                        candidate = (raw, created_at)
+                        break
+
+                    if candidate:
+                        break
+
+                    if self._total < self.max_size:
+                        self._total += 1
+                        open_new = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No {self.name} Radius connection available after {self.wait_timeout_s}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+
+            if open_new:
+                try:
+                    candidate = self._open_new()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._ping(candidate[0]):
+                self._discard(candidate[0])
+                with self._cond:
+                    self._total -= 1
+                    self._ping_failures += 1
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - t0
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total_s += waited
+                self._wait_max_s = max(self._wait_max_s, waited)
+
+            return PooledConnection(self, candidate[0], candidate[1])
+
+    def _release(self, raw, created_at: float) -> None:
+        reusable = not self._closed and not self._expired(created_at)
+
+        if reusable:
+            try:
+                # Same semantics as a real close(): never carry uncommitted work over
+                if not raw.autocommit:
+                    raw.rollback()
+            except Exception as e:
+                log.debug(f"[POOL {self.name}] rollback on release failed, discarding: {e}")
+                reusable = False
+
+        with self._cond:
+            if reusable:
+                self._idle.append((raw, created_at))
+            else:
+                self._total -= 1
+                if not self._closed:
+                    self._recycled += 1
+            self._cond.notify()
+
+        if not reusable:
+            self._discard(raw)
+
+    def close(self) -> None:
+        """Closes idle connections; checked-out ones are closed when released."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self) -> dict:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "pool": self.name,
+                "size": self._total,
+                "idle": len(self._idle),
+                "in_use": self._total - len(self._idle),
+                "max_size": self.max_size,
+                "checkouts": checkouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round((self._wait_total_s / checkouts) * 1000, 1) if checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max_s * 1000, 1),
+            }
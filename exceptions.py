@@ -7,6 +7,22 @@ class WorkflowHold(Exception):
         self.created_items = created_items or []
 
 
+class WorkflowDeferred(WorkflowHold):
+    """
+    Radius has not caught up yet (e.g. a just-created SO has no status/lines).
+    The order is parked in the deferred_checks queue and resumed once a batched
+    re-check sees the data. Subclasses WorkflowHold so it still stops the order.
+    """
+    def __init__(self, message: str, *, kind: str, ref=None, created_items: list[str] | None = None):
+        super().__init__(message, created_items=created_items)
+        self.kind = kind
+        self.ref = ref
+
+
+class RunLockLost(Exception):
+    """The run lock lease could not be renewed (expired and taken by another run): stop this run."""
+
+
 class WorkflowApiError(Exception):
     """
     Raised when an XLink API call fails and we want the Admin email to include
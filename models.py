@@ -23,3 +23,13 @@ class OrderState:
     last_api_entity: Optional[str] = None
     last_api_status: Optional[int] = None
     last_api_messages: Optional[List[str]] = None
+
+
+@dataclass
+class OutboxEvent:
+    outbox_id: int
+    change_type: str          # NEW_ORDER / QTY_CHANGE
+    compnum: int
+    plantcode: str
+    sordernum: int
+    sorderlinenum: Optional[int] = None   # None for header events
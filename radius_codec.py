@@ -0,0 +1,279 @@
+#radius_codec.py
+"""
+Single-pass codec for efiRadius adapter responses.
+
+_RadiusParse decodes an adapter reply at most once: the JSON envelope, the
+base64 payload, the payload JSON and the element list are each decoded on first
+access and kept. It is cached on the requests.Response, so the api.decode_*
+helpers, the XLink client and the batch creators all share the same decode.
+
+Every decode returns its own RadiusResponse over that shared parse, with its own
+messages list (decoders replace it with element errors) and its own fallbacks,
+so decoding a response twice never changes what an earlier caller holds.
+from_text() does the same for the raw text stored with a failure (fail_order email).
+
+Attribute names match the old ApiDecodeResult / decode_porder_response results
+(status_code, entity, raw_error, error_message, messages, decoded_payload, raw),
+so callers did not change.
+"""
+import base64
+import json
+from typing import Any, Dict, List, Optional
+
+_UNSET = object()
+
+# payload wrapper -> element list key
+_ELEMENT_KEYS = (
+    ("XLSOrders", "XLSOrder"),
+    ("XLPOrders", "XLPOrder"),
+    ("XLItems", "XLItem"),
+)
+
+
+class _RadiusParse:
+    """Lazily decoded parts of one adapter reply (shared, never mutated by callers)."""
+
+    __slots__ = (
+        "text",
+        "http_status",
+        "_body",
+        "body_error",
+        "_payload_text",
+        "_payload",
+        "payload_error",
+        "_elements",
+    )
+
+    def __init__(self, text: Optional[str], http_status: Optional[int] = None):
+        self.text = text or ""
+        self.http_status = http_status
+        self._body = _UNSET
+        self.body_error = None
+        self._payload_text = _UNSET
+        self._payload = _UNSET
+        self.payload_error = None
+        self._elements = None
+
+    @property
+    def body(self) -> Optional[Any]:
+        if self._body is _UNSET:
+            try:
+                self._body = json.loads(self.text)
+            except Exception as e:
+                self._body = None
+                self.body_error = e
+        return self._body
+
+    @property
+    def envelope(self) -> Dict[str, Any]:
+        body = self.body
+        return (body.get("efiRadiusResponse") or {}) if isinstance(body, dict) else {}
+
+    @property
+    def payload_text(self) -> Optional[str]:
+        if self._payload_text is _UNSET:
+            self._payload_text = None
+            b64 = self.envelope.get("payload")
+            if b64:
+                try:
+                    self._payload_text = base64.b64decode(b64).decode("utf-8", errors="replace").strip()
+                except Exception as e:
+                    self.payload_error = e
+        return self._payload_text
+
+    @property
+    def payload(self) -> Optional[Any]:
+        if self._payload is _UNSET:
+            self._payload = None
+            txt = self.payload_text
+            if txt:
+                try:
+                    self._payload = json.loads(txt)
+                except Exception as e:
+                    self.payload_error = e
+        return self._payload
+
+    def elements(self) -> List[Dict[str, Any]]:
+        if self._elements is None:
+            dp = self.payload
+            found: Any = None
+            if isinstance(dp, dict):
+                for wrapper, key in _ELEMENT_KEYS:
+                    if wrapper in dp:
+                        found = (dp.get(wrapper) or {}).get(key)
+                        break
+                    if key in dp:
+                        found = dp.get(key)
+                        break
+            elif isinstance(dp, list):
+                found = dp
+            if isinstance(found, dict):
+                found = [found]
+            self._elements = [e for e in found or [] if isinstance(e, dict)]
+        return self._elements
+
+
+class RadiusResponse:
+    """
+    One decode of an adapter reply. status_default is reported when the envelope
+    has no statusCode; text_payload=True turns a payload that is not JSON into
+    {"_payload_text": ...} (XLinkAPIPOrder) instead of a decode error.
+    """
+
+    __slots__ = ("_parse", "_status_default", "_text_payload", "_messages")
+
+    def __init__(self, parse: _RadiusParse, status_default: Optional[int] = None, text_payload: bool = False):
+        self._parse = parse
+        self._status_default = status_default
+        self._text_payload = text_payload
+        self._messages = None
+
+    @classmethod
+    def of(cls, resp, status_default: Optional[int] = None, text_payload: bool = False) -> "RadiusResponse":
+        """A new RadiusResponse over the (cached) parse of a requests.Response."""
+        parse = getattr(resp, "_radius_codec", None)
+        if parse is None:
+            try:
+                text = resp.text
+            except Exception:
+                text = ""
+            parse = _RadiusParse(text, getattr(resp, "status_code", None))
+            try:
+                resp._radius_codec = parse
+            except Exception:
+                pass
+        return cls(parse, status_default, text_payload)
+
+    @classmethod
+    def from_text(cls, raw_text: Optional[str]) -> "RadiusResponse":
+        return cls(_RadiusParse(raw_text))
+
+    # ----------------------------
+    # Envelope
+    # ----------------------------
+    @property
+    def text(self) -> str:
+        return self._parse.text
+
+    @property
+    def http_status(self) -> Optional[int]:
+        return self._parse.http_status
+
+    @property
+    def body(self) -> Optional[Any]:
+        """Parsed JSON body, or None when the reply is not JSON."""
+        return self._parse.body
+
+    raw = body  # decode_porder_response name
+
+    @property
+    def envelope(self) -> Dict[str, Any]:
+        return self._parse.envelope
+
+    @property
+    def status_code(self) -> Optional[int]:
+        v = self.envelope.get("statusCode")
+        try:
+            return int(v) if v not in (None, "") else self._status_default
+        except (TypeError, ValueError):
+            return self._status_default
+
+    @property
+    def entity(self) -> str:
+        return self.envelope.get("entityName", "") or ""
+
+    @property
+    def raw_error(self) -> str:
+        if self.body is None:
+            return f"Exception parsing API response JSON: {self._parse.body_error}"
+        return self.envelope.get("errorMessage", "") or ""
+
+    error_message = raw_error
+
+    # ----------------------------
+    # Payload
+    # ----------------------------
+    def _is_text_payload(self) -> bool:
+        txt = self._parse.payload_text
+        return bool(self._text_payload and txt and not txt.startswith(("{", "[")))
+
+    @property
+    def payload_text(self) -> Optional[str]:
+        return self._parse.payload_text
+
+    @property
+    def decoded_payload(self) -> Optional[Any]:
+        if self._is_text_payload():
+            return {"_payload_text": self._parse.payload_text}
+        return self._parse.payload
+
+    @property
+    def payload_error(self) -> Optional[Exception]:
+        self._parse.payload
+        return None if self._is_text_payload() else self._parse.payload_error
+
+    @property
+    def messages(self) -> List[str]:
+        """Decode problems, else the envelope errorMessage. Decoders may replace it with element errors."""
+        if self._messages is None:
+            msgs: List[str] = []
+            if self.payload_error is not None:
+                msgs.append(f"Failed to decode payload: {self.payload_error}")
+            if self.raw_error and not msgs:
+                msgs.append(self.raw_error)
+            self._messages = msgs
+        return self._messages
+
+    @messages.setter
+    def messages(self, value: List[str]) -> None:
+        self._messages = list(value or [])
+
+    # ----------------------------
+    # Element views
+    # ----------------------------
+    def elements(self) -> List[Dict[str, Any]]:
+        """XLSOrder / XLPOrder / XLItem elements of the payload, whatever the wrapper."""
+        return self._parse.elements()
+
+    def sorder_messages(self) -> List[str]:
+        """Per-order / per-line ErrorMessages of an XLSOrders reply."""
+        msgs: List[str] = []
+        for so in self.elements():
+            sn = so.get("SOrderNum", "")
+            hdr = so.get("ErrorMessage")
+            if hdr:
+                msgs.append(f"SO {sn}: {str(hdr).strip()}")
+            for line in so.get("XLSOrderPrice", []) or []:
+                lm = line.get("ErrorMessage")
+                if lm:
+                    msgs.append(f"SO {sn} Item {line.get('ItemCode', '')}: {str(lm).strip()}")
+        return msgs
+
+    def item_messages(self) -> List[str]:
+        """Per-item ErrorMessages of an XLItems reply."""
+        return [
+            f"Item {it.get('ItemCode', '')}: {str(it.get('ErrorMessage')).strip()}"
+            for it in self.elements()
+            if it.get("ErrorMessage")
+        ]
+
+    def line_errors(self, element: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """XLSOrderLine rows (line, item, message, action) of element (default: the first order)."""
+        if element is None:
+            els = self.elements()
+            element = els[0] if els else None
+        if not isinstance(element, dict):
+            return []
+        lines = element.get("XLSOrderLine")
+        if isinstance(lines, dict):
+            lines = [lines]
+        return [
+            {
+                "SOrderLineNum": ln.get("SOrderLineNum") or ln.get("sorderlinenum"),
+                "ItemCode": ln.get("ItemCode") or ln.get("itemcode"),
+                "ErrorMessage": ln.get("ErrorMessage") or ln.get("errorMessage"),
+                "Action": ln.get("Action") or ln.get("action"),
+            }
+            for ln in lines or []
+            if isinstance(ln, dict)
+        ]
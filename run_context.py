@@ -0,0 +1,184 @@
+# lws_workflow/run_context.py
+"""
+Run-scoped Radius read cache.
+
+run_once() starts a RunContext and binds its read-only Radius connection(s).
+While the run is active, db.rquery() on a bound connection memoizes results
+keyed by (SQL, params), so rows read in Phase 2A, the Phase 2A HOLD handler,
+Phase 2B and process_one_order only hit Radius once per run.
+
+Rules:
+- only bound (read-only) connections are cached; the rw connection never is
+- empty results are not cached (a record may be created later in the run),
+  nor results the caller's rquery(cache_if=...) rejects (Radius still catching up)
+- writes made by this run invalidate every cached query on the touched tables:
+    * XLink posts       -> api.send_post_request -> invalidate_for_entity()
+    * rexec / execute   -> invalidate_for_sql()
+    * direct UPDATEs    -> invalidate_tables() at the call site
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from logger import get_logger
+
+log = get_logger("run_context")
+
+# "PUB"."PV_SOrder" / pub.pv_sorder / PUB."PM_Item" -> pv_sorder / pm_item
+_TABLE_RE = re.compile(r'\bpub"?\s*\.\s*"?([a-z0-9_]+)', re.IGNORECASE)
+
+# Radius tables an XLink entity can change (unknown entities clear the whole cache)
+ENTITY_TABLES = {
+    "XLinkAPISOrder": ("pv_sorder", "pv_sorderline"),
+    "XLinkAPIPOrder": ("pv_porder", "pv_porderline", "pv_req"),
+    "XLinkAPIShipReq": ("pv_shipreq", "pv_shipreqline"),
+    "XLinkAPIItem": ("pm_item", "pv_item"),
+    "AdvancedOrderProcessing": ("pv_job", "pv_jobline", "pv_jobsolink", "pv_req", "pv_sorder", "pv_sorderline"),
+    "GetItem": (),  # read-only
+}
+
+
+def tables_in_sql(sql: str) -> set:
+    return {m.lower() for m in _TABLE_RE.findall(sql or "")}
+
+
+class RunContext:
+    """Per-run memo of read-only rquery results (thread-safe; Phase 1 workers share it)."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self._bound: Dict[int, Any] = {}
+        self._cache: Dict[Tuple[str, Tuple[Any, ...]], Tuple[List[Dict[str, Any]], set]] = {}
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    # ----------------------------
+    # Connections
+    # ----------------------------
+    def bind(self, conn) -> None:
+        with self._lock:
+            self._bound[id(conn)] = conn
+
+    def unbind(self, conn) -> None:
+        with self._lock:
+            self._bound.pop(id(conn), None)
+
+    def is_bound(self, conn) -> bool:
+        return self._bound.get(id(conn)) is conn
+
+    # ----------------------------
+    # Cache
+    # ----------------------------
+    def get(self, sql: str, params: Tuple[Any, ...]) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """Returns (rows or None, generation). Pass the generation back to put()."""
+        key = (sql, tuple(params))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, self._generation
+            self.hits += 1
+            return [dict(r) for r in entry[0]], self._generation
+
+    def put(self, sql: str, params: Tuple[Any, ...], rows: List[Dict[str, Any]], generation: int) -> None:
+        if not rows:
+            return
+        with self._lock:
+            # A write landed while the query ran: the rows may already be stale
+            if generation != self._generation:
+                return
+            self._cache[(sql, tuple(params))] = ([dict(r) for r in rows], tables_in_sql(sql))
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> None:
+        """Drops cached queries on `tables` (None = everything)."""
+        with self._lock:
+            self._generation += 1
+            if tables is None:
+                dropped = len(self._cache)
+                self._cache.clear()
+            else:
+                wanted = {str(t).lower() for t in tables}
+                if not wanted:
+                    return
+                stale = [k for k, (_, t) in self._cache.items() if not t or (t & wanted)]
+                for k in stale:
+                    del self._cache[k]
+                dropped = len(stale)
+            self.invalidated += dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "run_id": self.run_id,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(100.0 * self.hits / lookups, 1) if lookups else 0.0,
+                "entries": len(self._cache),
+                "invalidated": self.invalidated,
+            }
+
+
+# ------------------------------------------------------------
+# Active context (one run at a time per process; run_once is serialized)
+# ------------------------------------------------------------
+_ACTIVE: Optional[RunContext] = None
+_ACTIVE_LOCK = threading.Lock()
+
+
+def current() -> Optional[RunContext]:
+    return _ACTIVE
+
+
+def start_run_context(run_id: str) -> RunContext:
+    global _ACTIVE
+    ctx = RunContext(run_id)
+    with _ACTIVE_LOCK:
+        _ACTIVE = ctx
+    return ctx
+
+
+def end_run_context(ctx: Optional[RunContext]) -> dict:
+    """Deactivates ctx and returns its stats (hit rate etc.)."""
+    global _ACTIVE
+    if ctx is None:
+        return {}
+    with _ACTIVE_LOCK:
+        if _ACTIVE is ctx:
+            _ACTIVE = None
+    return ctx.stats()
+
+
+def invalidate_tables(*tables: str) -> None:
+    ctx = _ACTIVE
+    if ctx is not None:
+        ctx.invalidate(tables)
+
+
+def invalidate_all() -> None:
+    ctx = _ACTIVE
+    if ctx is not None:
+        ctx.invalidate(None)
+
+
+def invalidate_for_sql(sql: str) -> None:
+    ctx = _ACTIVE
+    if ctx is None or (sql or "").lstrip().upper().startswith("SELECT"):
+        return
+    tables = tables_in_sql(sql)
+    ctx.invalidate(tables if tables else None)
+
+
+def invalidate_for_entity(entity_name: str) -> None:
+    ctx = _ACTIVE
+    if ctx is None:
+        return
+    tables = ENTITY_TABLES.get(entity_name)
+    if tables is None:
+        ctx.invalidate(None)
+    elif tables:
+        ctx.invalidate(tables)
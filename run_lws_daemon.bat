@@ -0,0 +1,60 @@
+@echo off
+setlocal enabledelayedexpansion
+title LWS_Workflow_Daemon
+
+REM ==========================================
+REM LWS Workflow Daemon Runner (Rotating Log)
+REM  - One long-running process (replaces scheduling run_lws_workflow.bat)
+REM  - Writes to logs\daemon.log
+REM  - Rotates daily OR when > 5MB
+REM  - Keeps 5 rotated logs (zipped)
+REM  - Restarts the daemon if it exits
+REM ==========================================
+
+REM ===== Config =====
+set "WORKDIR=C:\Work\lws_workflow"
+set "SCRIPT=%WORKDIR%\daemon.py"
+set "LOG_DIR=%WORKDIR%\logs"
+
+REM ✅ Force 64-bit Python
+set "PY=C:\Users\rdevelopment\AppData\Local\Programs\Python\Python313\python.exe"
+
+REM ----- Ensure log dir exists -----
+if not exist "%LOG_DIR%" mkdir "%LOG_DIR%"
+
+REM ----- Base log file (single file) -----
+set "BASELOG=%LOG_DIR%\daemon.log"
+
+cd /d "%WORKDIR%"
+
+:START
+
+REM ✅ Rotate log before starting (daily + size, keep 5, compress)
+powershell -NoProfile -ExecutionPolicy Bypass -File "%WORKDIR%\scripts\rotate_logs.ps1" ^
+  -LogFile "%BASELOG%" -MaxMB 5 -Keep 5 -RotateDaily -Compress
+
+REM Locale-safe timestamp for header
+for /f %%i in ('powershell -NoProfile -Command "Get-Date -Format yyyy-MM-dd HH:mm:ss"') do set "TS=%%i"
+
+echo ====================================================== >> "%BASELOG%"
+echo ===== DAEMON START: %TS%  User=%USERNAME% ===== >> "%BASELOG%"
+echo ====================================================== >> "%BASELOG%"
+
+"%PY%" "%SCRIPT%" >> "%BASELOG%" 2>&1
+set "RC=%ERRORLEVEL%"
+
+REM Timestamp for exit header
+for /f %%i in ('powershell -NoProfile -Command "Get-Date -Format yyyy-MM-dd HH:mm:ss"') do set "TS=%%i"
+
+echo ====================================================== >> "%BASELOG%"
+echo ===== DAEMON EXIT: %TS%  ExitCode=%RC% ===== >> "%BASELOG%"
+echo ====================================================== >> "%BASELOG%"
+
+if not "%RC%"=="0" (
+    echo [ERROR] Workflow daemon failed. Sending alert email... >> "%BASELOG%"
+    "%PY%" "%WORKDIR%\send_fail_email.py" "%BASELOG%" "%RC%" >> "%BASELOG%" 2>&1
+)
+
+echo Daemon stopped/crashed (ExitCode=%RC%). Restarting in 5 seconds...
+timeout /t 5 /nobreak >nul
+goto START
@@ -0,0 +1,136 @@
+# lws_workflow/services/aop_batch.py
+"""
+Batched AdvancedOrderProcessing (AOP) job creation, shared by job_p4 / job_p2.
+
+One AOP request carries every SO in OrderProcessingLoadCriteria. GroupingMode 2
+groups per sales order, so each Output.Results[] entry belongs to one SO; it is
+matched back through the SO numbers in its Requirements[].Source (or SOrderNum)
+and handed to the plant's own single-result interpreter, so JobHold reasons and
+the raw result text stay per SO.
+
+SOs the response does not account for (the batch failed, or a result could not
+be matched) are looked up in PV_JobSOLink first, then the batch is split in two
+and each half retried (bisect) down to the plain single-SO create call, so one
+bad order does not block the rest.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List
+
+from api import send_post_request, decode_generic, b64_json
+
+_SO_KEYS = ("SOrderNum", "Sales Order", "SalesOrder", "Source")
+_NUM_RE = re.compile(r"\d+")
+
+
+def aop_payload(plant: str, sordernums: List[int]) -> dict:
+    return {
+        "AdvancedGroupingParameters": {
+            "UserCode": "Radius",
+            "GroupingMode": 2,
+            "ShowLoadingMessages": False,
+        },
+        "OrderProcessingLoadCriteria": [
+            {"CompNum": 2, "SOPlantCode": str(plant), "SOrderNum": int(so)} for so in sordernums
+        ],
+    }
+
+
+def _so_numbers(d: Any) -> set:
+    if not isinstance(d, dict):
+        return set()
+    nums = set()
+    for k, v in d.items():
+        if k in _SO_KEYS and v is not None:
+            nums.update(int(n) for n in _NUM_RE.findall(str(v)))
+    return nums
+
+
+def results_by_so(dp: dict, sordernums: List[int]) -> Dict[int, dict]:
+    """{SOrderNum: its Output.Results[] entry} for the results that name exactly one of sordernums."""
+    wanted = {int(so) for so in sordernums}
+    out: Dict[int, dict] = {}
+    for r in ((dp or {}).get("Output", {}) or {}).get("Results", []) or []:
+        if not isinstance(r, dict):
+            continue
+        nums = _so_numbers(r)
+        for req in r.get("Requirements") or []:
+            nums |= _so_numbers(req)
+        hit = nums & wanted
+        if len(hit) == 1:
+            out.setdefault(hit.pop(), r)
+    return out
+
+
+def create_jobs(
+    ro_conn,
+    plant: str,
+    sordernums: List[int],
+    job_from_result: Callable[[int, dict, Any, Any, dict], str],
+    single_create: Callable[[int], str],
+    find_existing: Callable[[Any, List[int]], Dict[int, str]],
+    logger,
+) -> Dict[str, Any]:
+    """
+    Returns {str(SOrderNum): JobCode or the exception for that SO}.
+
+    job_from_result(so, result, resp, decoded, dp) returns the JobCode or raises
+    the same error the single create would; single_create(so) is the original
+    one-SO call; find_existing(ro_conn, sos) is the PV_JobSOLink batch lookup.
+    """
+    out: Dict[str, Any] = {}
+
+    def _run(sos: List[int]) -> None:
+        if len(sos) == 1:
+            try:
+                out[str(sos[0])] = single_create(sos[0])
+            except Exception as e:
+                out[str(sos[0])] = e
+            return
+
+        per_so: Dict[int, dict] = {}
+        try:
+            resp = send_post_request("AdvancedOrderProcessing", b64_json(aop_payload(plant, sos)), logger)
+            decoded = decode_generic(resp)
+            dp = decoded.decoded_payload or {}
+            per_so = results_by_so(dp, sos)
+        except Exception as e:
+            logger.warning(f"[Batch AOP P{plant}] {len(sos)} SO(s): batch call failed: {e}")
+
+        for so, result in per_so.items():
+            try:
+                out[str(so)] = job_from_result(so, result, resp, decoded, dp)
+            except Exception as e:
+                out[str(so)] = e
+
+        left = [so for so in sos if str(so) not in out]
+        if not left:
+            return
+
+        try:
+            existing = find_existing(ro_conn, left)
+        except Exception as e:
+            logger.warning(f"[Batch AOP P{plant}] PV_JobSOLink lookup failed: {e}")
+            existing = {}
+        for so in left:
+            if existing.get(int(so)):
+                out[str(so)] = str(existing[int(so)])
+
+        left = [so for so in left if str(so) not in out]
+        if left:
+            logger.warning(f"[Batch AOP P{plant}] {len(left)}/{len(sos)} SO(s) unresolved; splitting and retrying")
+            mid = len(left) // 2
+            _run(left[:mid] or left)
+            if mid:
+                _run(left[mid:])
+
+    _run([int(so) for so in sordernums])
+
+    ok = sum(1 for v in out.values() if not isinstance(v, Exception))
+    logger.info(f"[Batch AOP P{plant}] {ok}/{len(out)} job(s) created")
+    return out
+
+
+def result_raw_text(result: dict) -> str:
+    """The SO's own Results[] entry, kept as the raw response for fail_order emails."""
+    return json.dumps(result, default=str)[:4000]
@@ -0,0 +1,92 @@
+# lws_workflow/services/batch_create.py
+"""
+Run-scoped batcher for Phase 1 create calls.
+
+An order that needs a new record (e.g. its PolyTex PO) queues the request with
+add() and parks itself in the deferred queue. run_deferred_checks() calls
+flush(), which creates the queued records BATCH_CREATE_SIZE at a time with one
+XLink call per chunk, then resumes the parked orders; they pick up their own
+outcome with result(): the new record number, or the exception for that order
+alone (raised so fail_order records the API details against the right order).
+
+KINDS: kind -> batch creator(ro_conn, [request, ...], logger) -> {key: result | Exception}
+"""
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from config import BATCH_CREATE_SIZE
+from logger import get_logger
+from services.job_p2 import create_jobs_p2
+from services.job_p4 import create_jobs_p4
+from services.polytex_po import create_polytex_pos
+from services.starpak_so import create_starpak_sos
+
+log = get_logger("batch_create")
+
+# kind -> (creator, request field holding the key)
+KINDS: Dict[str, Tuple[Callable[..., Dict[str, Any]], str]] = {
+    "JOB_P4": (create_jobs_p4, "sordernum"),
+    "PO_P4": (create_polytex_pos, "jobcode"),
+    "SO_P2": (create_starpak_sos, "pordernum"),
+    "JOB_P2": (create_jobs_p2, "sordernum"),
+}
+
+_MISSING = object()
+
+
+class CreateBatcher:
+    """Thread-safe: Phase 1 workers add() concurrently, flush() runs between passes."""
+
+    def __init__(self, size: int = BATCH_CREATE_SIZE):
+        self.size = max(1, int(size))
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {k: {} for k in KINDS}
+        self._results: Dict[str, Dict[str, Any]] = {k: {} for k in KINDS}
+
+    def add(self, kind: str, request: Dict[str, Any]) -> None:
+        key = str(request[KINDS[kind][1]])
+        with self._lock:
+            if key not in self._results[kind]:
+                self._pending[kind][key] = request
+
+    def discard(self, kind: str, key: Any) -> None:
+        with self._lock:
+            self._pending[kind].pop(str(key), None)
+
+    def result(self, kind: str, key: Any) -> Any:
+        """The outcome for key, or None while it has not been created yet."""
+        with self._lock:
+            out = self._results[kind].get(str(key), _MISSING)
+        return None if out is _MISSING else out
+
+    def has_result(self, kind: str, key: Any) -> bool:
+        with self._lock:
+            return str(key) in self._results[kind]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def flush(self, ro_conn, logger=log) -> int:
+        """Creates everything queued so far. Returns the number of records attempted."""
+        done = 0
+        for kind, (creator, _) in KINDS.items():
+            with self._lock:
+                items = list(self._pending[kind].items())
+                self._pending[kind].clear()
+
+            for i in range(0, len(items), self.size):
+                chunk = dict(items[i:i + self.size])
+                try:
+                    results = creator(ro_conn, list(chunk.values()), logger) or {}
+                except Exception as e:
+                    logger.error(f"[Batch {kind}] {len(chunk)} request(s) failed: {e}")
+                    results = {}
+
+                with self._lock:
+                    for key in chunk:
+                        self._results[kind][key] = results.get(
+                            key, RuntimeError(f"{kind} batch create returned no result for {key}")
+                        )
+                done += len(chunk)
+        return done
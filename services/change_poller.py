@@ -0,0 +1,223 @@
+# lws_workflow/services/change_poller.py
+"""
+Incremental Phase 2A change detection.
+
+Two signals decide which monitored SOs Phase 2A re-checks:
+  - QTY_CHANGE events from the LWS_Workflow_Outbox (primary qty signal, written
+    by trg_LWS_OrderLineQtyChange) when PHASE2A_OUTBOX_ENABLED
+  - Radius LastUpdatedDateTime high-water marks per source (sync_watermarks),
+    which also catch header edits such as CustRef, when WATERMARK_POLLING_ENABLED
+
+A missing mark, a failed source query or an overdue full sweep
+(WATERMARK_FULL_SWEEP_MINUTES) turns the run into a full sweep, and the caller
+re-checks every monitored SO as before. Marks are saved and outbox events
+acknowledged only after Phase 2A ran (commit_marks), so a crashed run sees the
+same window and events again. SOs the scheduler budget left unchecked do not
+hold the marks back: they are flagged pending in monitor_checks and the next
+run checks them whatever its window says.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from config import (
+    PHASE2A_OUTBOX_ENABLED,
+    WATERMARK_POLLING_ENABLED,
+    WATERMARK_OVERLAP_MINUTES,
+    WATERMARK_FULL_SWEEP_MINUTES,
+)
+from db import rquery, get_watermarks, set_watermarks, mark_monitor_pending
+from logger import get_logger
+
+log = get_logger("change_poller")
+
+FULL_SWEEP_SOURCE = "PHASE2A_FULL_SWEEP"
+
+# source -> (changed-rows SQL, max-timestamp SQL); both scoped to Plant 4 SOs
+SOURCES = {
+    "SO4_HEADER": (
+        """
+        SELECT so."SOrderNum" AS SOrderNum, so."LastUpdatedDateTime" AS LastUpdatedDateTime
+        FROM "PUB"."PV_SOrder" so
+        WHERE so."CompNum" = 2
+          AND so."PlantCode" = '4'
+          AND so."LastUpdatedDateTime" >= ?
+        """,
+        """
+        SELECT MAX(so."LastUpdatedDateTime") AS HighWater
+        FROM "PUB"."PV_SOrder" so
+        WHERE so."CompNum" = 2
+          AND so."PlantCode" = '4'
+        """,
+    ),
+    "SO4_LINE": (
+        """
+        SELECT sol."SOrderNum" AS SOrderNum, sol."LastUpdatedDateTime" AS LastUpdatedDateTime
+        FROM "PUB"."PV_SOrderLine" sol
+        WHERE sol."CompNum" = 2
+          AND sol."PlantCode" = '4'
+          AND sol."LastUpdatedDateTime" >= ?
+        """,
+        """
+        SELECT MAX(sol."LastUpdatedDateTime") AS HighWater
+        FROM "PUB"."PV_SOrderLine" sol
+        WHERE sol."CompNum" = 2
+          AND sol."PlantCode" = '4'
+        """,
+    ),
+}
+
+
+def _to_iso(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return str(value).strip() or None
+
+
+def _from_iso(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except Exception:
+        return None
+
+
+def _full_sweep_due(marks: Dict[str, Dict[str, Any]]) -> bool:
+    last = _from_iso((marks.get(FULL_SWEEP_SOURCE) or {}).get("updated_ts"))
+    if last is None:
+        return True
+    if last.tzinfo is None:
+        last = last.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - last >= timedelta(minutes=WATERMARK_FULL_SWEEP_MINUTES)
+
+
+def _poll_outbox(changed: set, result: Dict[str, Any]) -> bool:
+    """Adds pending QTY_CHANGE SOs to changed; returns False when the outbox could not be read."""
+    from services.outbox import outbox_conn, fetch_pending, qty_change_lines
+
+    try:
+        conn = outbox_conn()
+        try:
+            events = fetch_pending(conn, change_types=("QTY_CHANGE",))
+        finally:
+            conn.close()
+    except Exception as e:
+        log.warning(f"[Outbox] QTY_CHANGE poll failed, falling back to full sweep: {e}")
+        return False
+
+    for ev in events:
+        result["outbox_events"].setdefault(ev.sordernum, []).append(ev.outbox_id)
+    result["qty_lines"] = qty_change_lines(events)
+    changed.update(result["qty_lines"])
+    if events:
+        log.info(f"[Outbox] {len(events)} QTY_CHANGE event(s) for {len(result['qty_lines'])} SO(s)")
+    return True
+
+
+def poll_changed_so4(ro_conn) -> Optional[Dict[str, Any]]:
+    """
+    Returns {
+        "so4":        SO4s with a pending QTY_CHANGE event or touched in Radius,
+                      or None when this run must be a full sweep,
+        "marks":      {source: new high water} (saved by commit_marks),
+        "outbox_events": {SO4: [outbox id, ...]} to acknowledge after Phase 2A
+                      (monitored SOs) or Phase 1 (the rest),
+        "qty_lines":  {SO4: {line, ...}} from those events,
+    }
+    Returns None when both signals are disabled (every run is a full sweep).
+    """
+    if not (WATERMARK_POLLING_ENABLED or PHASE2A_OUTBOX_ENABLED):
+        return None
+
+    marks = get_watermarks()
+    full = _full_sweep_due(marks)
+
+    changed = set()
+    new_marks: Dict[str, Optional[str]] = {}
+    result: Dict[str, Any] = {"so4": None, "marks": new_marks, "outbox_events": {}, "qty_lines": {}}
+
+    if PHASE2A_OUTBOX_ENABLED and not _poll_outbox(changed, result):
+        full = True
+
+    for source, (changed_sql, max_sql) in (SOURCES.items() if WATERMARK_POLLING_ENABLED else ()):
+        mark = _from_iso((marks.get(source) or {}).get("high_water"))
+        try:
+            if mark is None:
+                # First run for this source: start the mark at Radius' current max, sweep everything
+                rows = rquery(ro_conn, max_sql, ())
+                new_marks[source] = _to_iso(rows[0].get("highwater")) if rows else None
+                full = True
+                continue
+
+            since = mark - timedelta(minutes=WATERMARK_OVERLAP_MINUTES)
+            rows = rquery(ro_conn, changed_sql, (since,))
+        except Exception as e:
+            log.warning(f"[Watermark] {source} poll failed, falling back to full sweep: {e}")
+            full = True
+            continue
+
+        high = mark
+        for r in rows:
+            so = r.get("sordernum")
+            if so is not None:
+                changed.add(int(so))
+            ts = r.get("lastupdateddatetime")
+            if isinstance(ts, datetime) and ts > high:
+                high = ts
+        new_marks[source] = _to_iso(high)
+
+    if full:
+        new_marks[FULL_SWEEP_SOURCE] = None  # updated_ts records when the sweep ran
+        log.info("[Watermark] Full Phase 2A sweep this run.")
+        return result
+
+    log.info(f"[Watermark] SO4s changed since last poll: {len(changed)}")
+    result["so4"] = changed
+    return result
+
+
+def commit_marks(
+    poll: Optional[Dict[str, Any]],
+    skipped: Iterable[int] = (),
+    handled: Optional[Iterable[int]] = None,
+) -> None:
+    """
+    Saves the new marks and acknowledges the outbox events once Phase 2A processed them.
+    skipped = SOs the scheduler left for a later run: they are flagged pending for
+    Phase 2A (monitor_checks) and their events stay Pending; the marks (including
+    the full-sweep mark) still move, so the next run stays incremental.
+    handled = SOs Phase 2A checked (None = all); events of the other SOs stay
+    Pending for ack_events() once Phase 1 has handled them.
+    """
+    if not poll:
+        return
+    skipped = {int(so) for so in skipped or ()}
+
+    # Pending first: if saving the marks fails, the SOs are still queued
+    if skipped:
+        mark_monitor_pending("2A", sorted(skipped))
+    if poll.get("marks"):
+        set_watermarks(poll["marks"])
+
+    sos = (poll.get("outbox_events") or {}).keys() if handled is None else handled
+    ack_events(poll, [so for so in sos if int(so) not in skipped])
+
+
+def ack_events(poll: Optional[Dict[str, Any]], sos: Iterable[int]) -> None:
+    """Marks the polled QTY_CHANGE events of the given SOs Sent."""
+    events = (poll or {}).get("outbox_events") or {}
+    ids = [i for so in dict.fromkeys(int(so) for so in sos) for i in events.get(so, ())]
+    if ids:
+        from services.outbox import outbox_conn, mark_sent
+
+        try:
+            conn = outbox_conn()
+            try:
+                mark_sent(conn, ids)
+            finally:
+                conn.close()
+        except Exception as e:
+            # Left Pending: the next run simply re-checks those SOs
+            log.warning(f"[Outbox] Could not acknowledge {len(ids)} QTY_CHANGE event(s): {e}")
@@ -1,6 +1,6 @@
 from typing import List
 from datetime import datetime, timezone, timedelta
-from db import rquery
+from db import rquery, rquery_in
 from logger import get_logger
 
 from config import LWS_ELIGIBILITY_START_DATE
@@ -11,8 +11,8 @@ log = get_logger("eligibility")
 def format_dt_tz(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + "+00:00"
 
-def find_eligible_sorders(conn, limit: int) -> List[int]:
-    sql = """
+
+ELIGIBLE_SORDERS_SQL = """
     SELECT DISTINCT so."SOrderNum" AS SOrderNum
     FROM "PUB"."PV_SOrder" so
     JOIN "PUB"."PV_SOrderLine" sol
@@ -30,11 +30,20 @@ def find_eligible_sorders(conn, limit: int) -> List[int]:
       AND it."ProdGroupCode" = 'P4-LWS'
       --AND it."ItemStatusCode" = 'APP'
       AND so."SOrderDate" >= ?
+"""
+
+
+def _eligibility_start_date():
+    # ✅ convert config string to Python date object
+    return datetime.strptime(LWS_ELIGIBILITY_START_DATE, "%m/%d/%Y").date()
+
+
+def find_eligible_sorders(conn, limit: int) -> List[int]:
+    sql = ELIGIBLE_SORDERS_SQL + """
     ORDER BY so."SOrderNum" DESC
     """
 
-    # ✅ convert config string to Python date object
-    start_date = datetime.strptime(LWS_ELIGIBILITY_START_DATE, "%m/%d/%Y").date()
+    start_date = _eligibility_start_date()
 
     rows = rquery(conn, sql, (start_date,))
     sorders = [int(r.get("SOrderNum") or r.get("sordernum")) for r in rows[:limit]]
@@ -42,3 +51,24 @@ def find_eligible_sorders(conn, limit: int) -> List[int]:
 
     log.info(f"Eligible LWS SOs since {LWS_ELIGIBILITY_START_DATE}: {len(sorders)}")
     return sorders
+
+
+def filter_eligible_sorders(conn, sordernums: List[int]) -> List[int]:
+    """
+    Same eligibility rules as find_eligible_sorders, applied to a given list of SOs
+    (targeted runs). Keeps the caller's order.
+    """
+    nums = [int(x) for x in sordernums or []]
+    if not nums:
+        return []
+
+    sql = ELIGIBLE_SORDERS_SQL + """
+      AND so."SOrderNum" IN ({marks})
+    """
+    rows = rquery_in(conn, sql, nums, params_before=(_eligibility_start_date(),))
+    ok = {int(r.get("SOrderNum") or r.get("sordernum")) for r in rows}
+
+    skipped = [so for so in nums if so not in ok]
+    if skipped:
+        log.info(f"Targeted SOs not eligible (skipped): {skipped}")
+    return [so for so in nums if so in ok]
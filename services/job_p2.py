@@ -3,7 +3,7 @@
 from typing import Optional
 
 from api import send_post_request, decode_generic, b64_json
-from db import rquery
+from db import rquery, rquery_in
 from logger import get_logger
 
 log = get_logger("job_p2")
@@ -32,6 +32,28 @@ def find_existing_job_p2(conn, sordernum: int) -> Optional[str]:
     return None
 
 
+def find_existing_jobs_p2(conn, sordernums: list[int]) -> dict[int, str]:
+    """
+    Batch version of find_existing_job_p2: {Plant2 SOrderNum: JobCode} (latest TableRecId wins).
+    """
+    sql = """
+    SELECT "SOrderNum" AS SOrderNum, "JobCode" AS JobCode
+    FROM "PUB"."PV_JobSOLink"
+    WHERE "CompNum" = 2
+      AND "PlantCode" = '2'
+      AND "SOPlantCode" = '2'
+      AND "SOrderNum" IN ({marks})
+    ORDER BY "TableRecId" DESC
+    """
+    out: dict[int, str] = {}
+    for r in rquery_in(conn, sql, [int(x) for x in sordernums or []]):
+        so = r.get("SOrderNum") or r.get("sordernum")
+        jc = r.get("JobCode") or r.get("jobcode")
+        if so is not None and jc and int(so) not in out:
+            out[int(so)] = str(jc)
+    return out
+
+
 def _first_key(d: dict, *keys, default=None):
     """Try keys in order, then case-insensitive."""
     if not isinstance(d, dict):
@@ -149,7 +171,11 @@ def create_job_p2(sordernum: int, customer: str, logger) -> str:
         raise RuntimeError(f"JOB_P2 did not produce a Job Code: {reason}")
 
     r0 = results[0] if isinstance(results[0], dict) else {}
+    return _job_from_result(sordernum, r0, dp)
 
+
+def _job_from_result(sordernum: int, r0: dict, dp: dict) -> str:
+    """JobCode from one Output.Results[] entry, or JobHold / RuntimeError with the best reason."""
     # If Errors exist, prefer them
     errors = _first_key(r0, "Errors", "Error", "errors", default="")
     errors = str(errors).strip() if errors is not None else ""
@@ -168,3 +194,31 @@ def create_job_p2(sordernum: int, customer: str, logger) -> str:
 
     log.info(f"Plant2 job created for SO {sordernum}: JobCode={job_code}")
     return str(job_code)
+
+
+def create_jobs_p2(ro_conn, requests: list[dict], logger) -> dict:
+    """
+    Batch version of create_job_p2 (one AOP call for many Plant2 SOs, see services/aop_batch.py).
+    requests = [{"sordernum", "customer"}]. Returns {str(SOrderNum): JobCode or exception}.
+    """
+    from services.aop_batch import create_jobs, result_raw_text
+
+    def _from_result(so, r, resp, decoded, dp):
+        try:
+            # Reason fallback only sees this SO's own result
+            return _job_from_result(so, r, {**dp, "Output": {**(dp.get("Output") or {}), "Results": [r]}})
+        except Exception as e:
+            e.api_entity = "AdvancedOrderProcessing"
+            e.api_status = getattr(decoded, "status_code", None)
+            e.raw_response_text = result_raw_text(r)
+            raise
+
+    customers = {int(r["sordernum"]): r.get("customer") for r in requests or []}
+    return create_jobs(
+        ro_conn, "2", list(customers),
+        job_from_result=_from_result,
+        single_create=lambda so: create_job_p2(so, customers[so], logger),
+        find_existing=find_existing_jobs_p2,
+        logger=logger,
+    )
+
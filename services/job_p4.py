@@ -4,7 +4,7 @@ from typing import Optional
 import html
 
 from api import send_post_request, decode_generic, b64_json
-from db import rquery
+from db import rquery, rquery_in
 from logger import get_logger
 
 
@@ -22,10 +22,12 @@ def _raise_aop_error(
     resp,
     decoded,
     decoded_payload=None,
+    raw_text=None,
 ):
     """
     Raise an exception that carries raw API response + decoded details so fail_order()
-    can always include them in the admin email.
+    can always include them in the admin email. raw_text overrides resp.text
+    (batched calls keep only the SO's own result).
     """
     ex = exc_cls(message)
 
@@ -40,10 +42,13 @@ def _raise_aop_error(
         ex.api_error_message = str(env_err)
 
     # Raw response text (best for email)
-    try:
-        ex.raw_response_text = resp.text
-    except Exception:
-        ex.raw_response_text = str(resp)
+    if raw_text is not None:
+        ex.raw_response_text = raw_text
+    else:
+        try:
+            ex.raw_response_text = resp.text
+        except Exception:
+            ex.raw_response_text = str(resp)
 
     # Optional: attach decoded payload if caller passes it
     if decoded_payload is not None:
@@ -71,6 +76,29 @@ def find_existing_job_p4(conn, sordernum: int) -> Optional[str]:
     return None
 
 
+def find_existing_jobs_p4(conn, sordernums: list[int]) -> dict[int, str]:
+    """
+    Batch version of find_existing_job_p4: {SOrderNum: JobCode} for SOs that already have a Plant4 job.
+    Same rule as the single lookup (latest TableRecId wins).
+    """
+    sql = """
+    SELECT "SOrderNum" AS SOrderNum, "JobCode" AS JobCode
+    FROM "PUB"."PV_JobSOLink"
+    WHERE "CompNum" = 2
+      AND "PlantCode" = '4'
+      AND "SOPlantCode" = '4'
+      AND "SOrderNum" IN ({marks})
+    ORDER BY "TableRecId" DESC
+    """
+    out: dict[int, str] = {}
+    for r in rquery_in(conn, sql, [int(x) for x in sordernums or []]):
+        so = r.get("SOrderNum") or r.get("sordernum")
+        jc = r.get("JobCode") or r.get("jobcode")
+        if so is not None and jc and int(so) not in out:
+            out[int(so)] = str(jc)
+    return out
+
+
 def create_job_p4(sordernum: int, customer: str, logger) -> str:
     payload = {
         "AdvancedGroupingParameters": {
@@ -122,8 +150,11 @@ def create_job_p4(sordernum: int, customer: str, logger) -> str:
             decoded_payload=dp,
         )
 
-    r0 = results[0]
+    return _job_from_result(sordernum, results[0], resp, decoded, dp)
+
 
+def _job_from_result(sordernum: int, r0: dict, resp, decoded, dp: dict, raw_text=None) -> str:
+    """JobCode from one Output.Results[] entry, or JobHold / RuntimeError with the API details."""
     # If AOP gives Errors, use it (this is the meaningful admin message you want)
     errors = (
         r0.get("Errors")
@@ -139,6 +170,7 @@ def create_job_p4(sordernum: int, customer: str, logger) -> str:
             resp=resp,
             decoded=decoded,
             decoded_payload=dp,
+            raw_text=raw_text,
         )
 
 
@@ -158,7 +190,28 @@ def create_job_p4(sordernum: int, customer: str, logger) -> str:
             resp=resp,
             decoded=decoded,
             decoded_payload=dp,
+            raw_text=raw_text,
         )
 
     log.info(f"Plant4 job created for SO {sordernum}: JobCode={job_code}")
     return str(job_code)
+
+
+def create_jobs_p4(ro_conn, requests: list[dict], logger) -> dict:
+    """
+    Batch version of create_job_p4 (one AOP call for many SOs, see services/aop_batch.py).
+    requests = [{"sordernum", "customer"}]. Returns {str(SOrderNum): JobCode or exception}.
+    """
+    from services.aop_batch import create_jobs, result_raw_text
+
+    customers = {int(r["sordernum"]): r.get("customer") for r in requests or []}
+    return create_jobs(
+        ro_conn, "4", list(customers),
+        job_from_result=lambda so, r, resp, decoded, dp: _job_from_result(
+            so, r, resp, decoded, dp, raw_text=result_raw_text(r),
+        ),
+        single_create=lambda so: create_job_p4(so, customers[so], logger),
+        find_existing=find_existing_jobs_p4,
+        logger=logger,
+    )
+
@@ -1,102 +1,91 @@
 import time
-import pyodbc
-from datetime import datetime
+from datetime import datetime, timezone
 
 from app import run_once
+from db import get_run_lock
 from logger import get_logger
+from services.outbox import outbox_conn, fetch_pending, mark_sent, has_lines
 
 log = get_logger("outbox_listener")
 
-SQL_SERVER = "PRO2SQL"
-DB_NAME = "VisionIIProd"
-USER = "odbcuser"
-PWD = "odbcpass"
-
-CONN_STR = (
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={SQL_SERVER};DATABASE={DB_NAME};UID={USER};PWD={PWD};"
-)
-
 POLL_SECONDS = 30
 
 
-def has_lines(conn, compnum: int, plantcode: str, sordernum: int) -> bool:
-    sql = """
-    SELECT TOP 1 1
-    FROM dbo.PV_SOrderLine
-    WHERE CompNum=? AND PlantCode=? AND SOrderNum=?
-    """
-    cur = conn.cursor()
-    cur.execute(sql, (compnum, plantcode, sordernum))
-    return cur.fetchone() is not None
-
-
-def fetch_pending(conn, batch_size=200):
-    sql = """
-    SELECT TOP (?)
-        OutboxId, ChangeType, CompNum, PlantCode, SOrderNum, SOrderLineNum
-    FROM dbo.LWS_Workflow_Outbox WITH (READPAST)
-    WHERE Status = 'Pending'
-    ORDER BY OutboxId
+def poll_outbox_once() -> int:
     """
-    cur = conn.cursor()
-    cur.execute(sql, (batch_size,))
-    return cur.fetchall()
-
-
-def mark_sent(conn, ids):
-    if not ids:
-        return
-    placeholders = ",".join("?" for _ in ids)
-    sql = f"""
-    UPDATE dbo.LWS_Workflow_Outbox
-    SET Status='Sent', ProcessedAt=SYSUTCDATETIME()
-    WHERE OutboxId IN ({placeholders})
+    Reads pending outbox events once and triggers a targeted run for them.
+    Events are marked Sent only after the run went through (run_once() returned
+    True); a skipped or crashed run leaves them Pending for the next poll.
+    Returns the number of events consumed.
     """
-    cur = conn.cursor()
-    cur.execute(sql, ids)
-    conn.commit()
+    # A run is active in another process: leave the events Pending until it is done
+    lock = get_run_lock()
+    if lock and lock["expires_ts"] > datetime.now(timezone.utc).isoformat():
+        log.debug(f"[Outbox] Run in progress ({lock['owner']}), polling later.")
+        return 0
 
+    conn = outbox_conn()
+    try:
+        rows = fetch_pending(conn)
 
-def main():
-    log.info("LWS Outbox Listener started (polling every 30 sec).")
+        if not rows:
+            return 0
 
-    while True:
-        try:
-            conn = pyodbc.connect(CONN_STR)
-            rows = fetch_pending(conn)
-
-            if not rows:
-                conn.close()
-                time.sleep(POLL_SECONDS)
-                continue
+        log.info(f"[Outbox] Found {len(rows)} pending event(s).")
 
-            log.info(f"[Outbox] Found {len(rows)} pending event(s).")
+        # Group by order number + change type
+        new_orders = set()
+        qty_change_orders = set()
+        outbox_ids = []
 
-            # Group by order number
-            orders_to_process = set()
-            outbox_ids = []
+        for r in rows:
+            outbox_ids.append(r.outbox_id)
 
-            for r in rows:
-                outbox_ids.append(r.OutboxId)
+            # Only process if order has lines
+            if not has_lines(conn, r.compnum, r.plantcode, r.sordernum):
+                log.info(f"[Outbox] SO {r.sordernum} has no lines yet → waiting.")
+                continue
 
-                # Only process if order has lines
-                if has_lines(conn, r.CompNum, r.PlantCode, r.SOrderNum):
-                    orders_to_process.add(r.SOrderNum)
-                else:
-                    log.info(f"[Outbox] SO {r.SOrderNum} has no lines yet → waiting.")
+            if r.change_type == "QTY_CHANGE":
+                qty_change_orders.add(r.sordernum)
+            else:
+                new_orders.add(r.sordernum)
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    if new_orders or qty_change_orders:
+        log.info(
+            f"[Outbox] Targeted run: NEW_ORDER={sorted(new_orders)} "
+            f"QTY_CHANGE={sorted(qty_change_orders)}"
+        )
+        if not run_once(orders=sorted(new_orders), qty_change_orders=sorted(qty_change_orders)):
+            log.info(f"[Outbox] Run did not go through, {len(outbox_ids)} event(s) left Pending.")
+            return 0
+    else:
+        log.info("[Outbox] No eligible orders with lines yet.")
+
+    # ✅ Acknowledge after acting (we don't want duplicates, nor lost events)
+    conn = outbox_conn()
+    try:
+        mark_sent(conn, outbox_ids)
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-            # Mark events as sent (we don't want duplicates)
-            mark_sent(conn, outbox_ids)
+    return len(rows)
 
-            conn.close()
 
-            if orders_to_process:
-                log.info(f"[Outbox] Triggering run_once() for orders: {sorted(orders_to_process)}")
-                run_once()  # workflow will pick eligible orders itself
-            else:
-                log.info("[Outbox] No eligible orders with lines yet.")
+def main():
+    log.info("LWS Outbox Listener started (polling every 30 sec).")
 
+    while True:
+        try:
+            poll_outbox_once()
         except Exception as e:
             log.warning(f"[Outbox Listener] Error (ignored): {e}")
 
@@ -0,0 +1,148 @@
+# lws_workflow/services/monitor_scheduler.py
+"""
+Time-budgeted, priority-ordered Phase 2 monitor scheduler.
+
+Each phase (2A / 2B / 2C) orders its work with prioritize() and runs it in
+batches of PHASE2_BATCH_SIZE through run_batched(). When the phase budget
+(PHASE2x_BUDGET_SECONDS) is used up, the remaining batches are left for the
+next run instead of pushing this run past the next scheduler tick.
+
+Priority (highest first):
+  1. SOs with a pending outbox event (hot)
+  2. SOs not checked within PHASE2_MAX_STALENESS_MINUTES (oldest check first)
+  3. longest in HOLD
+  4. least recently checked
+
+monitor_checks (state DB) records the last check per phase and SO; it is the
+resume cursor: orders skipped by a budget are the least recently checked and
+come first next run. Orders a run had to check because something changed are
+also flagged pending when skipped (change_poller.commit_marks), so an incremental run that
+only looks at new changes still picks them up.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import (
+    PHASE2A_BUDGET_SECONDS,
+    PHASE2B_BUDGET_SECONDS,
+    PHASE2C_BUDGET_SECONDS,
+    PHASE2_BATCH_SIZE,
+    PHASE2_MAX_STALENESS_MINUTES,
+)
+from db import get_monitor_schedule, mark_monitor_checked, get_monitor_pending
+from logger import get_logger
+
+log = get_logger("monitor_scheduler")
+
+PHASE_BUDGETS = {
+    "2A": PHASE2A_BUDGET_SECONDS,
+    "2B": PHASE2B_BUDGET_SECONDS,
+    "2C": PHASE2C_BUDGET_SECONDS,
+}
+
+# Per-run tallies (run_once is serialized; reset by start_run)
+_SKIPPED: Dict[str, int] = {}
+_KEEPALIVE: Optional[Callable[[], None]] = None
+
+
+def start_run(keepalive: Optional[Callable[[], None]] = None) -> None:
+    """keepalive() runs between batches (run lock renewal); it raises to abort the run."""
+    global _KEEPALIVE
+    _SKIPPED.clear()
+    _KEEPALIVE = keepalive
+
+
+def skipped_counts() -> Dict[str, int]:
+    """{phase: orders left for a later run} for the current run."""
+    return dict(_SKIPPED)
+
+
+def _stale_before() -> str:
+    return (datetime.now(timezone.utc) - timedelta(minutes=PHASE2_MAX_STALENESS_MINUTES)).isoformat()
+
+
+def stale_sos(phase: str, so_list: Iterable[int]) -> set:
+    """SOs this phase has never checked or not within the staleness bound."""
+    sos = [int(so) for so in so_list or []]
+    schedule = get_monitor_schedule(phase, sos)
+    cutoff = _stale_before()
+    return {
+        so for so in sos
+        if not (schedule.get(so) or {}).get("last_checked_ts")
+        or schedule[so]["last_checked_ts"] < cutoff
+    }
+
+
+def pending_sos(phase: str, so_list: Iterable[int]) -> set:
+    """SOs of so_list a previous run left pending for this phase."""
+    return get_monitor_pending(phase) & {int(so) for so in so_list or []}
+
+
+def prioritize(
+    phase: str,
+    items: Iterable[Any],
+    so_of: Callable[[Any], int] = int,
+    hot: Iterable[int] = (),
+) -> List[Any]:
+    """Returns items in scheduling order (see module docstring)."""
+    items = list(items or [])
+    if not items:
+        return items
+
+    hot = {int(so) for so in hot or ()}
+    schedule = get_monitor_schedule(phase, [so_of(x) for x in items])
+    cutoff = _stale_before()
+
+    def _key(item):
+        so = int(so_of(item))
+        info = schedule.get(so) or {}
+        last = info.get("last_checked_ts") or ""
+        stale = last < cutoff
+        return (
+            so not in hot,
+            not stale,
+            last if stale else "",
+            info.get("hold_since_ts") or "~",  # no HOLD -> after every HOLD
+            last,
+        )
+
+    return sorted(items, key=_key)
+
+
+def run_batched(
+    phase: str,
+    items: List[Any],
+    process_batch: Callable[[List[Any]], None],
+    so_of: Callable[[Any], int] = int,
+    budget_s: Optional[float] = None,
+) -> List[Any]:
+    """
+    Calls process_batch() batch by batch until the phase budget is used up and
+    returns the items that were processed. The first batch always runs, so a
+    tiny budget still makes progress.
+    """
+    budget = PHASE_BUDGETS.get(phase, 0) if budget_s is None else budget_s
+    t0 = time.monotonic()
+    done: List[Any] = []
+
+    for i in range(0, len(items), PHASE2_BATCH_SIZE):
+        elapsed = time.monotonic() - t0
+        if done and budget and elapsed >= budget:
+            left = len(items) - i
+            _SKIPPED[phase] = _SKIPPED.get(phase, 0) + left
+            log.warning(
+                f"[Scheduler] Phase {phase} budget {budget}s used ({elapsed:.1f}s): "
+                f"{len(done)} checked, {left} left for the next run"
+            )
+            break
+        if done and _KEEPALIVE is not None:
+            _KEEPALIVE()
+
+        batch = items[i:i + PHASE2_BATCH_SIZE]
+        process_batch(batch)
+        mark_monitor_checked(phase, [so_of(x) for x in batch])
+        done.extend(batch)
+
+    log.debug(f"[Scheduler] Phase {phase}: {len(done)}/{len(items)} checked in {time.monotonic() - t0:.1f}s")
+    return done
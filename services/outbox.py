@@ -0,0 +1,159 @@
+# lws_workflow/services/outbox.py
+"""
+Consumer API for dbo.LWS_Workflow_Outbox (fed by the NEW_ORDER / QTY_CHANGE triggers).
+
+Used by the outbox listener (targeted runs) and by run_once (Phase 2A change
+signal). Events are read with fetch_pending() and acknowledged with mark_sent()
+only after the caller has acted on them, so a crashed run sees them again.
+
+OUTBOX_BACKEND=sqlite reads the lws_workflow_outbox stand-in table in the state
+DB instead of SQL Server; enqueue_event() plays the part of the triggers there.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from config import (
+    OUTBOX_BACKEND,
+    OUTBOX_SQL_SERVER,
+    OUTBOX_DB_NAME,
+    OUTBOX_DB_USER,
+    OUTBOX_DB_PASS,
+    OUTBOX_BATCH_SIZE,
+)
+from logger import get_logger
+from models import OutboxEvent
+
+log = get_logger("outbox")
+
+CONN_STR = (
+    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+    f"SERVER={OUTBOX_SQL_SERVER};DATABASE={OUTBOX_DB_NAME};UID={OUTBOX_DB_USER};PWD={OUTBOX_DB_PASS};"
+)
+
+
+def _is_sqlite() -> bool:
+    return OUTBOX_BACKEND == "sqlite"
+
+
+def outbox_conn():
+    """Connection for the configured backend (caller closes it)."""
+    if _is_sqlite():
+        from db import state_conn
+        return state_conn()
+
+    import pyodbc
+    return pyodbc.connect(CONN_STR)
+
+
+def fetch_pending(conn, change_types: Optional[Iterable[str]] = None, limit: int = OUTBOX_BATCH_SIZE) -> List[OutboxEvent]:
+    """Oldest pending events first, optionally only the given change types."""
+    types = [str(t).upper() for t in (change_types or [])]
+    type_filter = f"AND ChangeType IN ({','.join('?' for _ in types)})" if types else ""
+
+    if _is_sqlite():
+        rows = conn.execute(f"""
+            SELECT outbox_id, change_type, compnum, plantcode, sordernum, sorderlinenum
+            FROM lws_workflow_outbox
+            WHERE status = 'Pending'
+              {type_filter.replace('ChangeType', 'change_type')}
+            ORDER BY outbox_id
+            LIMIT ?
+        """, (*types, int(limit))).fetchall()
+        return [
+            OutboxEvent(
+                outbox_id=int(r["outbox_id"]),
+                change_type=str(r["change_type"] or "").upper(),
+                compnum=int(r["compnum"]),
+                plantcode=str(r["plantcode"]),
+                sordernum=int(r["sordernum"]),
+                sorderlinenum=int(r["sorderlinenum"]) if r["sorderlinenum"] is not None else None,
+            )
+            for r in rows
+        ]
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT TOP (?)
+            OutboxId, ChangeType, CompNum, PlantCode, SOrderNum, SOrderLineNum
+        FROM dbo.LWS_Workflow_Outbox WITH (READPAST)
+        WHERE Status = 'Pending'
+          {type_filter}
+        ORDER BY OutboxId
+    """, (int(limit), *types))
+    return [
+        OutboxEvent(
+            outbox_id=int(r.OutboxId),
+            change_type=str(r.ChangeType or "").upper(),
+            compnum=int(r.CompNum),
+            plantcode=str(r.PlantCode),
+            sordernum=int(r.SOrderNum),
+            sorderlinenum=int(r.SOrderLineNum) if r.SOrderLineNum is not None else None,
+        )
+        for r in cur.fetchall()
+    ]
+
+
+def mark_sent(conn, ids: Iterable[int]) -> None:
+    ids = [int(i) for i in ids or []]
+    if not ids:
+        return
+    placeholders = ",".join("?" for _ in ids)
+
+    if _is_sqlite():
+        from db import _now_utc_iso
+        conn.execute(f"""
+            UPDATE lws_workflow_outbox
+            SET status='Sent', processed_at=?
+            WHERE outbox_id IN ({placeholders})
+        """, (_now_utc_iso(), *ids))
+        conn.commit()
+        return
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE dbo.LWS_Workflow_Outbox
+        SET Status='Sent', ProcessedAt=SYSUTCDATETIME()
+        WHERE OutboxId IN ({placeholders})
+    """, ids)
+    conn.commit()
+
+
+def has_lines(conn, compnum: int, plantcode: str, sordernum: int) -> bool:
+    """SO already has lines (the stand-in has no order tables, so it always says yes)."""
+    if _is_sqlite():
+        return True
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT TOP 1 1
+        FROM dbo.PV_SOrderLine
+        WHERE CompNum=? AND PlantCode=? AND SOrderNum=?
+    """, (compnum, plantcode, sordernum))
+    return cur.fetchone() is not None
+
+
+def enqueue_event(conn, change_type: str, sordernum: int, sorderlinenum: Optional[int] = None,
+                  compnum: int = 2, plantcode: str = "4") -> int:
+    """Writes an event to the SQLite stand-in (what the SQL Server triggers do in production)."""
+    if not _is_sqlite():
+        raise RuntimeError("enqueue_event is only available with OUTBOX_BACKEND=sqlite")
+
+    from db import _now_utc_iso
+    cur = conn.execute("""
+        INSERT INTO lws_workflow_outbox(change_type, compnum, plantcode, sordernum, sorderlinenum, occurred_at)
+        VALUES(?,?,?,?,?,?)
+    """, (str(change_type).upper(), int(compnum), str(plantcode), int(sordernum),
+          int(sorderlinenum) if sorderlinenum is not None else None, _now_utc_iso()))
+    conn.commit()
+    return int(cur.lastrowid)
+
+
+def qty_change_lines(events: Iterable[OutboxEvent]) -> Dict[int, set]:
+    """{SOrderNum: {SOrderLineNum, ...}} for the QTY_CHANGE events."""
+    out = defaultdict(set)
+    for ev in events:
+        if ev.change_type == "QTY_CHANGE":
+            lines = out[ev.sordernum]
+            if ev.sorderlinenum is not None:
+                lines.add(ev.sorderlinenum)
+    return dict(out)
@@ -1,6 +1,6 @@
 # services/phase2_custref_changes.py
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from api import send_post_request, b64_json, decode_generic
 from db import (
@@ -9,9 +9,11 @@ from db import (
     insert_change_log,
     upsert_order_state,
     sget,
+    change_log_writer,
+    flush_change_log,
 )
 from logger import get_logger
-from db import rquery, upsert_order_state, insert_change_log
+from db import rquery, rquery_in, upsert_order_state, insert_change_log
 from datetime import datetime, timezone
 
 from config import FULFILLMENT_EMAILS
@@ -47,6 +49,7 @@ def _house_email_wrap(title: str, intro_html: str, body_html: str, footer_html:
 # One email per (SO4, old_custref, new_custref)
 # ---------------------------------------------------------------------
 def _was_fulfillment_notified(sqlite_conn, so4: int, old_custref: str, new_custref: str) -> bool:
+    flush_change_log()
     row = sqlite_conn.execute("""
         SELECT 1
         FROM order_change_log
@@ -167,6 +170,37 @@ def get_so_header_custref_p2(ro_conn, so_num: int) -> str:
     return str(rows[0].get("CustRef") or rows[0].get("custref") or "").strip()
 
 
+def get_so_header_custrefs_bulk(ro_conn, plantcode: str, so_nums: List[int]) -> Dict[int, str]:
+    """CustRef for many SOs of one plant in one (chunked) query: {SOrderNum: custref}."""
+    sql = """
+    SELECT so."SOrderNum" AS SOrderNum, so."CustRef" AS CustRef
+    FROM "PUB"."PV_SOrder" so
+    WHERE so."CompNum" = 2
+      AND so."PlantCode" = ?
+      AND so."SOrderNum" IN ({marks})
+    """
+    out: Dict[int, str] = {}
+    for r in rquery_in(ro_conn, sql, [int(x) for x in so_nums or []], params_before=(str(plantcode),)):
+        so = r.get("sordernum")
+        if so is not None:
+            out[int(so)] = str(r.get("custref") or "").strip()
+    return out
+
+
+def _get_so4_header_snapshots_bulk(sqlite_conn, so4_list: List[int]) -> Dict[int, Any]:
+    out: Dict[int, Any] = {}
+    sos = [int(x) for x in so4_list or []]
+    for i in range(0, len(sos), 500):
+        chunk = sos[i:i + 500]
+        rows = sqlite_conn.execute(
+            f"SELECT * FROM so4_header_snapshot WHERE so4_sordernum IN ({','.join('?' for _ in chunk)})",
+            chunk,
+        ).fetchall()
+        for r in rows:
+            out[int(r["so4_sordernum"])] = r
+    return out
+
+
 def update_starpak_so_custref_api(rw_conn, so_p2: int, custref: str, logger):
     """
     Minimal StarPak SO header update payload.
@@ -224,6 +258,97 @@ def detect_so4_custref_changes_and_update_starpak(
 
     # previous snapshot
     snap = get_so4_header_snapshot(sqlite_conn, int(so4_sordernum))
+
+    return _apply_custref_check(
+        sqlite_conn=sqlite_conn,
+        rw_conn=rw_conn,
+        run_id=run_id,
+        so4_sordernum=so4_sordernum,
+        so_p2=so_p2,
+        current_custref=current_custref,
+        snap=snap,
+        sp_custref_func=lambda: get_so_header_custref_p2(ro_conn, int(so_p2)),
+        force_authorize_func=force_authorize_func,
+        logger=logger,
+    )
+
+
+def detect_so4_custref_changes_bulk(
+    *,
+    sqlite_conn,
+    ro_conn,
+    rw_conn,
+    run_id: str,
+    so_p2_by_so4: Dict[int, Optional[int]],
+    force_authorize_func,
+    logger,
+) -> Dict[int, Any]:
+    """
+    Set-based CustRef monitor for many SO4s ({so4: so_p2}).
+    One Plant4 header query, one Plant2 header query (only for SO4s without a
+    snapshot yet) and one snapshot read; only real diffs go through the same
+    update/email path as detect_so4_custref_changes_and_update_starpak.
+
+    Returns {so4: True/False (StarPak updated) or the Exception for that SO4}.
+    """
+    pairs = {int(so4): int(so_p2) for so4, so_p2 in (so_p2_by_so4 or {}).items() if so_p2}
+    results: Dict[int, Any] = {}
+    if not pairs:
+        return results
+
+    p4_custrefs = get_so_header_custrefs_bulk(ro_conn, "4", list(pairs))
+    snaps = _get_so4_header_snapshots_bulk(sqlite_conn, list(pairs))
+
+    no_snap = [so4 for so4 in pairs if so4 not in snaps]
+    p2_custrefs = get_so_header_custrefs_bulk(ro_conn, "2", [pairs[so4] for so4 in no_snap]) if no_snap else {}
+
+    candidates = []
+    for so4, so_p2 in pairs.items():
+        cur_norm = (p4_custrefs.get(so4) or "").strip()
+        snap = snaps.get(so4)
+        if snap is not None and cur_norm == ((snap["custref"] or "").strip()):
+            results[so4] = False  # unchanged
+            continue
+        candidates.append(so4)
+
+    logger.info(f"[Phase2 CustRef] checked={len(pairs)} new_snapshot={len(no_snap)} changed_or_new={len(candidates)}")
+
+    for so4 in candidates:
+        so_p2 = pairs[so4]
+        try:
+            with change_log_writer():
+                results[so4] = _apply_custref_check(
+                    sqlite_conn=sqlite_conn,
+                    rw_conn=rw_conn,
+                    run_id=run_id,
+                    so4_sordernum=so4,
+                    so_p2=so_p2,
+                    current_custref=p4_custrefs.get(so4) or "",
+                    snap=snaps.get(so4),
+                    sp_custref_func=lambda so_p2=so_p2: p2_custrefs.get(so_p2, ""),
+                    force_authorize_func=force_authorize_func,
+                    logger=logger,
+                )
+        except Exception as e:
+            results[so4] = e
+
+    return results
+
+
+def _apply_custref_check(
+    *,
+    sqlite_conn,
+    rw_conn,
+    run_id: str,
+    so4_sordernum: int,
+    so_p2: int,
+    current_custref: str,
+    snap,
+    sp_custref_func,
+    force_authorize_func,
+    logger,
+) -> bool:
+    """CustRef compare/sync on already-loaded values (shared by per-SO and bulk monitors)."""
     prev_custref = (snap["custref"] if snap else "") or ""
 
     # ✅ NEW: Safety guard — prevent rapid repeated updates (double-run protection)
@@ -243,7 +368,7 @@ def detect_so4_custref_changes_and_update_starpak(
 
     # ✅ FIRST TIME SNAPSHOT missing
     if not snap:
-        sp_custref = get_so_header_custref_p2(ro_conn, int(so_p2)) or ""
+        sp_custref = sp_custref_func() or ""
         sp_norm = sp_custref.strip()
 
         # ✅ If StarPak differs, sync it once
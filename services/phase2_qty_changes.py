@@ -18,6 +18,7 @@ from typing import Any, Dict, List, Optional, Tuple
 from config import CSR_EMAILS, STARPAK_EMAILS, FULFILLMENT_EMAILS
 from emailer import send_email
 from exceptions import WorkflowHold
+import run_context
 
 from db import sget
 
@@ -25,6 +26,13 @@ from db import sget
 from db import (
     get_so4_line_snapshot,
     upsert_so4_line_snapshot,
+    diff_so4_line_snapshots,
+    diff_req_snapshot_keyed,
+    get_snapshot_hashes,
+    snapshot_content_hash,
+    record_snapshot_versions,
+    change_already_logged,
+    flush_change_log,
 
     # old RequirementId snapshot still used by Phase2C (Plant2) if you want,
     # but Phase2B must use keyed snapshot
@@ -39,6 +47,7 @@ from db import (
     insert_change_log,
     upsert_order_state,
     rquery,
+    rquery_in,
     mark_run_order,
 )
 
@@ -61,6 +70,7 @@ def force_starpak_so_authorized(rw_conn, so_num: int, logger):
     cur = rw_conn.cursor()
     cur.execute(sql, (int(so_num),))
     rw_conn.commit()
+    run_context.invalidate_tables("pv_sorder")
     logger.info(f"[Phase2B FIX] Forced StarPak SO {so_num} back to AUTHORIZED (sorderstat=0).")
 
 
@@ -123,6 +133,7 @@ def get_latest_so_qty_change(sqlite_conn, so4_sordernum: int):
     Returns (old_qty, new_qty, created_ts) for the most recent PT SO qty change.
     Uses order_change_log as source of truth.
     """
+    flush_change_log()
     cur = sqlite_conn.cursor()
     cur.execute(
         """
@@ -195,40 +206,11 @@ def _already_logged_change(
 ) -> bool:
     """
     Return True if order_change_log already has this change_type for this order/line and new_value.
-    Uses numeric compare for new_value to avoid '7700' vs '7700.0' string mismatch.
+    Numeric compare (new_value_num) avoids '7700' vs '7700.0' string mismatch; rows still
+    buffered by change_log_writer count too.
     """
     try:
-        cur = sqlite_conn.cursor()
-
-        if new_value is None:
-            cur.execute(
-                """
-                SELECT 1
-                  FROM order_change_log
-                 WHERE so4_sordernum = ?
-                   AND so4_linenum   = ?
-                   AND change_type   = ?
-                   AND new_value IS NULL
-                 LIMIT 1
-                """,
-                (int(sordernum), int(line_num), str(change_type)),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT 1
-                  FROM order_change_log
-                 WHERE so4_sordernum = ?
-                   AND so4_linenum   = ?
-                   AND change_type   = ?
-                   AND CAST(new_value AS REAL) = ?
-                 LIMIT 1
-                """,
-                (int(sordernum), int(line_num), str(change_type), float(new_value)),
-            )
-
-        return cur.fetchone() is not None
-
+        return change_already_logged(sqlite_conn, sordernum, line_num, change_type, new_value)
     except Exception as e:
         if logger:
             logger.warning(f"_already_logged_change failed: {e}")
@@ -269,6 +251,91 @@ def get_p4_film_requirements(ro_conn, jobcode: str):
     return rquery(ro_conn, sql, (str(jobcode),))
 
 
+def get_p4_film_requirements_bulk(ro_conn, jobcodes: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    get_p4_film_requirements for many jobs in one (chunked) query: {jobcode: [rows]}.
+    Same filters; rows keep RequiredDate order within a job.
+    """
+    sql = """
+    SELECT
+        a."RequirementId" AS RequirementId,
+        a."JobCode"       AS JobCode,
+        a."ItemCode"      AS ItemCode,
+        a."RequiredQty"   AS RequiredQty,
+        a."RequiredDate"  AS RequiredDate,
+        a."ReqStatus"     AS ReqStatus,
+        a."ReqGroupCode"  AS ReqGroupCode,
+        a."POResQty"      AS POResQty,
+        a."InProdResQty"  AS InProdResQty,
+        a."SOrderNum"     AS SOrderNum,
+        a."SOrderLineNum" AS SOrderLineNum,
+        a."DimA"          AS DimA
+    FROM "PUB"."PV_Req" a
+    WHERE a."CompNum" = 2
+      AND a."PlantCode" = '4'
+      AND a."JobCode" IN ({marks})
+      AND a."ReqGroupCode" IN ('P4-PF','P4-FILM')
+      AND a.ItemCode LIKE '16P4-%'
+      AND a."ReqStatus" IN (10, 11, 20, 21)
+      AND COALESCE(a."POResQty",0) < 1
+      AND COALESCE(a."InProdResQty",0) < 1
+      AND a."RequiredQty" > 0
+    ORDER BY a."JobCode", a."RequiredDate" ASC
+    """
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for r in rquery_in(ro_conn, sql, [str(j) for j in jobcodes or []]):
+        job = _row_get(r, "jobcode")
+        if job is None:
+            continue
+        out.setdefault(str(job).strip(), []).append(r)
+    return out
+
+
+def find_changed_req_jobs(sqlite_conn, ro_conn, jobcodes: List[str], logger) -> Tuple[Dict[str, List[Dict[str, Any]]], set]:
+    """
+    Batch front-end for apply_req_changes_to_po (Phase 2B).
+    Fetches PV_Req for all waiting jobs at once; jobs whose content hash matches
+    the last recorded REQ_JOB version are skipped, the rest are diffed against
+    req_snapshot_keyed in one SQLite join.
+
+    Returns (reqs_by_job, changed_jobs). Jobs outside changed_jobs have every
+    req row snapshotted with an unchanged RequiredQty, so apply_req_changes_to_po
+    would only log WAITING_POLYTEX_RECONFIRM for them.
+    """
+    reqs_by_job = get_p4_film_requirements_bulk(ro_conn, jobcodes)
+
+    keyed = []
+    for job, reqs in reqs_by_job.items():
+        for r in reqs:
+            # same key normalization + guards as apply_req_changes_to_po
+            item = str(r.get("ItemCode") or r.get("ITEMCODE") or r.get("itemcode") or "").strip().upper()
+            reqgroup = str(r.get("ReqGroupCode") or r.get("REQGROUPCODE") or r.get("reqgroupcode") or "").strip().upper()
+            if not item.startswith("16P4-") or reqgroup not in ("P4-FILM", "P4-PF"):
+                continue
+            requiredqty = float(r.get("RequiredQty") or r.get("REQUIREDQTY") or r.get("requiredqty") or 0.0)
+            keyed.append((str(job), reqgroup, item, requiredqty))
+
+    by_job: Dict[str, List[Tuple[str, str, str, float]]] = {}
+    for row in keyed:
+        by_job.setdefault(row[0], []).append(row)
+
+    hashes = get_snapshot_hashes(sqlite_conn, "REQ_JOB", list(by_job))
+    to_diff = [
+        row
+        for job, rows in by_job.items()
+        if hashes.get(job) != snapshot_content_hash([(g, i, q) for _, g, i, q in rows])
+        for row in rows
+    ]
+
+    changed_jobs = diff_req_snapshot_keyed(sqlite_conn, to_diff) if to_diff else set()
+
+    logger.info(
+        f"[Phase2B] PV_Req rows={len(keyed)} across {len(reqs_by_job)} jobs; "
+        f"hash mismatches={len({r[0] for r in to_diff})}; new/changed jobs={len(changed_jobs)}"
+    )
+    return reqs_by_job, changed_jobs
+
+
 
 
 def _get_state_fields(sqlite_conn, sordernum: int) -> Dict[str, Any]:
@@ -310,6 +377,53 @@ def _get_state_fields(sqlite_conn, sordernum: int) -> Dict[str, Any]:
     }
 
 
+def _get_state_fields_bulk(sqlite_conn, sordernums: List[int]) -> Dict[int, Dict[str, Any]]:
+    """_get_state_fields for many orders: {sordernum: fields} (missing orders absent)."""
+    out: Dict[int, Dict[str, Any]] = {}
+    sos = [int(x) for x in sordernums or []]
+    for i in range(0, len(sos), 500):
+        chunk = sos[i:i + 500]
+        rows = sqlite_conn.execute(
+            f"""
+            SELECT sordernum, status, last_step, po_p4_num, so_p2_num, shipreq_p2, job_p2_code, job_p4_code
+            FROM lws_order_state
+            WHERE sordernum IN ({",".join("?" for _ in chunk)})
+            """,
+            chunk,
+        ).fetchall()
+        for row in rows:
+            out[int(row[0])] = {
+                "sordernum": row[0],
+                "status": row[1],
+                "last_step": row[2],
+                "po_p4": row[3],
+                "so_p2": row[4],
+                "shipreq_p2": row[5],
+                "job_p2": row[6],
+                "job_p4": row[7],
+            }
+    return out
+
+
+def _get_po_map_line1_bulk(sqlite_conn, sordernums: List[int]) -> List[Tuple[int, int, int]]:
+    """get_po_map(so4, 1) for many orders: [(so4, po_num, po_linenum)]."""
+    out: List[Tuple[int, int, int]] = []
+    sos = [int(x) for x in sordernums or []]
+    for i in range(0, len(sos), 500):
+        chunk = sos[i:i + 500]
+        rows = sqlite_conn.execute(
+            f"""
+            SELECT so4_sordernum, po_num, po_linenum
+            FROM so4_to_po_map
+            WHERE so4_linenum = 1
+              AND so4_sordernum IN ({",".join("?" for _ in chunk)})
+            """,
+            chunk,
+        ).fetchall()
+        out.extend((int(r[0]), int(r[1]), int(r[2])) for r in rows)
+    return out
+
+
 # ---------------------------------------------------------------------
 # Radius helpers
 # ---------------------------------------------------------------------
@@ -335,6 +449,31 @@ def get_po_line_info(ro_conn, po_num: int, po_linenum: int = 1) -> Optional[Dict
     return rows[0] if rows else None
 
 
+def get_po_line_info_bulk(ro_conn, po_nums: List[int]) -> Dict[Tuple[int, int], Dict[str, Any]]:
+    """get_po_line_info for many POs: {(pordernum, porderlinenum): row} (all lines of each PO)."""
+    sql = """
+    SELECT
+        p.porderstat AS porderstat,
+        pl.pordernum AS pordernum,
+        pl.porderlinenum AS porderlinenum,
+        pl.orderedqty AS orderedqty,
+        pl.receivedqty AS receivedqty,
+        pl.itemcode AS itemcode,
+        pl.plantcode AS plantcode
+    FROM PUB.PV_POrder p
+    JOIN PUB.PV_POrderLine pl
+      ON p.compnum = pl.compnum
+     AND p.pordernum = pl.pordernum
+    WHERE p.compnum = 2
+      AND p.pordernum IN ({marks})
+    """
+    out: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for r in rquery_in(ro_conn, sql, [int(x) for x in po_nums or []]):
+        key = (int(_row_get(r, "pordernum")), int(_row_get(r, "porderlinenum")))
+        out.setdefault(key, r)
+    return out
+
+
 def get_so_line_info_p2(ro_conn, so_num: int, so_linenum: int = 1) -> Optional[Dict[str, Any]]:
     sql = """
     SELECT
@@ -353,6 +492,49 @@ def get_so_line_info_p2(ro_conn, so_num: int, so_linenum: int = 1) -> Optional[D
     return rows[0] if rows else None
 
 
+def get_so_line1_info_p2_bulk(ro_conn, so_nums: List[int]) -> Dict[int, Dict[str, Any]]:
+    """get_so_line_info_p2(so, 1) for many Plant2 SOs: {sordernum: row}."""
+    sql = """
+    SELECT
+        sol.sordernum AS sordernum,
+        sol.sorderlinenum AS sorderlinenum,
+        sol.itemcode AS itemcode,
+        sol.orderedqty AS orderedqty,
+        sol.reqdate AS reqdate
+    FROM PUB.PV_SOrderLine sol
+    WHERE sol.compnum = 2
+      AND sol.plantcode = '2'
+      AND sol.sorderlinenum = ?
+      AND sol.sordernum IN ({marks})
+    """
+    out: Dict[int, Dict[str, Any]] = {}
+    for r in rquery_in(ro_conn, sql, [int(x) for x in so_nums or []], params_before=(1,)):
+        out.setdefault(int(_row_get(r, "sordernum")), r)
+    return out
+
+
+def get_jobline_qtys_p2_bulk(ro_conn, jobcodes: List[str]) -> Dict[Tuple[str, str], Optional[float]]:
+    """
+    get_jobline_qty_p2 for many Plant2 jobs: {(jobcode, itemcode): qty}.
+    Same value rules as the single lookup (first row wins; NULL qty -> None).
+    """
+    sql = """
+    SELECT jl."JobCode" AS JobCode, jl."ItemCode" AS ItemCode, jl."OrderedQty" AS JobQty
+    FROM "PUB"."PV_JobLine" jl
+    WHERE jl."CompNum" = 2
+      AND jl."PlantCode" = '2'
+      AND jl."JobCode" IN ({marks})
+    """
+    out: Dict[Tuple[str, str], Optional[float]] = {}
+    for r in rquery_in(ro_conn, sql, [str(j) for j in jobcodes or []]):
+        key = (str(_row_get(r, "jobcode") or "").strip(), str(_row_get(r, "itemcode") or "").strip())
+        if key in out:
+            continue
+        v = r.get("JobQty") or r.get("JOBQTY") or r.get("jobqty")
+        out[key] = float(v) if v is not None else None
+    return out
+
+
 def get_job_requirements_by_jobcode(ro_conn, plantcode: str, jobcode: str) -> List[Dict[str, Any]]:
     """
     Generic PV_Req fetch by jobcode and plantcode. We keep it broad but safe.
@@ -394,9 +576,77 @@ def get_so_lines_p4(ro_conn, sordernum: int) -> list[dict]:
     return rquery(ro_conn, sql, (int(sordernum),))
 
 
+def get_so_lines_p4_bulk(ro_conn, sordernums: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Plant4 SO lines for many SOs in one (chunked) query: {so4: [lines ordered by line num]}.
+    Same columns as app.get_so_line_items_p4.
+    """
+    sql = """
+    SELECT sol."SOrderNum", sol."SOrderLineNum", sol."ItemCode", sol."OrderedQty", sol."ReqDate", sol."SOItemTypeCode"
+    FROM "PUB"."PV_SOrderLine" sol
+    WHERE sol."CompNum" = 2
+      AND sol."PlantCode" = '4'
+      AND sol."SOrderNum" IN ({marks})
+    """
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for r in rquery_in(ro_conn, sql, [int(x) for x in sordernums or []]):
+        so = _row_get(r, "sordernum")
+        if so is None:
+            continue
+        out.setdefault(int(so), []).append(r)
+    for rows in out.values():
+        rows.sort(key=lambda r: int(_row_get(r, "sorderlinenum", 0) or 0))
+    return out
+
+
 # ---------------------------------------------------------------------
 # Phase 2A - Detect Plant4 SO OrderedQty changes
 # ---------------------------------------------------------------------
+def detect_so4_qty_changes_bulk(
+    sqlite_conn,
+    ro_conn,
+    sordernums: List[int],
+    logger,
+) -> Tuple[Dict[int, List[Dict[str, Any]]], set]:
+    """
+    Batch front-end for detect_so4_qty_changes_or_hold.
+    Pulls all monitored SO4 lines in one query, compares one content hash per SO
+    with the last recorded snapshot version and diffs only the mismatches
+    against so4_line_snapshot in one SQLite join.
+
+    Returns (lines_by_so, changed_sos): only SOs in changed_sos (a line is new
+    or its OrderedQty differs from the snapshot) need the per-SO detector.
+    """
+    lines_by_so = get_so_lines_p4_bulk(ro_conn, sordernums)
+
+    current_by_so: Dict[int, List[Tuple[int, int, float]]] = {}
+    for so, lines in lines_by_so.items():
+        for ln in lines:
+            line_num = int(ln.get("SOrderLineNum") or ln.get("sorderlinenum") or 0)
+            if not line_num:
+                continue
+            current_by_so.setdefault(so, []).append(
+                (so, line_num, float(ln.get("OrderedQty") or ln.get("orderedqty") or 0.0))
+            )
+
+    # ✅ Same hash as the recorded SO4_LINES version -> nothing to diff for that SO
+    hashes = get_snapshot_hashes(sqlite_conn, "SO4_LINES", list(current_by_so))
+    current = [
+        row
+        for so, rows in current_by_so.items()
+        if hashes.get(str(so)) != snapshot_content_hash([(ln, qty) for _, ln, qty in rows])
+        for row in rows
+    ]
+
+    changed_sos = {int(r["so4_sordernum"]) for r in diff_so4_line_snapshots(sqlite_conn, current)} if current else set()
+
+    logger.info(
+        f"[Phase2A] SO4 lines={sum(len(r) for r in current_by_so.values())} across {len(lines_by_so)} SOs; "
+        f"hash mismatches={len({so for so, _, _ in current})}; new/changed SOs={len(changed_sos)}"
+    )
+    return lines_by_so, changed_sos
+
+
 def detect_so4_qty_changes_or_hold(
     sqlite_conn,
     run_id: str,
@@ -1085,11 +1335,125 @@ def apply_req_changes_to_po(
 # ---------------------------------------------------------------------
 from services.starpak_so import get_jobline_qty_p2
 
-def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id: str, so4_sordernum: int, logger) -> bool:
+_PHASE2C_STEPS = (
+    "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
+    "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
+    "P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM",
+)
+
 
+def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id: str, so4_sordernum: int, logger) -> bool:
+    """
+    Per-order Phase 2C check (reference implementation for
+    detect_starpak_reconfirm_or_complete_bulk; both share _phase2c_evaluate).
+    """
     state = _get_state_fields(sqlite_conn, int(so4_sordernum))
-    if not state:
+    target = _phase2c_target(state, so4_sordernum, logger)
+    if target is None:
         return False
+    step, so_p2, job_p2, shipreq_p2 = target
+
+    # ✅ Derive target_qty from PO ordered qty (source-of-truth)
+    target_qty = None
+    try:
+        m = get_po_map(sqlite_conn, int(so4_sordernum), 1)
+        if m:
+            po_num = int(m["po_num"])
+            po_linenum = int(m["po_linenum"])
+            info = get_po_line_info(ro_conn, po_num, po_linenum)
+            if info:
+                target_qty = float(info.get("orderedqty") or 0.0)
+    except Exception as e:
+        logger.warning(f"[Phase2C] target_qty derive from PO failed (ignored): {e}")
+
+    # ✅ Read FG item from SO line 1
+    so_line = get_so_line_info_p2(ro_conn, so_p2, 1)
+
+    return _phase2c_evaluate(
+        sqlite_conn, ro_conn, rw_conn, run_id, so4_sordernum,
+        step, so_p2, job_p2, shipreq_p2,
+        target_qty, so_line,
+        lambda fg_itemcode: get_jobline_qty_p2(ro_conn, job_p2, fg_itemcode),
+        logger,
+    )
+
+
+def detect_starpak_reconfirm_or_complete_bulk(
+    sqlite_conn,
+    ro_conn,
+    rw_conn,
+    run_id: str,
+    so4_list: List[int],
+    logger,
+) -> Dict[int, Any]:
+    """
+    Batch Phase 2C check. Loads state + PO map from SQLite and PO line qty,
+    Plant2 SO line 1 and Plant2 JobLine qty from Radius in three set-based
+    queries, then applies the same rules as detect_starpak_reconfirm_or_complete.
+
+    Returns {so4: True/False (released) or the Exception raised for that order}.
+    """
+    so4_list = [int(x) for x in so4_list or []]
+    results: Dict[int, Any] = {}
+    if not so4_list:
+        return results
+
+    states = _get_state_fields_bulk(sqlite_conn, so4_list)
+
+    targets = {}
+    for so4 in so4_list:
+        t = _phase2c_target(states.get(so4) or {}, so4, logger)
+        if t is None:
+            results[so4] = False
+        else:
+            targets[so4] = t
+
+    if not targets:
+        return results
+
+    # SQLite: SO4 line 1 -> PO map
+    po_map: Dict[int, Tuple[int, int]] = {}
+    for so4, po_num, po_linenum in _get_po_map_line1_bulk(sqlite_conn, list(targets)):
+        po_map[so4] = (po_num, po_linenum)
+
+    # Radius (3 queries)
+    try:
+        po_lines = get_po_line_info_bulk(ro_conn, [po for po, _ in po_map.values()])
+    except Exception as e:
+        logger.warning(f"[Phase2C] target_qty derive from PO failed (ignored): {e}")
+        po_lines = None
+
+    so_lines = get_so_line1_info_p2_bulk(ro_conn, [t[1] for t in targets.values()])
+    job_qtys = get_jobline_qtys_p2_bulk(ro_conn, [t[2] for t in targets.values()])
+
+    for so4, (step, so_p2, job_p2, shipreq_p2) in targets.items():
+        target_qty = None
+        if po_lines is not None and so4 in po_map:
+            info = po_lines.get(po_map[so4])
+            if info:
+                target_qty = float(info.get("orderedqty") or 0.0)
+
+        try:
+            results[so4] = _phase2c_evaluate(
+                sqlite_conn, ro_conn, rw_conn, run_id, so4,
+                step, so_p2, job_p2, shipreq_p2,
+                target_qty, so_lines.get(so_p2),
+                lambda fg_itemcode, job=job_p2: job_qtys.get((job.strip(), fg_itemcode)),
+                logger,
+            )
+        except Exception as e:
+            results[so4] = e
+
+    return results
+
+
+def _phase2c_target(state: Dict[str, Any], so4_sordernum: int, logger) -> Optional[Tuple[str, int, str, Any]]:
+    """
+    Phase 2C guards on the order state. Returns (step, so_p2, job_p2, shipreq_p2)
+    when the order is in a StarPak HOLD step Phase 2C handles, else None.
+    """
+    if not state:
+        return None
 
     # ✅ DEBUG LOG - always print what state Phase2C sees
     logger.info(
@@ -1102,15 +1466,11 @@ def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id:
 
     step = str(state.get("last_step") or "")
     if str(state.get("status") or "").upper() != "HOLD":
-        return False
+        return None
 
     # ✅ Phase2C must ONLY run for StarPak HOLD states
-    if step not in (
-        "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
-        "P2_SO_QTY_UPDATED_MANUAL_COMPLETE_REQUIRED",
-        "P2_QTY_DECREASE_WAIT_SP_JOB_RECONFIRM",
-    ):
-        return False
+    if step not in _PHASE2C_STEPS:
+        return None
 
     so_p2 = state.get("so_p2")
     job_p2 = state.get("job_p2")
@@ -1120,26 +1480,27 @@ def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id:
         logger.info(
             f"Phase2C: Missing so_p2/job_p2 in state for SO4={so4_sordernum}. so_p2={so_p2}, job_p2={job_p2}"
         )
-        return False
+        return None
 
-    so_p2 = int(so_p2)
-    job_p2 = str(job_p2)
+    return step, int(so_p2), str(job_p2), shipreq_p2
 
-    # ✅ Derive target_qty from PO ordered qty (source-of-truth)
-    target_qty = None
-    try:
-        m = get_po_map(sqlite_conn, int(so4_sordernum), 1)
-        if m:
-            po_num = int(m["po_num"])
-            po_linenum = int(m["po_linenum"])
-            info = get_po_line_info(ro_conn, po_num, po_linenum)
-            if info:
-                target_qty = float(info.get("orderedqty") or 0.0)
-    except Exception as e:
-        logger.warning(f"[Phase2C] target_qty derive from PO failed (ignored): {e}")
 
-    # ✅ Read FG item from SO line 1
-    so_line = get_so_line_info_p2(ro_conn, so_p2, 1)
+def _phase2c_evaluate(
+    sqlite_conn,
+    ro_conn,
+    rw_conn,
+    run_id: str,
+    so4_sordernum: int,
+    step: str,
+    so_p2: int,
+    job_p2: str,
+    shipreq_p2,
+    target_qty: Optional[float],
+    so_line: Optional[Dict[str, Any]],
+    job_qty_func,
+    logger,
+) -> bool:
+    """Phase 2C release rules on already-loaded inputs (shared by per-order and bulk)."""
     if not so_line:
         logger.info(f"Phase2C: No Plant2 SO lines found for SO={so_p2}.")
         return False
@@ -1150,7 +1511,7 @@ def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id:
         logger.info(f"Phase2C: Could not resolve FG ItemCode from SO={so_p2}.")
         return False
 
-    job_qty = get_jobline_qty_p2(ro_conn, job_p2, fg_itemcode)
+    job_qty = job_qty_func(fg_itemcode)
 
     logger.info(
         f"Phase2C CHECK: so4={so4_sordernum} step={step} so2={so_p2} job2={job_p2} "
@@ -1215,6 +1576,7 @@ def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id:
                 reqdate = str(ln.get("ReqDate") or ln.get("reqdate") or "")[:10]
                 if line_num:
                     upsert_so4_line_snapshot(sqlite_conn, int(so4_sordernum), int(line_num), itemcode, orderedqty, reqdate)
+            record_snapshot_versions(sqlite_conn, "SO4_LINES", [int(so4_sordernum)], run_id)
             logger.info(f"Phase2C: refreshed SO4 snapshot baseline for SO {so4_sordernum}")
         except Exception as e:
             logger.warning(f"Phase2C: failed to refresh SO4 snapshot baseline (ignored): {e}")
@@ -1352,6 +1714,7 @@ def detect_starpak_reconfirm_or_complete(sqlite_conn, ro_conn, rw_conn, run_id:
                 reqdate = str(ln.get("ReqDate") or ln.get("reqdate") or "")[:10]
                 if line_num:
                     upsert_so4_line_snapshot(sqlite_conn, int(so4_sordernum), int(line_num), itemcode, orderedqty, reqdate)
+            record_snapshot_versions(sqlite_conn, "SO4_LINES", [int(so4_sordernum)], run_id)
             logger.info(f"Phase2C: refreshed SO4 snapshot baseline for SO {so4_sordernum}")
         except Exception as e:
             logger.warning(f"Phase2C: failed to refresh SO4 snapshot baseline (ignored): {e}")
@@ -1,22 +1,13 @@
 from typing import Optional, Tuple
 from datetime import datetime, timedelta
-import base64, json
+import json
 
 
-from db import rquery
-from api import send_post_request, decode_porder_response, b64_json
+from db import rquery, rquery_in
+from api import send_post_request, decode_porder_response, b64_json, xlink_client
+from exceptions import WorkflowApiError
 from logger import get_logger
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
-
-@dataclass
-class DecodedResponse:
-    status_code: int
-    messages: List[str]
-    decoded_payload: Optional[Dict[str, Any]]
-    error_message: str
-    raw: Dict[str, Any]
-
+from typing import Any, Dict, List
 
 
 log = get_logger("polytex_po")
@@ -29,9 +20,6 @@ UNIT_PRICE = 0.01
 PRICE_UNIT_CODE = "KFEET"
 PRICE_GROUP_NO = 1
 
-def b64_json_decode(payload_b64: str):
-    return json.loads(base64.b64decode(payload_b64).decode("utf-8"))
-
 def find_existing_po_by_job(conn, jobcode: str) -> Optional[int]:
     sql = """
     SELECT po."POrderNum" AS POrderNum
@@ -70,39 +58,29 @@ def find_existing_po_by_job(conn, jobcode: str) -> Optional[int]:
     return int(po_num) if po_num is not None else None
 
 
-def decode_porder_response(resp):
-    body = resp.json()
-    efi = body.get("efiRadiusResponse", {})
-
-    status_code = efi.get("statusCode")
-    error_message = efi.get("errorMessage", "")
-    payload_b64 = efi.get("payload")
-
-    messages = []
-    decoded_payload = None
-
-    if error_message:
-        messages.append(error_message)
-
-    if payload_b64:
-        try:
-            decoded_payload = b64_json_decode(payload_b64)
-        except Exception as e:
-            messages.append(str(e))
-
-    return DecodedResponse(
-        status_code=status_code,
-        messages=messages,
-        decoded_payload=decoded_payload,
-        error_message=error_message,
-        raw=body,
-    )
-
-
-
-def create_polytex_po(conn, jobcode: str, itemcode: str, qty: float, required_date: str, dim_a: float, logger) -> int:
+def find_existing_pos_by_jobs(conn, jobcodes: list[str]) -> dict[str, int]:
+    """
+    Batch version of find_existing_po_by_job: {JobCode: POrderNum} matched on PV_POrder.SuppRef
+    (latest LastUpdatedDateTime wins).
+    """
+    sql = """
+    SELECT po."POrderNum" AS POrderNum, po."SuppRef" AS SuppRef
+    FROM "PUB"."PV_POrder" po
+    WHERE po."CompNum" = 2
+      AND po."SuppRef" IN ({marks})
+    ORDER BY po."LastUpdatedDateTime" DESC
+    """
+    out: dict[str, int] = {}
+    for r in rquery_in(conn, sql, [str(j) for j in jobcodes or [] if j]):
+        ref = str(r.get("SuppRef") or r.get("suppref") or "").strip()
+        po_num = r.get("POrderNum") or r.get("pordernum")
+        if ref and po_num is not None:
+            out.setdefault(ref, int(po_num))
+    return out
 
 
+def _po_order_element(jobcode: str, itemcode: str, qty: float, required_date: str, dim_a: float) -> dict:
+    """One XLPOrders.XLPOrder element (header + line + price) for a PolyTex PO against jobcode."""
     today = datetime.now()
     price_date = datetime.now().strftime("%Y-%m-%d")
 
@@ -124,104 +102,109 @@ def create_polytex_po(conn, jobcode: str, itemcode: str, qty: float, required_da
     PRICE_UNIT_CODE = "KFEET"
     PRICE_GROUP_NO = 1
 
-    payload = {
-        "XLPOrders": {
-            "XLPOrder": [{
-                # --------------------
-                # HEADER
-                # --------------------
-                "CompNum": 2,
-                "PlantCode": PLANT_P4,                  # "4"
-                "SuppCode": SUPPCODE_POLYTEX_LWS,        # "P4-00684"
-                "SuppRef": str(jobcode),
-                "POAddrNum": ADDRNUM_POLYTEX_LWS,        # "3086"
-                "TermsCode": "NET 30",
-                "WHouseCode": WHOUSE_POLYTEX_LWS,        # "9200"
-                "POStatus": 2,
-                "RequiredDate": req_dt.strftime("%Y-%m-%d"),
-                "ReqDate": new_req.strftime("%Y-%m-%d"),
-                "POrderNum": "",                        # force create
-
-                # --------------------
-                # LINES
-                # --------------------
-                "XLPOrderLine": [{
-                    "CompNum": 2,
-                    "PlantCode": PLANT_P4,              # "4"
-                    "SuppCode": SUPPCODE_POLYTEX_LWS,
-                    "WhouseCode": WHOUSE_POLYTEX_LWS,
-                    "POrderLineNum": 1,
-                    "ItemCode": itemcode,
-                    "DimA": float(dim_a),               # ✅ from Req table
-                    "DimB": 0.0,
-                    "DimC": 0.0,
-                    "OrderedQty": float(qty),           # ✅ from Req table
-                    "ReqDate": req_dt.strftime("%Y-%m-%d"),
-                    "PriceGroupNo": PRICE_GROUP_NO,
-                    "PriceUnitCode": PRICE_UNIT_CODE,
-                    "FCUnitPrice": UNIT_PRICE,          # ✅ hard code
-                    "UnitPrice": UNIT_PRICE,            # ✅ hard code
-                    "POLineStatus": 10,
-                    "LastUserCode": "radius",
-                    "MaxRollWeight": 0.0,
-                    "NumberOfRolls": 0,
-                }],
-
-                # --------------------
-                # PRICE
-                # --------------------
-                "XLPOrderPrice": [{
-                    "CompNum": 2,
-                    "ItemCode": itemcode,
-                    "LastUserCode": "radius",
-                    "PriceDate": price_date,
-                    "PriceGroupNo": PRICE_GROUP_NO,
-                    "PriceUnitCode": PRICE_UNIT_CODE,
-                    "FCUnitPrice": UNIT_PRICE,          # ✅ hard code
-                    "PriceStatus": 0,
-                }],
-            }]
-        }
+    return {
+        # --------------------
+        # HEADER
+        # --------------------
+        "CompNum": 2,
+        "PlantCode": PLANT_P4,                  # "4"
+        "SuppCode": SUPPCODE_POLYTEX_LWS,        # "P4-00684"
+        "SuppRef": str(jobcode),
+        "POAddrNum": ADDRNUM_POLYTEX_LWS,        # "3086"
+        "TermsCode": "NET 30",
+        "WHouseCode": WHOUSE_POLYTEX_LWS,        # "9200"
+        "POStatus": 2,
+        "RequiredDate": req_dt.strftime("%Y-%m-%d"),
+        "ReqDate": new_req.strftime("%Y-%m-%d"),
+        "POrderNum": "",                        # force create
+
+        # --------------------
+        # LINES
+        # --------------------
+        "XLPOrderLine": [{
+            "CompNum": 2,
+            "PlantCode": PLANT_P4,              # "4"
+            "SuppCode": SUPPCODE_POLYTEX_LWS,
+            "WhouseCode": WHOUSE_POLYTEX_LWS,
+            "POrderLineNum": 1,
+            "ItemCode": itemcode,
+            "DimA": float(dim_a),               # ✅ from Req table
+            "DimB": 0.0,
+            "DimC": 0.0,
+            "OrderedQty": float(qty),           # ✅ from Req table
+            "ReqDate": req_dt.strftime("%Y-%m-%d"),
+            "PriceGroupNo": PRICE_GROUP_NO,
+            "PriceUnitCode": PRICE_UNIT_CODE,
+            "FCUnitPrice": UNIT_PRICE,          # ✅ hard code
+            "UnitPrice": UNIT_PRICE,            # ✅ hard code
+            "POLineStatus": 10,
+            "LastUserCode": "radius",
+            "MaxRollWeight": 0.0,
+            "NumberOfRolls": 0,
+        }],
+
+        # --------------------
+        # PRICE
+        # --------------------
+        "XLPOrderPrice": [{
+            "CompNum": 2,
+            "ItemCode": itemcode,
+            "LastUserCode": "radius",
+            "PriceDate": price_date,
+            "PriceGroupNo": PRICE_GROUP_NO,
+            "PriceUnitCode": PRICE_UNIT_CODE,
+            "FCUnitPrice": UNIT_PRICE,          # ✅ hard code
+            "PriceStatus": 0,
+        }],
     }
 
 
+def _ci(row: dict, key: str):
+    v = row.get(key)
+    if v is not None:
+        return v
+    for k, val in row.items():
+        if str(k).lower() == key.lower():
+            return val
+    return None
 
 
-
-    resp = send_post_request("XLinkAPIPOrder", b64_json(payload), logger)
-    decoded = decode_porder_response(resp)
-
+def _raise_for_po_status(decoded) -> None:
     if decoded.status_code == 9:
         raise RuntimeError(f"PO API error: {decoded.messages or decoded.error_message or 'Unknown Radius error'}")
 
-
     if decoded.status_code != 1:
         raise RuntimeError(f"PO failed: {decoded.messages}")
 
-    # Extract PO number from decoded payload (robust + case-insensitive)
-    decoded_payload = decoded.decoded_payload or {}
 
-    orders = None
-    if isinstance(decoded_payload, dict):
-        if "XLPOrders" in decoded_payload:
-            orders = decoded_payload.get("XLPOrders", {}).get("XLPOrder")
-        elif "XLPOrder" in decoded_payload:
-            orders = decoded_payload.get("XLPOrder")
-    elif isinstance(decoded_payload, list):
-        orders = decoded_payload
+def _row_po_num(po_row: dict):
+    """POrderNum Radius assigned to one returned XLPOrder (robust + case-insensitive), or None."""
+    return _ci(po_row, "POrderNum") or None
+
+
+def _single_po_payload(jobcode: str, itemcode: str, qty: float, required_date: str, dim_a: float) -> str:
+    return b64_json({"XLPOrders": {"XLPOrder": [_po_order_element(jobcode, itemcode, qty, required_date, dim_a)]}})
+
+
+def create_polytex_po(conn, jobcode: str, itemcode: str, qty: float, required_date: str, dim_a: float, logger) -> int:
+    resp = send_post_request("XLinkAPIPOrder", _single_po_payload(jobcode, itemcode, qty, required_date, dim_a), logger)
+    return _created_po_num(decode_porder_response(resp))
+
+
+def _created_po_num(decoded) -> int:
+    """POrderNum of a single-PO create response; raises like create_polytex_po."""
+    _raise_for_po_status(decoded)
+
+    # Extract PO number from decoded payload
+    orders = decoded.elements()
 
     if not orders:
         raise RuntimeError(
-            f"PO succeeded but payload shape unexpected: {decoded_payload}"
+            f"PO succeeded but payload shape unexpected: {decoded.decoded_payload or decoded.payload_text}"
         )
 
-    po_row = orders[0] if isinstance(orders, list) else orders
-
-    po_num = (
-        po_row.get("POrderNum")
-        or po_row.get("PORDERNUM")
-        or po_row.get("pordernum")
-    )
+    po_row = orders[0]
+    po_num = _row_po_num(po_row)
 
     if po_num is None:
         raise RuntimeError(
@@ -231,3 +214,98 @@ def create_polytex_po(conn, jobcode: str, itemcode: str, qty: float, required_da
     return int(po_num)
 
 
+def create_polytex_pos(ro_conn, requests: List[Dict[str, Any]], logger) -> Dict[str, Any]:
+    """
+    Batch version of create_polytex_po: one XLinkAPIPOrder call with one XLPOrder
+    element per job. requests = [{"jobcode", "itemcode", "qty", "required_date", "dim_a"}].
+
+    Returns {jobcode: POrderNum or the exception for that job}, matched on SuppRef.
+    An element with a POrderNum was created (its ErrorMessage, if any, is only a
+    warning, as in the single call); one with an ErrorMessage and no POrderNum
+    fails only its own job.
+    If the batch is rejected as a whole (or a job is missing from the response),
+    those jobs are first looked up by SuppRef, so a PO Radius did create is not
+    created twice, and the rest are created one PO per call, posted concurrently
+    through the XLink client.
+    """
+    by_job = {str(r["jobcode"]): r for r in requests or []}
+    if not by_job:
+        return {}
+
+    payload = {"XLPOrders": {"XLPOrder": [
+        _po_order_element(job, r["itemcode"], r["qty"], r["required_date"], r["dim_a"])
+        for job, r in by_job.items()
+    ]}}
+
+    out: Dict[str, Any] = {}
+    try:
+        resp = send_post_request("XLinkAPIPOrder", b64_json(payload), logger)
+        decoded = decode_porder_response(resp)
+        rows = decoded.elements()
+    except Exception as e:
+        logger.warning(f"[Batch PO] {len(by_job)} PO(s): batch call failed, retrying one by one: {e}")
+        decoded, rows = None, []
+
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        job = str(_ci(row, "SuppRef") or "").strip()
+        if job not in by_job:
+            continue
+        err = str(_ci(row, "ErrorMessage") or "").strip()
+        po_num = _row_po_num(row)
+        if po_num:
+            out[job] = int(po_num)
+            if err:
+                logger.warning(f"[Batch PO] Job {job}: PO {po_num} created with message: {err}")
+        elif err:
+            out[job] = WorkflowApiError(
+                f"PO API error for job {job}: {err}",
+                api_entity="XLinkAPIPOrder",
+                api_status=decoded.status_code,
+                api_error_message=err,
+                api_messages=[err],
+                raw_response_text=json.dumps(row, default=str)[:4000],
+            )
+        # neither: not created because of another element -> single-call fallback below
+
+    missing = [job for job in by_job if job not in out]
+    if missing:
+        if decoded is not None:
+            logger.warning(
+                f"[Batch PO] status={decoded.status_code} returned {len(out)}/{len(by_job)} PO(s) "
+                f"({decoded.messages or decoded.error_message or 'no per-order result'}); "
+                f"falling back to single calls for {len(missing)}"
+            )
+        try:
+            existing = find_existing_pos_by_jobs(ro_conn, missing)
+        except Exception as e:
+            logger.warning(f"[Batch PO] SuppRef lookup before fallback failed: {e}")
+            existing = {}
+
+        for job in missing:
+            if job in existing:
+                out[job] = int(existing[job])
+
+        # ✅ One PO per call, posted concurrently (XLINK_MAX_IN_FLIGHT / XLINK_ENTITY_LIMITS still apply)
+        singles, calls = [], []
+        for job in missing:
+            if job in out:
+                continue
+            r = by_job[job]
+            singles.append(job)
+            calls.append(("XLinkAPIPOrder", _single_po_payload(job, r["itemcode"], r["qty"], r["required_date"], r["dim_a"])))
+
+        for job, res in zip(singles, xlink_client().post_all(calls, logger, decoder=decode_porder_response)):
+            if isinstance(res, Exception):
+                out[job] = res
+                continue
+            try:
+                out[job] = _created_po_num(res[1])
+            except Exception as e:
+                out[job] = e
+
+    ok = sum(1 for v in out.values() if not isinstance(v, Exception))
+    logger.info(f"[Batch PO] {ok}/{len(by_job)} PO(s) created for {len(by_job)} job(s)")
+    return out
+
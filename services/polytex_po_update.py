@@ -32,8 +32,16 @@ def _post_xlink(entity_name: str, payload_dict: dict) -> dict:
     # ✅ correct adapter wrapper
     body = {"efiRadiusRequest": {"entityName": entity_name, "payload": payload_b64}}
 
-    # ✅ send request
-    resp = SESSION.post(API_URL, json=body, timeout=60)
+    # ✅ send request (same in-flight limits and run-cache invalidation as api.send_post_request)
+    from api import entity_slot
+    import run_context
+
+    try:
+        with entity_slot(entity_name):
+            resp = SESSION.post(API_URL, json=body, timeout=60)
+    finally:
+        # Even a failed/timed-out post may have changed Radius: drop cached reads
+        run_context.invalidate_for_entity(entity_name)
 
     raw_text = ""
     try:
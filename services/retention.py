@@ -0,0 +1,226 @@
+# lws_workflow/services/retention.py
+"""
+State DB retention, run by the maintenance job after archive_old_complete_orders().
+
+Policies (config RETENTION_*):
+  - order_change_log: rows older than RETENTION_CHANGE_LOG_DAYS for orders that are
+    no longer in lws_order_state are folded into order_change_log_rollup (one row
+    per order and change_type) and deleted. Monitored orders keep their full log:
+    the Phase 2 dedupe probes (change_already_logged, CustRef notifications) read it.
+  - archived orders: RETENTION_ARCHIVED_GRACE_DAYS after archiving, their Phase 2
+    snapshots, so4_to_po_map rows, requirement snapshots of their jobs and their
+    snapshot_hash / snapshot_versions rows are removed.
+  - snapshot_versions: versions older than RETENTION_SNAPSHOT_VERSIONS_DAYS are
+    dropped, but the newest RETENTION_SNAPSHOT_VERSIONS_KEEP per entity always stay.
+
+Every delete works through RETENTION_DELETE_CHUNK rows at a time and commits per
+chunk, so Phase 2 writers never wait long on the state DB write lock. Freed pages
+go back to the OS with PRAGMA incremental_vacuum (RETENTION_VACUUM_PAGES per pass).
+"""
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Tuple
+
+from config import (
+    RETENTION_ENABLED,
+    RETENTION_CHANGE_LOG_DAYS,
+    RETENTION_ARCHIVED_GRACE_DAYS,
+    RETENTION_SNAPSHOT_VERSIONS_DAYS,
+    RETENTION_SNAPSHOT_VERSIONS_KEEP,
+    RETENTION_DELETE_CHUNK,
+    RETENTION_VACUUM_PAGES,
+    RETENTION_CONVERT_AUTO_VACUUM,
+)
+from db import state_conn, _now_utc_iso
+from logger import get_logger
+
+log = get_logger("retention")
+
+# Archived orders whose grace period is over and that are not monitored again
+_ARCHIVED_SO_SQL = """
+    SELECT a.sordernum
+    FROM lws_order_state_archive a
+    WHERE a.archived_ts < datetime('now', ?)
+      AND a.sordernum NOT IN (SELECT sordernum FROM lws_order_state)
+"""
+
+# Job codes of those orders that no monitored order still uses
+_ARCHIVED_JOB_SQL = f"""
+    SELECT a.job_p4_code FROM lws_order_state_archive a
+    WHERE a.job_p4_code IS NOT NULL AND a.sordernum IN ({_ARCHIVED_SO_SQL})
+    UNION
+    SELECT a.job_p2_code FROM lws_order_state_archive a
+    WHERE a.job_p2_code IS NOT NULL AND a.sordernum IN ({_ARCHIVED_SO_SQL})
+    EXCEPT
+    SELECT job_p4_code FROM lws_order_state WHERE job_p4_code IS NOT NULL
+    EXCEPT
+    SELECT job_p2_code FROM lws_order_state WHERE job_p2_code IS NOT NULL
+"""
+
+# table -> WHERE clause over that table (every "?" is the grace period)
+_ARCHIVE_CASCADE: Dict[str, str] = {
+    "so4_line_snapshot": f"so4_sordernum IN ({_ARCHIVED_SO_SQL})",
+    "so4_header_snapshot": f"so4_sordernum IN ({_ARCHIVED_SO_SQL})",
+    "so4_to_po_map": f"so4_sordernum IN ({_ARCHIVED_SO_SQL})",
+    "req_snapshot_keyed": f"jobcode IN ({_ARCHIVED_JOB_SQL})",
+    "req_snapshot": f"jobcode IN ({_ARCHIVED_JOB_SQL})",
+    "snapshot_versions": f"""
+        (kind IN ('SO4_LINES','SO4_HEADER') AND entity_key IN (SELECT CAST(sordernum AS TEXT) FROM ({_ARCHIVED_SO_SQL})))
+        OR (kind = 'REQ_JOB' AND entity_key IN ({_ARCHIVED_JOB_SQL}))
+    """,
+    "snapshot_hash": f"""
+        (kind IN ('SO4_LINES','SO4_HEADER') AND entity_key IN (SELECT CAST(sordernum AS TEXT) FROM ({_ARCHIVED_SO_SQL})))
+        OR (kind = 'REQ_JOB' AND entity_key IN ({_ARCHIVED_JOB_SQL}))
+    """,
+}
+
+
+def _cutoff_iso(days: int) -> str:
+    # Same format as _now_utc_iso(), so plain string comparison works
+    return (datetime.now(timezone.utc) - timedelta(days=int(days))).isoformat()
+
+
+def delete_in_chunks(conn: sqlite3.Connection, table: str, where: str, params: Tuple[Any, ...] = (),
+                     chunk: int = RETENTION_DELETE_CHUNK) -> int:
+    """DELETE ... WHERE <where>, chunk rows per transaction. Returns rows deleted."""
+    total = 0
+    while True:
+        cur = conn.execute(f"""
+            DELETE FROM {table}
+            WHERE rowid IN (
+                SELECT rowid FROM {table}
+                WHERE {where}
+                LIMIT ?
+            )
+        """, (*params, int(chunk)))
+        conn.commit()
+        n = int(cur.rowcount or 0)
+        total += n
+        if n < chunk:
+            return total
+
+
+def rollup_change_log(conn: sqlite3.Connection, days: int = RETENTION_CHANGE_LOG_DAYS,
+                      chunk: int = RETENTION_DELETE_CHUNK) -> int:
+    """
+    Folds old change-log rows of unmonitored orders into order_change_log_rollup
+    and deletes them, chunk rows per transaction. Returns rows rolled up.
+    """
+    cutoff = _cutoff_iso(days)
+    total = 0
+
+    while True:
+        ids = [int(r[0]) for r in conn.execute("""
+            SELECT id
+            FROM order_change_log
+            WHERE created_ts < ?
+              AND so4_sordernum NOT IN (SELECT sordernum FROM lws_order_state)
+            ORDER BY id
+            LIMIT ?
+        """, (cutoff, int(chunk))).fetchall()]
+        if not ids:
+            return total
+
+        marks = ",".join("?" for _ in ids)
+        # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the join
+        conn.execute(f"""
+            INSERT INTO order_change_log_rollup(
+                so4_sordernum, change_type, row_count, first_ts, last_ts,
+                last_old_value, last_new_value, last_run_id, updated_ts
+            )
+            SELECT g.so4_sordernum, g.change_type, g.n, g.first_ts, l.created_ts,
+                   l.old_value, l.new_value, l.run_id, ?
+            FROM (
+                SELECT so4_sordernum, change_type, COUNT(*) AS n,
+                       MIN(created_ts) AS first_ts, MAX(id) AS last_id
+                FROM order_change_log
+                WHERE id IN ({marks})
+                GROUP BY so4_sordernum, change_type
+            ) g
+            JOIN order_change_log l ON l.id = g.last_id
+            WHERE true
+            ON CONFLICT(so4_sordernum, change_type) DO UPDATE SET
+                row_count = row_count + excluded.row_count,
+                first_ts = MIN(COALESCE(first_ts, excluded.first_ts), COALESCE(excluded.first_ts, first_ts)),
+                last_ts = CASE WHEN COALESCE(excluded.last_ts, '') >= COALESCE(last_ts, '')
+                               THEN excluded.last_ts ELSE last_ts END,
+                last_old_value = CASE WHEN COALESCE(excluded.last_ts, '') >= COALESCE(last_ts, '')
+                                      THEN excluded.last_old_value ELSE last_old_value END,
+                last_new_value = CASE WHEN COALESCE(excluded.last_ts, '') >= COALESCE(last_ts, '')
+                                      THEN excluded.last_new_value ELSE last_new_value END,
+                last_run_id = CASE WHEN COALESCE(excluded.last_ts, '') >= COALESCE(last_ts, '')
+                                   THEN excluded.last_run_id ELSE last_run_id END,
+                updated_ts = excluded.updated_ts
+        """, (_now_utc_iso(), *ids))
+        conn.execute(f"DELETE FROM order_change_log WHERE id IN ({marks})", ids)
+        conn.commit()
+
+        total += len(ids)
+        if len(ids) < chunk:
+            return total
+
+
+def cascade_archived_orders(conn: sqlite3.Connection, grace_days: int = RETENTION_ARCHIVED_GRACE_DAYS,
+                            chunk: int = RETENTION_DELETE_CHUNK) -> Dict[str, int]:
+    """Removes per-order Phase 2 state of archived orders. Returns {table: rows deleted}."""
+    grace = f"-{int(grace_days)} days"
+    out = {}
+    for table, where in _ARCHIVE_CASCADE.items():
+        out[table] = delete_in_chunks(conn, table, where, (grace,) * where.count("?"), chunk)
+    return out
+
+
+def trim_snapshot_versions(conn: sqlite3.Connection, days: int = RETENTION_SNAPSHOT_VERSIONS_DAYS,
+                           keep: int = RETENTION_SNAPSHOT_VERSIONS_KEEP,
+                           chunk: int = RETENTION_DELETE_CHUNK) -> int:
+    """Drops old snapshot versions, always keeping the newest `keep` per entity."""
+    return delete_in_chunks(conn, "snapshot_versions", """
+        created_ts < ?
+        AND version <= COALESCE((
+            SELECT h.version FROM snapshot_hash h
+            WHERE h.kind = snapshot_versions.kind
+              AND h.entity_key = snapshot_versions.entity_key
+        ), 0) - ?
+    """, (_cutoff_iso(days), max(1, int(keep))), chunk)
+
+
+def reclaim_space(conn: sqlite3.Connection, pages: int = RETENTION_VACUUM_PAGES) -> Dict[str, int]:
+    """
+    Returns up to `pages` free pages to the OS. Needs auto_vacuum=INCREMENTAL,
+    which only new files get; RETENTION_CONVERT_AUTO_VACUUM converts an existing
+    state.db with one full VACUUM (exclusive lock, run it in a quiet window).
+    """
+    mode = int(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+    if mode != 2 and RETENTION_CONVERT_AUTO_VACUUM:
+        log.info("[RETENTION] Converting state DB to auto_vacuum=INCREMENTAL (full VACUUM).")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        mode = int(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+
+    free_before = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+    if mode != 2:
+        if free_before:
+            log.info(f"[RETENTION] {free_before} free page(s) stay in state.db (auto_vacuum is not INCREMENTAL).")
+        return {"free_pages": free_before, "reclaimed_pages": 0}
+
+    if pages > 0 and free_before:
+        # executescript steps the pragma to completion; execute() frees a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    free_after = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+    return {"free_pages": free_after, "reclaimed_pages": free_before - free_after}
+
+
+def run_retention() -> Dict[str, Any]:
+    """Applies every policy once. Returns per-step counts for the maintenance log."""
+    if not RETENTION_ENABLED:
+        return {}
+
+    conn = state_conn()
+    try:
+        stats: Dict[str, Any] = {"change_log_rolled_up": rollup_change_log(conn)}
+        stats["archived_cascade"] = cascade_archived_orders(conn)
+        stats["snapshot_versions_trimmed"] = trim_snapshot_versions(conn)
+        stats.update(reclaim_space(conn))
+        return stats
+    finally:
+        conn.close()
@@ -6,7 +6,7 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List, Tuple
 
 from api import send_post_request, decode_generic, b64_json
-from db import rquery
+from db import rquery, rquery_in
 from logger import get_logger
 import time
 
@@ -29,6 +29,9 @@ def _get_first(d: Dict[str, Any], *keys, default=None):
 
     return default
 
+def _line_item(row: Dict[str, Any]) -> str:
+    return str(_get_first(row, "ItemCode", "ITEMCODE", "itemcode", default="") or "").strip()
+
 def _get_first(d: dict, *keys, default=None):
     """
     Case-insensitive safe getter for DB rows.
@@ -116,14 +119,13 @@ def get_so_lines_p2(conn, so_num: int, retries: int = 6, delay_s: float = 1.0) -
     last: List[Dict[str, Any]] = []
     for i in range(retries):
         try:
-            rows = rquery(conn, sql, (so_num,)) or []
+            # Lines without an ItemCode yet are not cached, so the retry reads Radius again
+            rows = rquery(conn, sql, (so_num,), cache_if=lambda r: bool(r) and bool(_line_item(r[0]))) or []
             last = rows
 
             if rows:
                 # validate first line has an itemcode (case-insensitive)
-                l0 = rows[0]
-                item = str(_get_first(l0, "ItemCode", "ITEMCODE", "itemcode", default="") or "").strip()
-                if item:
+                if _line_item(rows[0]):
                     return rows
 
             # IMPORTANT: reset RO transaction snapshot if any
@@ -139,11 +141,39 @@ def get_so_lines_p2(conn, so_num: int, retries: int = 6, delay_s: float = 1.0) -
             except Exception:
                 pass
 
-        time.sleep(delay_s)
+        if i < retries - 1:
+            time.sleep(delay_s)
 
     return last
 
 
+def get_so_line_counts_p2(conn, so_nums: List[int]) -> Dict[int, int]:
+    """
+    Batch check for the deferred verify queue: {SOrderNum: number of lines with an ItemCode}.
+    SOs without usable lines are absent.
+    """
+    sql = """
+    SELECT sol."SOrderNum" AS SOrderNum, sol."ItemCode" AS ItemCode
+    FROM "PUB"."PV_SOrderLine" sol
+    WHERE sol."CompNum" = 2
+      AND sol."PlantCode" = '2'
+      AND sol."SOrderNum" IN ({marks})
+    """
+    wanted = {int(x) for x in so_nums or []}
+
+    def _every_so_has_lines(rows) -> bool:
+        # Cache only when no requested SO is still at zero lines (the next pass must re-read)
+        seen = {_get_first(r, "SOrderNum") for r in rows if _line_item(r)}
+        return {int(so) for so in seen if so is not None} >= wanted
+
+    out: Dict[int, int] = {}
+    for r in rquery_in(conn, sql, sorted(wanted), cache_if=_every_so_has_lines):
+        so_num = _get_first(r, "SOrderNum")
+        if so_num is not None and _line_item(r):
+            out[int(so_num)] = out.get(int(so_num), 0) + 1
+    return out
+
+
 def find_existing_shipreq_for_so_p2(conn, so_num: int) -> Optional[str]:
     """
     Try to locate an existing ShipReqNum for a Plant2 Sales Order.
@@ -179,12 +209,14 @@ def create_shipreq_for_so_p2(
     ro_conn,
     so_num: int,
     logger=None,
+    line_retries: int = 6,
 ) -> Optional[str]:
     """
     Create Shipping Request via entity 'XLinkAPIShipReq'
     after Plant 2 SO is successfully created.
     Returns ShipReqNum if API returns it, otherwise None (but still logs/validates).
     Raises RuntimeError on API/validation failure.
+    line_retries=1 reads the SO lines once (no sleeping) for callers that defer instead.
     """
     logger = logger or log
     existing = find_existing_shipreq_for_so_p2(ro_conn, so_num)
@@ -194,7 +226,7 @@ def create_shipreq_for_so_p2(
 
 
     hdr = get_so_header_p2(ro_conn, so_num)
-    lines = get_so_lines_p2(ro_conn, so_num)
+    lines = get_so_lines_p2(ro_conn, so_num, retries=line_retries)
 
     if not lines:
         raise RuntimeError(f"No Plant2 SO lines found for SO {so_num} (cannot create ShipReq)")
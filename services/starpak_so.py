@@ -1,9 +1,10 @@
 #starpak_so.py
+import json
 from typing import Optional
 from datetime import datetime, timedelta
 
-from db import rquery
-from api import send_post_request, decode_sorder_response, b64_json
+from db import rquery, rquery_in
+from api import send_post_request, decode_sorder_response, decode_generic, b64_json, xlink_client
 from logger import get_logger
 from exceptions import WorkflowApiError
 
@@ -85,6 +86,52 @@ def find_existing_so_by_po(conn, pordernum: int) -> Optional[int]:
 
     return int(so_num)
 
+def find_existing_sos_by_pos(conn, pordernums: list[int]) -> dict[int, int]:
+    """
+    Batch version of find_existing_so_by_po: {PolyTex POrderNum: StarPak SOrderNum}
+    matched on AddtCustRef (latest LastUpdatedDateTime wins).
+    """
+    sql = """
+    SELECT so."SOrderNum" AS SOrderNum, so."AddtCustRef" AS AddtCustRef
+    FROM "PUB"."PV_SOrder" so
+    WHERE so."CompNum" = 2
+      AND so."PlantCode" = '2'
+      AND so."SOSourceCode" = 'LWS'
+      AND so."AddtCustRef" IN ({marks})
+    ORDER BY so."LastUpdatedDateTime" DESC
+    """
+    out: dict[int, int] = {}
+    for r in rquery_in(conn, sql, [str(int(x)) for x in pordernums or []]):
+        ref = str(r.get("AddtCustRef") or r.get("addtcustref") or "").strip()
+        so_num = r.get("SOrderNum") or r.get("sordernum")
+        if not ref.isdigit() or so_num is None:
+            continue
+        out.setdefault(int(ref), int(so_num))
+    return out
+
+
+def get_so_statuses_p2(conn, sordernums: list[int]) -> dict[int, int]:
+    """
+    Batch version of get_so_status_p2: {Plant2 SOrderNum: SOrderStat}. Missing SOs are absent.
+    """
+    sql = """
+    SELECT so."SOrderNum" AS SOrderNum, so."SOrderStat" AS SOrderStat
+    FROM "PUB"."PV_SOrder" so
+    WHERE so."CompNum" = 2
+      AND so."PlantCode" = '2'
+      AND so."SOrderNum" IN ({marks})
+    """
+    out: dict[int, int] = {}
+    for r in rquery_in(conn, sql, [int(x) for x in sordernums or []]):
+        so_num = r.get("SOrderNum") or r.get("sordernum")
+        stat = r.get("SOrderStat")
+        if stat is None:
+            stat = r.get("sorderstat")
+        if so_num is not None and stat is not None:
+            out[int(so_num)] = int(stat)
+    return out
+
+
 def get_so_line_qty_p2(conn, sordernum: int, sorderlinenum: int = 1) -> float | None:
     sql = """
     SELECT sol."OrderedQty" AS OrderedQty
@@ -141,103 +188,221 @@ def get_jobline_qty_p2(ro_conn, jobcode: str, fg_itemcode: str) -> float | None:
     return float(v) if v is not None else None
 
 
-def create_starpak_so(
-    conn,
+def _so_order_element(
     pordernum: int,
     custref_value: str,
     itemcode_1600: str,
     qty: float,
     required_date: str,
     so_item_type_code: str,
-    logger
-) -> int:
-
+) -> dict:
+    """One XLSOrders.XLSOrder element for the StarPak SO of PolyTex PO pordernum."""
     today = datetime.now()
     try:
         req_dt = datetime.fromisoformat(required_date[:10])
     except Exception:
         req_dt = today + timedelta(days=7)
 
-    payload = {
-        "XLSOrders": {
-            "XLSOrder": [{
-                "CompNum": 2,
-                "PlantCode": PLANT_P2,
-                "CustCode": CUSTCODE_STP,
-                "CustRef": str(custref_value),
-                "AddtCustRef": str(pordernum),
-                "SOrderDate": today.strftime("%Y-%m-%d"),
-                "CustReqDate": req_dt.strftime("%Y-%m-%d"),
-                "SOSourceCode": "LWS",
-                "CurrCode": "USD",
-                "DaysPrior": 1,
-                "TermsCode": "NET 30",
-                "XLSOrderLine": [{
-                    "SOrderLineNum": 1,
-                    "PlantCode": "2",
-                    "CompNum": 2,
-                    "ItemCode": itemcode_1600,
-                    "OrderedQty": float(qty),
-                    "ReqDate": req_dt.strftime("%Y-%m-%d"),
-                    "PriceUnitCode": "KFEET",
-                    "SOItemTypeCode": so_item_type_code,
-                    "UnitPrice": 0.01
-                }]
-            }]
-        }
+    return {
+        "CompNum": 2,
+        "PlantCode": PLANT_P2,
+        "CustCode": CUSTCODE_STP,
+        "CustRef": str(custref_value),
+        "AddtCustRef": str(pordernum),
+        "SOrderDate": today.strftime("%Y-%m-%d"),
+        "CustReqDate": req_dt.strftime("%Y-%m-%d"),
+        "SOSourceCode": "LWS",
+        "CurrCode": "USD",
+        "DaysPrior": 1,
+        "TermsCode": "NET 30",
+        "XLSOrderLine": [{
+            "SOrderLineNum": 1,
+            "PlantCode": "2",
+            "CompNum": 2,
+            "ItemCode": itemcode_1600,
+            "OrderedQty": float(qty),
+            "ReqDate": req_dt.strftime("%Y-%m-%d"),
+            "PriceUnitCode": "KFEET",
+            "SOItemTypeCode": so_item_type_code,
+            "UnitPrice": 0.01
+        }]
     }
 
-    resp = send_post_request("XLinkAPISOrder", b64_json(payload), logger)
-    decoded = decode_sorder_response(resp)
 
-    # ------------------------------------------------------------
-    # ✅ Raise structured API error so fail_order() can email real API details
-    # ------------------------------------------------------------
-    if decoded.status_code != 1:
-        api_entity = getattr(decoded, "entity_name", None) or getattr(decoded, "entityName", None) or "XLinkAPISOrder"
-        api_status = getattr(decoded, "status_code", None)
+def _so_api_error(decoded, raw_response_text, api_messages=None) -> WorkflowApiError:
+    """Structured API error so fail_order() can email real API details."""
+    api_entity = getattr(decoded, "entity_name", None) or getattr(decoded, "entityName", None) or "XLinkAPISOrder"
+    api_status = getattr(decoded, "status_code", None)
 
-        api_error_message = (
-            getattr(decoded, "error_message", None)
-            or getattr(decoded, "errorMessage", None)
-            or None
-        )
+    api_error_message = (
+        getattr(decoded, "error_message", None)
+        or getattr(decoded, "errorMessage", None)
+        or None
+    )
 
+    if api_messages is None:
         api_messages = list(getattr(decoded, "messages", None) or [])
 
-        raise WorkflowApiError(
-            f"SO API error: {api_messages}" if api_messages else "SO API error",
-            api_entity=api_entity,
-            api_status=api_status,
-            api_error_message=api_error_message,
-            api_messages=api_messages,
-            raw_response_text=getattr(resp, "text", None),
-        )
+    return WorkflowApiError(
+        f"SO API error: {api_messages}" if api_messages else "SO API error",
+        api_entity=api_entity,
+        api_status=api_status,
+        api_error_message=api_error_message,
+        api_messages=api_messages,
+        raw_response_text=raw_response_text,
+    )
 
-    dp = decoded.decoded_payload or {}
 
-    orders = None
-    if isinstance(dp, dict):
-        if "XLSOrders" in dp:
-            orders = (dp.get("XLSOrders") or {}).get("XLSOrder")
-        elif "XLSOrder" in dp:
-            orders = dp.get("XLSOrder")
-    elif isinstance(dp, list):
-        orders = dp
+def _row_so_num(so_row: dict):
+    """SOrderNum Radius assigned to one returned XLSOrder, or None."""
+    return so_row.get("SOrderNum") or so_row.get("SORDERNUM") or so_row.get("sordernum") or None
 
-    if not orders:
-        raise RuntimeError(f"SO succeeded but payload shape unexpected: {dp}")
 
-    so_row = orders[0] if isinstance(orders, list) else orders
+def create_starpak_so(
+    conn,
+    pordernum: int,
+    custref_value: str,
+    itemcode_1600: str,
+    qty: float,
+    required_date: str,
+    so_item_type_code: str,
+    logger
+) -> int:
 
-    so_num = (
-        so_row.get("SOrderNum")
-        or so_row.get("SORDERNUM")
-        or so_row.get("sordernum")
-    )
+    payload = _single_so_payload(pordernum, custref_value, itemcode_1600, qty, required_date, so_item_type_code)
+
+    resp = send_post_request("XLinkAPISOrder", payload, logger)
+    return _created_so_num(resp, decode_sorder_response(resp))
+
+
+def _single_so_payload(pordernum, custref_value, itemcode_1600, qty, required_date, so_item_type_code) -> str:
+    return b64_json({"XLSOrders": {"XLSOrder": [
+        _so_order_element(pordernum, custref_value, itemcode_1600, qty, required_date, so_item_type_code)
+    ]}})
+
+
+def _created_so_num(resp, decoded) -> int:
+    """SOrderNum of a single-SO create response; raises like create_starpak_so."""
+    # ------------------------------------------------------------
+    # ✅ Raise structured API error so fail_order() can email real API details
+    # ------------------------------------------------------------
+    if decoded.status_code != 1:
+        raise _so_api_error(decoded, getattr(resp, "text", None))
+
+    orders = decoded.elements()
+
+    if not orders:
+        raise RuntimeError(f"SO succeeded but payload shape unexpected: {decoded.decoded_payload or {}}")
+
+    so_row = orders[0]
+    so_num = _row_so_num(so_row)
 
     if so_num is None:
         raise RuntimeError(f"SO succeeded but SOrderNum missing. Keys={list(so_row.keys())} row={so_row}")
 
     return int(so_num)
 
+
+def _element_errors(so_row: dict) -> list[str]:
+    """Header + line ErrorMessages of one returned XLSOrder (same shape decode_sorder_response reads)."""
+    sn = so_row.get("SOrderNum", "")
+    msgs = []
+    hdr = str(so_row.get("ErrorMessage") or "").strip()
+    if hdr:
+        msgs.append(f"SO {sn}: {hdr}")
+    for key in ("XLSOrderLine", "XLSOrderPrice"):
+        for line in so_row.get(key) or []:
+            lm = str((line or {}).get("ErrorMessage") or "").strip()
+            if lm:
+                msgs.append(f"SO {sn} Item {line.get('ItemCode', '')}: {lm}")
+    return msgs
+
+
+def create_starpak_sos(ro_conn, requests: list[dict], logger) -> dict:
+    """
+    Batch version of create_starpak_so: one XLinkAPISOrder call with one XLSOrder
+    per PolyTex PO. requests = [{"pordernum", "custref_value", "itemcode_1600", "qty",
+    "required_date", "so_item_type_code"}].
+
+    Returns {str(pordernum): SOrderNum or WorkflowApiError}, matched on AddtCustRef.
+    An element with a SOrderNum was created (its ErrorMessages are only logged,
+    as in the single call); header/line ErrorMessages without a SOrderNum fail
+    only the PO they belong to. POs without a result (batch rejected as a whole,
+    or left out of the response) are first looked up by AddtCustRef, then
+    created one SO per call, posted concurrently through the XLink client.
+    """
+    by_po = {str(int(r["pordernum"])): r for r in requests or []}
+    if not by_po:
+        return {}
+
+    payload = {"XLSOrders": {"XLSOrder": [
+        _so_order_element(
+            int(po), r["custref_value"], r["itemcode_1600"], r["qty"], r["required_date"], r["so_item_type_code"],
+        )
+        for po, r in by_po.items()
+    ]}}
+
+    out: dict = {}
+    decoded = None
+    try:
+        resp = send_post_request("XLinkAPISOrder", b64_json(payload), logger)
+        decoded = decode_generic(resp)
+        rows = decoded.elements()
+    except Exception as e:
+        logger.warning(f"[Batch SO] {len(by_po)} SO(s): batch call failed, retrying one by one: {e}")
+        rows = []
+
+    for so_row in rows:
+        if not isinstance(so_row, dict):
+            continue
+        po = str(so_row.get("AddtCustRef") or "").strip()
+        if po not in by_po:
+            continue
+        msgs = _element_errors(so_row)
+        so_num = _row_so_num(so_row)
+        if so_num:
+            out[po] = int(so_num)
+            if msgs:
+                logger.warning(f"[Batch SO] PO {po}: SO {so_num} created with message(s): {msgs}")
+        elif msgs:
+            out[po] = _so_api_error(decoded, json.dumps(so_row, default=str)[:4000], msgs)
+        # neither: not created because of another element -> single-call fallback below
+
+    missing = [po for po in by_po if po not in out]
+    if missing:
+        if decoded is not None:
+            logger.warning(
+                f"[Batch SO] status={decoded.status_code} returned {len(out)}/{len(by_po)} SO(s) "
+                f"({decoded.messages or 'no per-order result'}); falling back to single calls for {len(missing)}"
+            )
+        try:
+            existing = find_existing_sos_by_pos(ro_conn, [int(po) for po in missing])
+        except Exception as e:
+            logger.warning(f"[Batch SO] AddtCustRef lookup before fallback failed: {e}")
+            existing = {}
+
+        # ✅ One SO per call, posted concurrently (XLINK_MAX_IN_FLIGHT / XLINK_ENTITY_LIMITS still apply)
+        singles, calls = [], []
+        for po in missing:
+            if int(po) in existing:
+                out[po] = int(existing[int(po)])
+                continue
+            r = by_po[po]
+            singles.append(po)
+            calls.append(("XLinkAPISOrder", _single_so_payload(
+                int(po), r["custref_value"], r["itemcode_1600"], r["qty"], r["required_date"], r["so_item_type_code"],
+            )))
+
+        for po, res in zip(singles, xlink_client().post_all(calls, logger, decoder=decode_sorder_response)):
+            if isinstance(res, Exception):
+                out[po] = res
+                continue
+            try:
+                out[po] = _created_so_num(*res)
+            except Exception as e:
+                out[po] = e
+
+    ok = sum(1 for v in out.values() if not isinstance(v, Exception))
+    logger.info(f"[Batch SO] {ok}/{len(by_po)} StarPak SO(s) created for {len(by_po)} PO(s)")
+    return out
+
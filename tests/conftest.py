@@ -0,0 +1,124 @@
+# tests/conftest.py
+"""
+Shared fixtures. Tests run against a throw-away state DB and never touch Radius:
+Radius reads/writes are replaced per test with monkeypatch.
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# ✅ Keep test runs out of logs/lws_workflow.log and off the LIVE defaults
+os.environ.setdefault("ENV", "TEST")
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "lws_workflow_tests.log"))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+pytest.importorskip("pyodbc")
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    """Fresh state.db (full schema) for one test; yields the db module."""
+    import db
+
+    db.STATE_STORE.close_all()
+    monkeypatch.setattr(db.STATE_STORE, "path", str(tmp_path / "state.db"))
+    db.init_state_db(force=True)
+    yield db
+    db.STATE_STORE.close_all()
+
+
+class FakeResponse:
+    """Stands in for requests.Response coming back from the efiRadius adapter."""
+
+    def __init__(self, text: str, status_code: int = 200):
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+@pytest.fixture
+def radius_response():
+    """radius_response(status, payload=None, error="") -> FakeResponse with a base64 JSON payload."""
+
+    def _make(status, payload=None, error="", entity="XLinkAPI", raw_payload=None):
+        env = {"statusCode": status, "entityName": entity, "errorMessage": error}
+        if payload is not None:
+            env["payload"] = base64.b64encode(json.dumps(payload).encode()).decode()
+        if raw_payload is not None:
+            env["payload"] = raw_payload
+        return FakeResponse(json.dumps({"efiRadiusResponse": env}))
+
+    return _make
+
+
+class FakeRadiusConn:
+    """
+    pyodbc-like Radius connection. handler(sql, params) -> list of row dicts;
+    every executed (sql, params) is kept in .executed.
+    """
+
+    autocommit = False
+
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda sql, params: [])
+        self.executed = []
+        self.committed = 0
+        self.rolled_back = 0
+        self.closed = False
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        self.committed += 1
+
+    def rollback(self):
+        self.rolled_back += 1
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._rows = []
+        self.description = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        self._conn.executed.append((sql, tuple(params)))
+        rows = list(self._conn.handler(sql, tuple(params)) or [])
+        cols = list(rows[0].keys()) if rows else []
+        self.description = [(c,) for c in cols]
+        self._rows = [tuple(r.get(c) for c in cols) for r in rows]
+        self.rowcount = len(rows)
+        return self
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def radius_conn():
+    """radius_conn(handler=None) -> FakeRadiusConn."""
+    return FakeRadiusConn
@@ -0,0 +1,124 @@
+# tests/test_batch_create.py
+import base64
+import json
+import logging
+
+import pytest
+
+from services import aop_batch, batch_create
+
+LOG = logging.getLogger("test_batch_create")
+
+
+def _aop_result(so, job):
+    return {"JobCode": job, "Requirements": [{"Source": f"SO {so} / Line 1"}]}
+
+
+@pytest.fixture
+def aop(monkeypatch, radius_response):
+    """Fake AdvancedOrderProcessing: answers for every SO except those in `bad`."""
+    calls, bad = [], set()
+
+    def _post(entity, b64_payload, logger):
+        sos = [c["SOrderNum"] for c in json.loads(base64.b64decode(b64_payload))["OrderProcessingLoadCriteria"]]
+        calls.append(sos)
+        if bad & set(sos):
+            return radius_response(9, error="AOP failed")
+        return radius_response(1, {"Output": {"Results": [_aop_result(so, f"J{so}") for so in sos]}})
+
+    monkeypatch.setattr(aop_batch, "send_post_request", _post)
+    return calls, bad
+
+
+def _create(sos, singles, existing=None):
+    def single(so):
+        singles.append(so)
+        if so == 13:
+            raise RuntimeError("SO 13 is on hold")
+        return f"S{so}"
+
+    return aop_batch.create_jobs(
+        None, "4", sos,
+        job_from_result=lambda so, result, resp, decoded, dp: result["JobCode"],
+        single_create=single,
+        find_existing=lambda conn, sos: {so: existing[so] for so in sos if so in (existing or {})},
+        logger=LOG,
+    )
+
+
+def test_one_call_for_the_whole_batch(aop):
+    calls, _ = aop
+    singles = []
+    assert _create([11, 12, 14], singles) == {"11": "J11", "12": "J12", "14": "J14"}
+    assert calls == [[11, 12, 14]]
+    assert singles == []
+
+
+def test_bad_order_is_bisected_out(aop):
+    calls, bad = aop
+    bad.add(13)
+    singles = []
+
+    out = _create([11, 12, 13, 14], singles, existing={12: "JEXIST"})
+
+    assert out["12"] == "JEXIST"  # PV_JobSOLink hit, not re-created
+    assert isinstance(out["13"], RuntimeError)
+    # [11, 13, 14] is split in two; halves of one SO use the single create
+    assert calls == [[11, 12, 13, 14], [13, 14]]
+    assert singles == [11, 13, 14]
+    assert out["11"] == "S11" and out["14"] == "S14"
+
+
+def test_results_by_so_skips_ambiguous_results():
+    dp = {"Output": {"Results": [
+        _aop_result(1, "J1"),
+        {"JobCode": "JX", "Requirements": [{"Source": "SO 2"}, {"Source": "SO 3"}]},
+    ]}}
+    assert aop_batch.results_by_so(dp, [1, 2, 3]) == {1: _aop_result(1, "J1")}
+
+
+@pytest.fixture
+def creator(monkeypatch):
+    seen = []
+
+    def _create(ro_conn, requests, logger):
+        keys = [r["jobcode"] for r in requests]
+        seen.append(keys)
+        if "BOOM" in keys:
+            raise RuntimeError("XLink down")
+        return {k: f"PO-{k}" for k in keys if k != "NORESULT"}
+
+    monkeypatch.setitem(batch_create.KINDS, "PO_P4", (_create, "jobcode"))
+    return seen
+
+
+def test_batcher_chunks_and_records_per_key_results(creator):
+    b = batch_create.CreateBatcher(size=2)
+    for job in ("J1", "J2", "J3", "NORESULT"):
+        b.add("PO_P4", {"jobcode": job})
+    b.add("PO_P4", {"jobcode": "J1"})  # queued twice, created once
+    assert b.pending_count() == 4
+
+    assert b.flush(None, LOG) == 4
+    assert creator == [["J1", "J2"], ["J3", "NORESULT"]]
+    assert b.pending_count() == 0
+    assert b.result("PO_P4", "J3") == "PO-J3"
+    assert isinstance(b.result("PO_P4", "NORESULT"), RuntimeError)
+    assert b.has_result("PO_P4", "J1") and not b.has_result("PO_P4", "J9")
+    assert b.result("PO_P4", "J9") is None
+
+    # Already created: add() does not queue it again
+    b.add("PO_P4", {"jobcode": "J1"})
+    assert b.pending_count() == 0
+
+
+def test_batcher_failed_chunk_fails_only_its_keys(creator):
+    b = batch_create.CreateBatcher(size=2)
+    for job in ("BOOM", "J2", "J3"):
+        b.add("PO_P4", {"jobcode": job})
+    b.discard("PO_P4", "J3")
+
+    b.flush(None, LOG)
+    assert isinstance(b.result("PO_P4", "BOOM"), RuntimeError)
+    assert isinstance(b.result("PO_P4", "J2"), RuntimeError)
+    assert not b.has_result("PO_P4", "J3")
@@ -0,0 +1,58 @@
+# tests/test_change_log.py
+import pytest
+
+
+def _rows(db):
+    conn = db.state_conn()
+    try:
+        return conn.execute("SELECT change_type, new_value, new_value_num FROM order_change_log ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_buffered_rows_are_written_on_exit_and_dedupe_sees_them(state_db):
+    conn = state_db.state_conn()
+    with state_db.change_log_writer():
+        state_db.insert_change_log(conn, "RUN1", 1, 1, "SO4_QTY_CHANGED", old_value=10, new_value=7700)
+        assert _rows(state_db) == []
+        # '7700.0' vs 7700: same numeric value, already logged while still buffered
+        assert state_db.change_already_logged(conn, 1, 1, "SO4_QTY_CHANGED", 7700.0)
+        assert not state_db.change_already_logged(conn, 1, 2, "SO4_QTY_CHANGED", 7700.0)
+
+    assert [tuple(r) for r in _rows(state_db)] == [("SO4_QTY_CHANGED", "7700", 7700.0)]
+    assert state_db.change_already_logged(conn, 1, 1, "SO4_QTY_CHANGED", 7700)
+    conn.close()
+
+
+def test_text_values_never_match_a_numeric_probe(state_db):
+    conn = state_db.state_conn()
+    with state_db.change_log_writer():
+        state_db.insert_change_log(conn, "RUN1", 2, 0, "CUSTREF_CHANGED", old_value="A", new_value="B")
+        assert not state_db.change_already_logged(conn, 2, 0, "CUSTREF_CHANGED", None)
+    assert not state_db.change_already_logged(conn, 2, 0, "CUSTREF_CHANGED", None)
+    conn.close()
+
+
+def test_exception_still_flushes_and_nesting_joins(state_db):
+    conn = state_db.state_conn()
+    with pytest.raises(RuntimeError):
+        with state_db.change_log_writer() as outer:
+            with state_db.change_log_writer() as inner:
+                assert inner is outer
+                state_db.insert_change_log(conn, "RUN1", 3, 1, "P2_HOLD", new_value=1)
+            assert _rows(state_db) == []
+            raise RuntimeError("boom")
+
+    assert len(_rows(state_db)) == 1
+    conn.close()
+
+
+def test_dedupe_lookup_uses_the_index(state_db):
+    conn = state_db.state_conn()
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT 1 FROM order_change_log
+         WHERE so4_sordernum = 1 AND so4_linenum = 1 AND change_type = 'X' AND new_value_num IS 1
+    """).fetchall()
+    conn.close()
+    assert any("idx_order_change_log_dedupe" in str(tuple(r)) for r in plan)
@@ -0,0 +1,163 @@
+# tests/test_change_poller.py
+import pytest
+
+from services import change_poller, monitor_scheduler
+
+
+def _poll(so4, marks):
+    return {"so4": so4, "marks": marks, "outbox_events": {}, "qty_lines": {}}
+
+
+def test_skipped_orders_do_not_freeze_the_marks(state_db):
+    poll = _poll({1, 2, 3}, {"SO_LINES": "2026-10-01T10:00:00", change_poller.FULL_SWEEP_SOURCE: None})
+
+    change_poller.commit_marks(poll, skipped={2, 3})
+
+    marks = state_db.get_watermarks()
+    assert marks["SO_LINES"]["high_water"] == "2026-10-01T10:00:00"
+    assert marks[change_poller.FULL_SWEEP_SOURCE]["updated_ts"]
+    # the skipped SOs are queued for the next (incremental) run
+    assert monitor_scheduler.pending_sos("2A", [1, 2, 3, 4]) == {2, 3}
+
+
+def test_checking_a_pending_order_clears_it(state_db):
+    change_poller.commit_marks(_poll({5, 6}, {"SO_LINES": "2026-10-01T10:00:00"}), skipped={5, 6})
+
+    done = monitor_scheduler.run_batched("2A", [5], lambda batch: None)
+
+    assert done == [5]
+    assert monitor_scheduler.pending_sos("2A", [5, 6]) == {6}
+
+
+def test_watermark_polling_goes_incremental_after_the_first_sweep(state_db, radius_conn, monkeypatch):
+    from datetime import datetime, timedelta
+
+    monkeypatch.setattr(change_poller, "PHASE2A_OUTBOX_ENABLED", False)
+    monkeypatch.setattr(change_poller, "WATERMARK_POLLING_ENABLED", True)
+    monkeypatch.setattr(change_poller, "WATERMARK_OVERLAP_MINUTES", 5)
+    t0 = datetime(2026, 10, 1, 10, 0, 0)
+
+    def _radius(sql, params):
+        if "MAX(" in sql:
+            return [{"HighWater": t0}]
+        if '"PV_SOrderLine"' in sql:
+            return [{"SOrderNum": 7, "LastUpdatedDateTime": t0 + timedelta(minutes=3)}]
+        return [{"SOrderNum": 8, "LastUpdatedDateTime": t0 - timedelta(minutes=1)}]
+
+    ro = radius_conn(_radius)
+
+    first = change_poller.poll_changed_so4(ro)
+    assert first["so4"] is None  # no marks yet: full sweep, marks start at Radius' max
+    change_poller.commit_marks(first)
+
+    second = change_poller.poll_changed_so4(ro)
+    assert second["so4"] == {7, 8}
+    # the window re-reads the overlap before the mark
+    assert ro.executed[-1][1] == (t0 - timedelta(minutes=5),)
+    change_poller.commit_marks(second)
+
+    marks = state_db.get_watermarks()
+    assert marks["SO4_LINE"]["high_water"] == (t0 + timedelta(minutes=3)).isoformat(sep=" ")
+    assert marks["SO4_HEADER"]["high_water"] == t0.isoformat(sep=" ")
+
+
+def test_a_failing_source_turns_the_run_into_a_full_sweep(state_db, radius_conn, monkeypatch):
+    monkeypatch.setattr(change_poller, "PHASE2A_OUTBOX_ENABLED", False)
+    monkeypatch.setattr(change_poller, "WATERMARK_POLLING_ENABLED", True)
+    state_db.set_watermarks({
+        "SO4_HEADER": "2026-10-01 10:00:00", "SO4_LINE": "2026-10-01 10:00:00",
+        change_poller.FULL_SWEEP_SOURCE: None,
+    })
+
+    def _radius(sql, params):
+        if '"PV_SOrderLine"' in sql:
+            raise RuntimeError("ODBC timeout")
+        return []
+
+    poll = change_poller.poll_changed_so4(radius_conn(_radius))
+
+    assert poll["so4"] is None
+    assert "SO4_LINE" not in poll["marks"]  # its mark stays where it was
+    assert poll["marks"]["SO4_HEADER"] == "2026-10-01 10:00:00"
+
+
+def test_outbox_qty_events_drive_phase2a_and_are_acked_after_it(state_db, monkeypatch):
+    from services import outbox
+
+    monkeypatch.setattr(outbox, "OUTBOX_BACKEND", "sqlite")
+    monkeypatch.setattr(change_poller, "PHASE2A_OUTBOX_ENABLED", True)
+    monkeypatch.setattr(change_poller, "WATERMARK_POLLING_ENABLED", False)
+    state_db.set_watermarks({change_poller.FULL_SWEEP_SOURCE: None})
+
+    conn = state_db.state_conn()
+    outbox.enqueue_event(conn, "QTY_CHANGE", 31, 1)
+    outbox.enqueue_event(conn, "QTY_CHANGE", 31, 2)
+    outbox.enqueue_event(conn, "QTY_CHANGE", 32, 1)
+    outbox.enqueue_event(conn, "NEW_ORDER", 33)
+    conn.close()
+
+    poll = change_poller.poll_changed_so4(None)
+    assert poll["so4"] == {31, 32}
+    assert poll["qty_lines"] == {31: {1, 2}, 32: {1}}
+
+    # 32 did not fit the budget: its event stays Pending, the NEW_ORDER event is the listener's
+    change_poller.commit_marks(poll, skipped={32})
+    assert _pending(outbox) == [("QTY_CHANGE", 32), ("NEW_ORDER", 33)]
+
+
+def _pending(outbox):
+    conn = outbox.outbox_conn()
+    try:
+        return [(e.change_type, e.sordernum) for e in outbox.fetch_pending(conn)]
+    finally:
+        conn.close()
+
+
+def test_unmonitored_qty_events_stay_pending_until_phase1_ran(state_db, radius_conn, monkeypatch):
+    import app
+    from exceptions import RunLockLost
+    from services import outbox
+
+    monkeypatch.setattr(outbox, "OUTBOX_BACKEND", "sqlite")
+    monkeypatch.setattr(change_poller, "PHASE2A_OUTBOX_ENABLED", True)
+    monkeypatch.setattr(change_poller, "WATERMARK_POLLING_ENABLED", False)
+    state_db.set_watermarks({change_poller.FULL_SWEEP_SOURCE: None})
+
+    conn = state_db.state_conn()
+    outbox.enqueue_event(conn, "QTY_CHANGE", 41, 1)  # monitored: Phase 2A
+    outbox.enqueue_event(conn, "QTY_CHANGE", 42, 1)  # not monitored yet: Phase 1
+    conn.close()
+
+    monkeypatch.setattr(app, "get_readonly_conn", lambda: radius_conn())
+    monkeypatch.setattr(app, "get_db_conn", lambda: radius_conn())
+    monkeypatch.setattr(state_db, "get_orders_to_monitor", lambda: [41])
+    monkeypatch.setattr(state_db, "get_so4_needing_baseline", lambda conn, sos: set())
+    monkeypatch.setattr(app, "run_phase2a", lambda ro, rw, sq, run_id, sos: set())
+
+    def _lock_lost(*args):
+        raise RunLockLost("Run lock lost to other")
+
+    # the run dies after Phase 2A, before Phase 1 reached SO 42
+    monkeypatch.setattr(app, "run_phase2b", _lock_lost)
+
+    with pytest.raises(RunLockLost):
+        app._run_once(None, None, include_maintenance=False)
+
+    assert _pending(outbox) == [("QTY_CHANGE", 42)]
+
+
+def test_unreadable_outbox_falls_back_to_a_full_sweep(state_db, monkeypatch):
+    from services import outbox
+
+    def _down():
+        raise RuntimeError("SQL Server unreachable")
+
+    monkeypatch.setattr(outbox, "outbox_conn", _down)
+    monkeypatch.setattr(change_poller, "PHASE2A_OUTBOX_ENABLED", True)
+    monkeypatch.setattr(change_poller, "WATERMARK_POLLING_ENABLED", False)
+    state_db.set_watermarks({change_poller.FULL_SWEEP_SOURCE: None})
+
+    poll = change_poller.poll_changed_so4(None)
+
+    assert poll["so4"] is None
+    assert poll["outbox_events"] == {}
@@ -0,0 +1,71 @@
+# tests/test_daemon.py
+import threading
+import time
+
+from daemon import PeriodicJob
+
+
+def _job(name, func, stop, lock=None, interval_s=0.01):
+    job = PeriodicJob(name, 60, func, stop, lock)
+    job.interval_s = interval_s  # the constructor floors it at 1s
+    return job
+
+
+def test_failures_are_counted_and_the_job_keeps_running():
+    stop = threading.Event()
+    calls = []
+
+    def _func():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("Radius down")
+        if len(calls) == 3:
+            stop.set()
+
+    job = _job("workflow", _func, stop)
+    job.start()
+    job.join(5)
+
+    assert len(calls) == 3
+    assert (job.runs, job.failures) == (2, 1)
+
+
+def test_jobs_sharing_a_lock_never_overlap():
+    stop = threading.Event()
+    lock = threading.Lock()
+    active, overlaps = [], []
+
+    def _func():
+        active.append(1)
+        if len(active) > 1:
+            overlaps.append(1)
+        time.sleep(0.01)
+        active.pop()
+
+    jobs = [_job("workflow", _func, stop, lock), _job("outbox", _func, stop, lock)]
+    for j in jobs:
+        j.start()
+    time.sleep(0.2)
+    stop.set()
+    for j in jobs:
+        j.join(5)
+
+    assert overlaps == []
+    assert all(j.runs > 0 for j in jobs)
+
+
+def test_stop_skips_a_run_waiting_on_the_lock():
+    stop = threading.Event()
+    lock = threading.Lock()
+    calls = []
+
+    lock.acquire()
+    job = _job("outbox", lambda: calls.append(1), stop, lock)
+    job.start()
+    time.sleep(0.05)
+    stop.set()
+    lock.release()
+    job.join(5)
+
+    assert calls == []
+    assert not job._thread.is_alive()
@@ -0,0 +1,96 @@
+# tests/test_db_pool.py
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def make_pool(radius_conn):
+    opened = []
+
+    def _make(**kw):
+        def _connect():
+            c = radius_conn()
+            opened.append(c)
+            return c
+
+        kw.setdefault("min_size", 0)
+        kw.setdefault("max_size", 2)
+        return ConnectionPool("TEST", _connect, **kw)
+
+    return _make, opened
+
+
+def test_close_rolls_back_and_returns_the_connection(make_pool):
+    make, opened = make_pool
+    pool = make()
+
+    conn = pool.acquire()
+    conn.cursor().execute("UPDATE x SET y = 1")
+    conn.close()
+    conn.close()  # second close is a no-op
+
+    again = pool.acquire()
+    assert len(opened) == 1
+    assert again._raw is opened[0]
+    assert opened[0].rolled_back == 1
+    assert not opened[0].closed
+    assert pool.stats()["in_use"] == 1
+
+
+def test_waits_for_a_free_slot_then_times_out(make_pool):
+    make, _ = make_pool
+    pool = make(max_size=1, wait_timeout_s=0)
+
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+    # a release wakes a waiter
+    pool.wait_timeout_s = 5
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.acquire()))
+    t.start()
+    held.close()
+    t.join(5)
+    assert got and got[0]._raw is held._raw
+
+
+def test_failed_ping_and_old_connections_are_replaced(make_pool):
+    make, opened = make_pool
+    pool = make(ping_sql="SELECT 1")
+
+    conn = pool.acquire()
+    conn.close()
+
+    def _broken(sql, params):
+        raise RuntimeError("link down")
+
+    opened[0].handler = _broken
+    fresh = pool.acquire()
+    assert fresh._raw is opened[1]
+    assert opened[0].closed
+    assert pool.stats()["ping_failures"] == 1
+
+    pool.max_age_s = 1
+    fresh._created_at -= 10
+    fresh.close()
+    assert opened[1].closed
+    assert pool.stats()["size"] == 0
+
+
+def test_close_discards_idle_and_later_returns(make_pool):
+    make, opened = make_pool
+    pool = make()
+    a, b = pool.acquire(), pool.acquire()
+    a.close()
+
+    pool.close()
+    assert opened[0].closed and not opened[1].closed
+    b.close()
+    assert opened[1].closed
+    with pytest.raises(RuntimeError):
+        pool.acquire()
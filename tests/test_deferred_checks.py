@@ -0,0 +1,81 @@
+# tests/test_deferred_checks.py
+import pytest
+
+
+def _park_batched_po(app, so=501, jobcode="J501"):
+    from services.batch_create import CreateBatcher
+
+    prefetch = {"create_batcher": CreateBatcher(size=5)}
+    request = {"jobcode": jobcode, "itemcode": "IT", "qty": 1, "required_date": "2026-01-01", "dim_a": 1}
+    with pytest.raises(app.WorkflowDeferred):
+        with app.order_unit_of_work():
+            app._batched_create(prefetch, "PO_P4", request, "RUN1", so, job_p4=jobcode)
+    return prefetch
+
+
+def test_batched_create_park_survives_maintenance(state_db):
+    import app
+
+    prefetch = _park_batched_po(app)
+
+    assert state_db.get_order_status(501) == "IN_PROGRESS"
+    assert state_db.get_order_state_row(501)["last_step"] == "PO_P4_BATCH_PENDING"
+    assert prefetch["create_batcher"].pending_count() == 1
+
+    app.run_archive_and_purge()
+
+    rows = state_db.get_deferred_checks([501])
+    assert [(r["kind"], r["ref"]) for r in rows] == [("PO_P4_BATCH", "J501")]
+
+
+def test_purge_keeps_pending_steps_and_drops_finished_orders(state_db):
+    state_db.upsert_order_state(601, "IN_PROGRESS", "SO_P2_VERIFY_PENDING")
+    state_db.upsert_order_state(602, "IN_PROGRESS", "JOB_P4_BATCH_PENDING")
+    state_db.upsert_order_state(603, "COMPLETE", "COMPLETE")
+    for so in (601, 602, 603):
+        state_db.park_deferred_check(so, "X", "ref", "RUN1", 0)
+
+    # Inside the grace window nothing goes, whatever the order state
+    assert state_db.purge_stale_deferred_checks() == 0
+
+    assert state_db.purge_stale_deferred_checks(grace_minutes=0) == 1
+    assert sorted(r["sordernum"] for r in state_db.get_deferred_checks()) == [601, 602]
+
+
+def test_reparking_the_same_kind_counts_attempts(state_db):
+    assert state_db.park_deferred_check(701, "SO_P2_STATUS", 9001, "RUN1", 0) == 1
+    assert state_db.park_deferred_check(701, "SO_P2_STATUS", 9001, "RUN1", 0) == 2
+    # waiting on something else now: a fresh count
+    assert state_db.park_deferred_check(701, "SHIPREQ_LINES", 9001, "RUN1", 0) == 1
+
+    state_db.clear_deferred_check(701)
+    assert state_db.get_deferred_attempts(701, "SHIPREQ_LINES") == 0
+
+
+def test_parked_orders_are_rechecked_in_batch_and_resumed(state_db, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "DEFERRED_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(app, "DEFERRED_RECHECK_SECONDS", 0)
+    queries, resumed = [], []
+    monkeypatch.setattr(app, "get_so_statuses_p2", lambda conn, sos: queries.append(sorted(sos)) or {9001: 1})
+    monkeypatch.setattr(app, "get_so_line_counts_p2", lambda conn, sos: queries.append(sorted(sos)) or {})
+
+    def _phase1(ro, rw, run_id, sorders, prefetch=None):
+        resumed.append((list(sorders), set(prefetch["deferred_give_up"]), dict(prefetch["so_status_p2"])))
+        return {"processed": len(sorders), "held": 0, "failed": 0, "deferred": 0}
+
+    monkeypatch.setattr(app, "run_phase1_orders", _phase1)
+
+    state_db.park_deferred_check(701, "SO_P2_STATUS", 9001, "RUN1", 0)
+    state_db.park_deferred_check(702, "SHIPREQ_LINES", 9002, "RUN1", 0)
+    state_db.park_deferred_check(703, "SO_P2_STATUS", 9003, "OTHER_RUN", 0)
+
+    counts = app.run_deferred_checks(None, None, "RUN1", {})
+
+    # 701's SO status showed up on the first pass; 702's lines never did, so it
+    # resumes with the give-up flag (process_one_order applies its fallback)
+    assert resumed == [([701], set(), {9001: 1}), ([702], {702}, {9001: 1})]
+    assert queries[:2] == [[9001], [9002]]
+    assert counts == {"resumed": 2, "held": 0, "failed": 0, "waiting": 0}
+    assert [r["sordernum"] for r in state_db.get_deferred_checks()] == [703]
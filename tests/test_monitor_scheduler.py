@@ -0,0 +1,43 @@
+# tests/test_monitor_scheduler.py
+from services import monitor_scheduler
+
+
+def _check(db, phase, sos, ts):
+    db.mark_monitor_checked(phase, sos)
+    conn = db.state_conn()
+    conn.executemany(
+        "UPDATE monitor_checks SET last_checked_ts=? WHERE phase=? AND sordernum=?",
+        [(ts, phase, so) for so in sos],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_priority_hot_then_stale_then_oldest_hold(state_db):
+    for so in (1, 2, 3, 4, 5):
+        state_db.upsert_order_state(so, "COMPLETE", "COMPLETE")
+    state_db.upsert_order_state(4, "HOLD", "P2_REQ_CHANGED")
+    state_db.upsert_order_state(2, "HOLD", "P2_REQ_CHANGED")
+    _check(state_db, "2A", [1, 2, 3, 4], "2999-01-01T00:00:00+00:00")  # recently checked
+    _check(state_db, "2A", [5], "2000-01-01T00:00:00+00:00")          # past the staleness bound
+
+    order = monitor_scheduler.prioritize("2A", [1, 2, 3, 4, 5], hot=[3])
+
+    # QTY_CHANGE event first, then the stale order, then HOLDs oldest first, then the rest
+    assert order == [3, 5, 4, 2, 1]
+
+
+def test_run_batched_stops_on_budget(state_db, monkeypatch):
+    for so in (1, 2, 3, 4, 5):
+        state_db.upsert_order_state(so, "IN_PROGRESS", "PHASE2A")
+    monkeypatch.setattr(monitor_scheduler, "PHASE2_BATCH_SIZE", 2)
+    monitor_scheduler.start_run()
+    seen = []
+
+    done = monitor_scheduler.run_batched("2A", [1, 2, 3, 4, 5], seen.append, budget_s=1e-9)
+
+    # the first batch always runs, the rest is left for the next run
+    assert seen == [[1, 2]]
+    assert done == [1, 2]
+    assert monitor_scheduler.skipped_counts() == {"2A": 3}
+    assert monitor_scheduler.stale_sos("2A", [1, 2, 3]) == {3}
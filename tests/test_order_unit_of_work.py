@@ -0,0 +1,70 @@
+# tests/test_order_unit_of_work.py
+import pytest
+
+COLS = ("status", "last_step", "job_p4_code", "po_p4_num", "so_p2_num", "hold_since_ts")
+
+
+def _row(db, so):
+    conn = db.state_conn()
+    try:
+        r = conn.execute(f"SELECT {', '.join(COLS)} FROM lws_order_state WHERE sordernum=?", (so,)).fetchone()
+        return dict(r) if r else None
+    finally:
+        conn.close()
+
+
+def _steps(db, so):
+    db.upsert_order_state(so, "HOLD", "JOB_P4_HOLD", job_p4="J1")
+    db.upsert_order_state(so, "HOLD", "JOB_P4_HOLD")
+    db.upsert_order_state(so, "IN_PROGRESS", "PO_P4", po_p4=77)
+    db.upsert_order_state(so, "IN_PROGRESS", "SO_P2", so_p2=88)
+    db.upsert_order_state(so, "COMPLETE", "COMPLETE")
+
+
+def test_buffered_writes_end_up_like_direct_writes(state_db):
+    _steps(state_db, 1)
+    with state_db.order_unit_of_work():
+        _steps(state_db, 2)
+        assert _row(state_db, 2) is None  # nothing written yet
+
+    assert _row(state_db, 2) == _row(state_db, 1)
+    assert _row(state_db, 2)["job_p4_code"] == "J1"
+    assert _row(state_db, 2)["hold_since_ts"] is None
+
+
+def test_hold_keeps_its_start_across_buffered_writes(state_db):
+    state_db.upsert_order_state(3, "HOLD", "JOB_P4_HOLD")
+    since = _row(state_db, 3)["hold_since_ts"]
+
+    with state_db.order_unit_of_work():
+        state_db.upsert_order_state(3, "HOLD", "JOB_P4_HOLD")
+        state_db.upsert_order_state(3, "HOLD", "PO_P4_HOLD")
+
+    assert _row(state_db, 3)["hold_since_ts"] == since
+    assert _row(state_db, 3)["last_step"] == "PO_P4_HOLD"
+
+
+def test_flush_makes_progress_durable_mid_order(state_db):
+    with state_db.order_unit_of_work():
+        state_db.upsert_order_state(4, "IN_PROGRESS", "JOB_P4", job_p4="J4")
+        state_db.mark_run_order("RUN1", 4, "IN_PROGRESS", "JOB_P4")
+        state_db.flush_order_writes()
+        assert _row(state_db, 4)["job_p4_code"] == "J4"
+
+        with state_db.order_unit_of_work():  # nested joins the outer one
+            state_db.upsert_order_state(4, "IN_PROGRESS", "PO_P4", po_p4=44)
+        assert _row(state_db, 4)["po_p4_num"] is None
+
+    assert _row(state_db, 4)["po_p4_num"] == 44
+    conn = state_db.state_conn()
+    assert conn.execute("SELECT last_step FROM run_orders WHERE run_id='RUN1' AND sordernum=4").fetchone()[0] == "JOB_P4"
+    conn.close()
+
+
+def test_exception_still_flushes(state_db):
+    with pytest.raises(RuntimeError):
+        with state_db.order_unit_of_work():
+            state_db.upsert_order_state(5, "FAILED", "PO_P4")
+            raise RuntimeError("boom")
+
+    assert _row(state_db, 5)["status"] == "FAILED"
@@ -0,0 +1,54 @@
+# tests/test_outbox_listener.py
+import pytest
+
+from services import lws_outbox_listener, outbox
+
+
+@pytest.fixture
+def events(state_db, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BACKEND", "sqlite")
+    conn = state_db.state_conn()
+    outbox.enqueue_event(conn, "NEW_ORDER", 101)
+    outbox.enqueue_event(conn, "QTY_CHANGE", 102, 1)
+    conn.close()
+
+
+def _pending():
+    conn = outbox.outbox_conn()
+    try:
+        return [e.sordernum for e in outbox.fetch_pending(conn)]
+    finally:
+        conn.close()
+
+
+def test_events_are_acknowledged_after_the_run(events, monkeypatch):
+    calls = []
+
+    def _run_once(orders, qty_change_orders):
+        calls.append((orders, qty_change_orders, _pending()))
+        return True
+
+    monkeypatch.setattr(lws_outbox_listener, "run_once", _run_once)
+
+    assert lws_outbox_listener.poll_outbox_once() == 2
+    # still Pending while the run acted on them
+    assert calls == [([101], [102], [101, 102])]
+    assert _pending() == []
+
+
+def test_skipped_run_leaves_events_pending(events, monkeypatch):
+    monkeypatch.setattr(lws_outbox_listener, "run_once", lambda **kw: False)
+
+    assert lws_outbox_listener.poll_outbox_once() == 0
+    assert _pending() == [101, 102]
+
+
+def test_crashed_run_leaves_events_pending(events, monkeypatch):
+    def _run_once(**kw):
+        raise RuntimeError("Radius down")
+
+    monkeypatch.setattr(lws_outbox_listener, "run_once", _run_once)
+
+    with pytest.raises(RuntimeError):
+        lws_outbox_listener.poll_outbox_once()
+    assert _pending() == [101, 102]
@@ -0,0 +1,66 @@
+# tests/test_phase1_workers.py
+import threading
+
+import pytest
+
+import app
+import run_context
+from exceptions import WorkflowDeferred, WorkflowHold
+
+
+@pytest.fixture
+def outcomes(monkeypatch, radius_conn):
+    """process_one_order stand-in: SO % 4 -> ok / hold / deferred / crash. Records the conns used."""
+    opened, used = [], []
+
+    def _conn():
+        c = radius_conn()
+        opened.append(c)
+        return c
+
+    def _process(ro_conn, rw_conn, run_id, sordernum, prefetch=None):
+        used.append((sordernum, threading.get_ident(), ro_conn, rw_conn))
+        kind = sordernum % 4
+        if kind == 1:
+            raise WorkflowHold("hold")
+        if kind == 2:
+            raise WorkflowDeferred("wait", kind="SO_P2_STATUS", ref=sordernum)
+        if kind == 3:
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(app, "get_readonly_conn", _conn)
+    monkeypatch.setattr(app, "get_db_conn", _conn)
+    monkeypatch.setattr(app, "process_one_order", _process)
+    return opened, used
+
+
+def test_sequential_uses_the_run_connections(outcomes, radius_conn):
+    opened, used = outcomes
+    ro, rw = radius_conn(), radius_conn()
+
+    counts = app.run_phase1_orders(ro, rw, "RUN1", [4, 5, 6, 7], workers=1)
+
+    assert counts == {"processed": 4, "held": 1, "failed": 1, "deferred": 1}
+    assert opened == []
+    assert all(u[2] is ro and u[3] is rw for u in used)
+
+
+def test_workers_get_their_own_connections_and_close_them(outcomes, radius_conn):
+    opened, used = outcomes
+    ro, rw = radius_conn(), radius_conn()
+    ctx = run_context.start_run_context("RUN1")
+    try:
+        counts = app.run_phase1_orders(ro, rw, "RUN1", list(range(4, 16)), workers=3)
+        # worker read-only connections are unbound from the run cache again
+        assert not any(ctx.is_bound(c) for c in opened)
+    finally:
+        run_context.end_run_context(ctx)
+
+    assert counts == {"processed": 12, "held": 3, "failed": 3, "deferred": 3}
+    assert sorted(u[0] for u in used) == list(range(4, 16))
+    assert not any(u[2] is ro or u[3] is rw for u in used)
+    # one RO/RW pair per worker thread, all closed after the pool
+    threads = {u[1] for u in used}
+    assert len(opened) == 2 * len(threads) <= 6
+    assert all(c.closed for c in opened)
+    assert not ro.closed and not rw.closed
@@ -0,0 +1,157 @@
+# tests/test_phase2_bulk.py
+import logging
+
+from services import phase2_qty_changes as p2
+
+LOG = logging.getLogger("test_phase2_bulk")
+
+
+def _so4_lines(lines):
+    """PV_SOrderLine (Plant 4) handler: lines = [(so, line, qty)]."""
+
+    def _handler(sql, params):
+        return [
+            {"SOrderNum": so, "SOrderLineNum": ln, "ItemCode": "FG", "OrderedQty": qty,
+             "ReqDate": "2026-01-01", "SOItemTypeCode": "FG"}
+            for so, ln, qty in lines
+            if so in params
+        ]
+
+    return _handler
+
+
+def test_so4_lines_for_every_monitored_so_in_one_query(state_db, radius_conn):
+    ro = radius_conn(_so4_lines([(1, 2, 5), (1, 1, 4), (2, 1, 7)]))
+
+    lines = p2.get_so_lines_p4_bulk(ro, [1, 2, 3])
+
+    assert len(ro.executed) == 1
+    assert [ln["SOrderLineNum"] for ln in lines[1]] == [1, 2]
+    assert set(lines) == {1, 2}
+
+
+def test_bulk_detector_flags_new_and_changed_sos_only(state_db, radius_conn):
+    conn = state_db.state_conn()
+    for so, ln, qty in [(1, 1, 4), (2, 1, 7), (3, 1, 9)]:
+        state_db.upsert_so4_line_snapshot(conn, so, ln, "FG", qty, "2026-01-01")
+    conn.commit()
+
+    ro = radius_conn(_so4_lines([
+        (1, 1, 4),             # unchanged
+        (2, 1, 8),             # qty changed
+        (3, 1, 9), (3, 2, 1),  # new line
+        (4, 1, 2),             # never snapshotted
+    ]))
+
+    lines_by_so, changed = p2.detect_so4_qty_changes_bulk(conn, ro, [1, 2, 3, 4], LOG)
+
+    assert changed == {2, 3, 4}
+    assert set(lines_by_so) == {1, 2, 3, 4}
+    # the temp diff table is left empty
+    assert conn.execute("SELECT COUNT(*) FROM tmp_so4_lines").fetchone()[0] == 0
+    conn.close()
+
+
+def _pv_req(rows):
+    """PV_Req handler: rows = [(job, group, item, qty)]."""
+
+    def _handler(sql, params):
+        return [
+            {"RequirementId": i, "JobCode": job, "ReqGroupCode": grp, "ItemCode": item, "RequiredQty": qty,
+             "RequiredDate": "2026-01-01"}
+            for i, (job, grp, item, qty) in enumerate(rows)
+            if job in params
+        ]
+
+    return _handler
+
+
+def test_changed_req_jobs_are_found_in_one_fetch_and_one_diff(state_db, radius_conn):
+    conn = state_db.state_conn()
+    for job, qty in (("J1", 10), ("J2", 10)):
+        state_db.upsert_req_snapshot_keyed(conn, job, "P4-FILM", "16P4-A", qty, "2026-01-01")
+    state_db.upsert_req_snapshot_keyed(conn, "J4", "P4-FILM", "16P4-A", 3, "2026-01-01")
+    state_db.record_snapshot_versions(conn, "REQ_JOB", ["J4"], "RUN0")
+
+    ro = radius_conn(_pv_req([
+        ("J1", "P4-FILM", "16P4-A", 10.00001),  # within tolerance
+        ("J2", "p4-film", "16p4-a", 12),        # moved (keys normalized)
+        ("J3", "P4-PF", "16P4-B", 5),           # no snapshot yet
+        ("J1", "P4-FILM", "OTHER-ITEM", 99),    # not a film requirement: ignored
+        ("J4", "P4-FILM", "16P4-A", 3),         # equal hash: not diffed
+    ]))
+
+    reqs_by_job, changed = p2.find_changed_req_jobs(conn, ro, ["J1", "J2", "J3", "J4", "J5"], LOG)
+
+    assert changed == {"J2", "J3"}
+    assert set(reqs_by_job) == {"J1", "J2", "J3", "J4"}
+    assert len(ro.executed) == 1
+    conn.close()
+
+
+def _phase2c_radius(sql, params):
+    if "PV_POrderLine" in sql:
+        return [{"pordernum": po, "porderlinenum": 1, "orderedqty": 100} for po in params]
+    if "PV_JobLine" in sql:
+        qty = {"JP11": 100, "JP12": 90}
+        return [{"JobCode": j, "ItemCode": "FG-2", "JobQty": qty[j]} for j in params if j in qty]
+    if "sol.plantcode = '2'" in sql:
+        return [{"sordernum": so, "sorderlinenum": 1, "itemcode": "FG-2", "orderedqty": 100, "reqdate": "2026-01-01"}
+                for so in params[1:]]
+    if "\"PlantCode\" = '4'" in sql:
+        return [{"SOrderLineNum": 1, "ItemCode": "FG", "OrderedQty": 100, "ReqDate": "2026-01-01"}]
+    return []
+
+
+def test_phase2c_checks_every_hold_with_three_radius_queries(state_db, radius_conn):
+    conn = state_db.state_conn()
+    for so4 in (11, 12):
+        state_db.upsert_order_state(so4, "HOLD", "P2_SO_QTY_UPDATED_WAIT_RECONFIRM",
+                                    so_p2=200 + so4, job_p2=f"JP{so4}")
+        state_db.upsert_so4_to_po_map(conn, so4, 1, 500 + so4, 1)
+    state_db.upsert_order_state(13, "COMPLETE", "COMPLETE", so_p2=213, job_p2="JP13")
+    ro = radius_conn(_phase2c_radius)
+
+    results = p2.detect_starpak_reconfirm_or_complete_bulk(conn, ro, None, "RUN1", [11, 12, 13], LOG)
+
+    # 11: job reconfirmed to the PO qty -> released; 12: still 90 -> stays HOLD; 13: not a 2C hold
+    assert results == {11: True, 12: False, 13: False}
+    assert state_db.get_order_status(11) == "COMPLETE"
+    assert state_db.get_order_status(12) == "HOLD"
+    # PO lines, Plant 2 SO lines, job lines (+ the SO4 baseline refresh of the released order)
+    assert len(ro.executed) == 4
+    conn.close()
+
+
+def test_custref_monitor_only_touches_real_changes(state_db, radius_conn, monkeypatch):
+    from services import phase2_custref_changes as cr
+
+    updates, emails = [], []
+    monkeypatch.setattr(cr, "update_starpak_so_custref_api", lambda rw, so_p2, custref, logger: updates.append((so_p2, custref)))
+    monkeypatch.setattr(cr, "_send_fulfillment_custref_reconfirm_email", lambda **kw: emails.append(kw["so4"]))
+
+    conn = state_db.state_conn()
+    for so4 in (21, 22):
+        state_db.upsert_so4_header_snapshot(conn, so4, "A")
+    conn.execute("UPDATE so4_header_snapshot SET updated_ts='2026-01-01T00:00:00+00:00'")
+    conn.commit()
+
+    headers = {"4": {21: "A", 22: "B ", 23: "X"}, "2": {223: "X"}}
+    ro = radius_conn(lambda sql, params: [
+        {"SOrderNum": so, "CustRef": headers[params[0]][so]} for so in params[1:] if so in headers[params[0]]
+    ])
+
+    results = cr.detect_so4_custref_changes_bulk(
+        sqlite_conn=conn, ro_conn=ro, rw_conn=None, run_id="RUN1",
+        so_p2_by_so4={21: 221, 22: 222, 23: 223, 24: None},
+        force_authorize_func=lambda rw, so_p2, logger: None, logger=LOG,
+    )
+
+    # 21 unchanged, 22 changed A -> B, 23 first snapshot already in sync with StarPak, 24 has no StarPak SO
+    assert results == {21: False, 22: True, 23: False}
+    assert updates == [(222, "B")]
+    assert emails == [22]
+    assert state_db.get_so4_header_snapshot(conn, 23)["custref"] == "X"
+    # Plant 4 headers + Plant 2 headers of the one SO4 without a snapshot
+    assert [p for _, p in ro.executed] == [("4", 21, 22, 23), ("2", 223)]
+    conn.close()
@@ -0,0 +1,106 @@
+# tests/test_polytex_po.py
+import base64
+import json
+import logging
+import threading
+
+import pytest
+
+import api
+
+from exceptions import WorkflowApiError
+from services import polytex_po
+
+LOG = logging.getLogger("test_polytex_po")
+
+
+def _req(job):
+    return {"jobcode": job, "itemcode": "PT-1", "qty": 10, "required_date": "2026-01-01", "dim_a": 12}
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    """
+    Queue of responses for XLinkAPIPOrder; records every posted payload.
+    A dict reply answers a single-PO call by its SuppRef (those are posted concurrently).
+    """
+    sent, replies = [], []
+
+    def _post(entity, b64_payload, logger):
+        sent.append(entity)
+        reply = replies.pop(0)
+        if isinstance(reply, dict):
+            reply = reply[json.loads(base64.b64decode(b64_payload))["XLPOrders"]["XLPOrder"][0]["SuppRef"]]
+        return reply() if callable(reply) else reply
+
+    monkeypatch.setattr(polytex_po, "send_post_request", _post)
+    monkeypatch.setattr(api, "send_post_request", _post)  # XLinkClient posts
+    monkeypatch.setattr(polytex_po, "find_existing_pos_by_jobs", lambda conn, jobs: {})
+    return sent, replies
+
+
+def test_element_with_po_number_and_message_counts_as_created(posts, radius_response):
+    sent, replies = posts
+    replies.append(radius_response(1, {"XLPOrders": {"XLPOrder": [
+        {"SuppRef": "J1", "POrderNum": 9001, "ErrorMessage": "Price defaulted"},
+        {"SuppRef": "J2", "POrderNum": 9002},
+    ]}}))
+
+    out = polytex_po.create_polytex_pos(None, [_req("J1"), _req("J2")], LOG)
+
+    assert out == {"J1": 9001, "J2": 9002}
+    assert sent == ["XLinkAPIPOrder"]  # no single-call retry, so no duplicate PO
+
+
+def test_element_error_without_po_number_fails_only_its_job(posts, radius_response):
+    sent, replies = posts
+    replies.append(radius_response(9, {"XLPOrders": {"XLPOrder": [
+        {"SuppRef": "J1", "ErrorMessage": "Item inactive"},
+        {"SuppRef": "J2", "POrderNum": 9002},
+    ]}}, error="Problem with PO"))
+
+    out = polytex_po.create_polytex_pos(None, [_req("J1"), _req("J2")], LOG)
+
+    assert isinstance(out["J1"], WorkflowApiError)
+    assert out["J1"].api_messages == ["Item inactive"]
+    assert out["J2"] == 9002
+    assert sent == ["XLinkAPIPOrder"]
+
+
+def test_element_without_result_falls_back_to_existing_then_single(posts, radius_response, monkeypatch):
+    sent, replies = posts
+    monkeypatch.setattr(polytex_po, "find_existing_pos_by_jobs", lambda conn, jobs: {"J2": 7002})
+    replies.append(radius_response(9, {"XLPOrders": {"XLPOrder": [
+        {"SuppRef": "J1"}, {"SuppRef": "J2"}, {"SuppRef": "J3"},
+    ]}}, error="Batch rejected"))
+    # both single calls must be in flight together to get past the barrier
+    both_posted = threading.Barrier(2, timeout=5)
+
+    def _single(resp):
+        def _reply():
+            both_posted.wait()
+            return resp
+        return _reply
+
+    singles = {
+        "J1": _single(radius_response(1, {"XLPOrders": {"XLPOrder": [{"POrderNum": 7001}]}})),
+        "J3": _single(radius_response(9, None, error="Job closed")),
+    }
+    replies.extend([singles, singles])
+
+    out = polytex_po.create_polytex_pos(None, [_req("J1"), _req("J2"), _req("J3")], LOG)
+
+    assert out["J1"] == 7001
+    assert out["J2"] == 7002
+    assert "Job closed" in str(out["J3"])
+    assert len(sent) == 3
+
+
+def test_single_create_status_handling(posts, radius_response):
+    _, replies = posts
+    replies.append(radius_response(1, {"XLPOrders": {"XLPOrder": {"pordernum": 55}}}))
+    assert polytex_po.create_polytex_po(None, "J1", "PT-1", 1, "2026-01-01", 1, LOG) == 55
+
+    replies.append(radius_response(9, None, error="Supplier on hold"))
+    with pytest.raises(RuntimeError, match="Supplier on hold"):
+        polytex_po.create_polytex_po(None, "J1", "PT-1", 1, "2026-01-01", 1, LOG)
@@ -0,0 +1,58 @@
+# tests/test_prefetch_links.py
+import app
+import db
+
+# Rows as Radius returns them for the ORDER BY ... DESC of each lookup (newest first)
+JOBSOLINK = [
+    {"SOrderNum": 10, "JobCode": "J10-NEW", "PlantCode": "4"},
+    {"SOrderNum": 10, "JobCode": "J10-OLD", "PlantCode": "4"},
+    {"SOrderNum": 11, "JobCode": "J11", "PlantCode": "4"},
+    {"SOrderNum": 900, "JobCode": "P2-900", "PlantCode": "2"},
+]
+PORDER = [{"POrderNum": 500, "SuppRef": "J10-NEW"}]
+SORDER = [{"SOrderNum": 900, "AddtCustRef": "500"}, {"SOrderNum": 1, "AddtCustRef": "n/a"}]
+
+
+def _radius(sql, params):
+    if '"PV_JobSOLink"' in sql:
+        plant = "2" if "\"PlantCode\" = '2'" in sql else "4"
+        return [r for r in JOBSOLINK if r["PlantCode"] == plant and r["SOrderNum"] in params]
+    if '"PV_POrder"' in sql:
+        return [r for r in PORDER if r["SuppRef"] in params]
+    if '"PV_SOrder"' in sql:
+        return [r for r in SORDER if r["AddtCustRef"] in params]
+    return []
+
+
+def test_rquery_in_dedupes_and_chunks(radius_conn):
+    conn = radius_conn(lambda sql, params: [{"n": p} for p in params])
+
+    rows = db.rquery_in(conn, "SELECT n FROM t WHERE n IN ({marks})", [1, 2, 2, 3, 1], chunk_size=2)
+
+    assert [r["n"] for r in rows] == [1, 2, 3]
+    assert [p for _, p in conn.executed] == [(1, 2), (3,)]
+    assert conn.executed[0][0] == "SELECT n FROM t WHERE n IN (?,?)"
+
+
+def test_prefetch_resolves_the_whole_chain_in_four_queries(radius_conn):
+    conn = radius_conn(_radius)
+
+    links = app.prefetch_radius_links(conn, [10, 11, 12])
+
+    assert links == {
+        "job_p4": {10: "J10-NEW", 11: "J11"},  # newest job wins, SO 12 has none
+        "po_by_job": {"J10-NEW": 500},
+        "so_by_po": {500: 900},
+        "job_p2": {900: "P2-900"},
+    }
+    assert len(conn.executed) == 4
+
+
+def test_prefetch_miss_falls_back_to_the_live_lookup():
+    calls = []
+    prefetch = {"job_p4": {10: "J10"}}
+
+    assert app._prefetched(prefetch, "job_p4", 10, lambda: calls.append(10)) == "J10"
+    assert app._prefetched(prefetch, "job_p4", 11, lambda: calls.append(11) or "J11-LIVE") == "J11-LIVE"
+    assert app._prefetched(None, "job_p4", 12, lambda: "J12-LIVE") == "J12-LIVE"
+    assert calls == [11]
@@ -0,0 +1,101 @@
+# tests/test_radius_codec.py
+import base64
+import json
+
+import api
+from radius_codec import RadiusResponse
+
+
+def test_parse_is_shared_but_each_decode_gets_its_own_messages(radius_response):
+    resp = radius_response(1, {"XLSOrders": {"XLSOrder": [
+        {"SOrderNum": 5, "ErrorMessage": "bad", "XLSOrderPrice": [{"ItemCode": "I", "ErrorMessage": "inactive"}]},
+    ]}})
+
+    first = api.decode_sorder_response(resp)
+    second = api.decode_sorder_response(resp)
+    generic = api.decode_generic(resp)
+
+    assert first.messages == ["SO 5: bad", "SO 5 Item I: inactive"]
+    assert second.messages == first.messages
+    assert first.messages is not second.messages
+    assert generic.messages == []
+    # one parse: the element list object is the same for every decode of resp
+    assert first.elements() is second.elements() is generic.elements()
+
+
+def test_decoding_porder_twice_does_not_duplicate_messages(radius_response):
+    resp = radius_response(9, error="Supplier on hold", raw_payload="!!not base64")
+
+    a = api.decode_porder_response(resp)
+    b = api.decode_porder_response(resp)
+
+    assert a.messages[0] == "Supplier on hold"
+    assert len(a.messages) == 2 and a.messages[1].startswith("Failed to decode payload")
+    assert b.messages == a.messages
+    b.messages.append("caller note")
+    assert len(a.messages) == 2
+
+
+def test_porder_keeps_old_fallbacks():
+    text_payload = base64.b64encode(b"PO 123 created").decode()
+    resp_text = json.dumps({"efiRadiusResponse": {"entityName": "XLinkAPIPOrder", "payload": text_payload}})
+
+    class Resp:
+        text = resp_text
+        status_code = 200
+
+    por = api.decode_porder_response(Resp())
+    assert por.status_code == 0
+    assert por.decoded_payload == {"_payload_text": "PO 123 created"}
+    assert por.messages == []
+
+    gen = api.decode_generic(Resp())
+    assert gen.status_code is None
+    assert gen.decoded_payload is None
+    assert gen.messages and gen.messages[0].startswith("Failed to decode payload")
+
+
+def test_non_json_body():
+    out = RadiusResponse.from_text("<html>Proxy error</html>")
+    assert out.body is None
+    assert out.status_code is None
+    assert out.raw_error.startswith("Exception parsing API response JSON")
+    assert out.messages == [out.raw_error]
+    assert out.elements() == []
+
+
+def test_elements_and_item_messages(radius_response):
+    resp = radius_response(1, {"XLItems": {"XLItem": {"ItemCode": "A", "ErrorMessage": " x "}}})
+    out = api.decode_item_response(resp)
+    assert out.elements() == [{"ItemCode": "A", "ErrorMessage": " x "}]
+    assert out.messages == ["Item A: x"]
+
+
+def test_line_errors_for_failure_email():
+    payload = {"XLSOrders": {"XLSOrder": [{
+        "ErrorMessage": "Problem with Line #1",
+        "XLSOrderLine": {"SOrderLineNum": 1, "ItemCode": "I", "ErrorMessage": "Item is inactive"},
+    }]}}
+    raw = json.dumps({"efiRadiusResponse": {
+        "statusCode": 9, "payload": base64.b64encode(json.dumps(payload).encode()).decode(),
+    }})
+
+    out = RadiusResponse.from_text(raw)
+    assert out.line_errors() == [
+        {"SOrderLineNum": 1, "ItemCode": "I", "ErrorMessage": "Item is inactive", "Action": None},
+    ]
+
+
+def test_send_post_request_skips_debug_rendering_when_debug_is_off(monkeypatch, radius_response):
+    calls = []
+
+    class QuietLogger:
+        def isEnabledFor(self, level):
+            return False
+
+        def debug(self, *args):
+            calls.append(args)
+
+    monkeypatch.setattr(api.SESSION, "post", lambda *a, **k: radius_response(1))
+    api.send_post_request("XLinkAPIItem", api.b64_json({"a": 1}), QuietLogger())
+    assert calls == []
@@ -0,0 +1,98 @@
+# tests/test_retention.py
+import pytest
+
+from services import retention
+
+
+def _archive(conn, so, job_p4=None, job_p2=None, days_ago=30):
+    conn.execute("""
+        INSERT INTO lws_order_state_archive(sordernum, status, job_p4_code, job_p2_code, archived_ts)
+        VALUES (?, 'COMPLETE', ?, ?, datetime('now', ?))
+    """, (so, job_p4, job_p2, f"-{days_ago} days"))
+
+
+def _count(conn, table, where="1=1", params=()):
+    return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+
+
+@pytest.fixture
+def conn(state_db):
+    c = state_db.state_conn()
+    yield c
+    c.close()
+
+
+def test_cascade_removes_archived_state_but_keeps_shared_and_recent(state_db, conn):
+    _archive(conn, 100, job_p4="J100", job_p2="JSHARED")
+    _archive(conn, 101, job_p4="J101", days_ago=1)  # still in its grace period
+    state_db.upsert_order_state(200, "IN_PROGRESS", "PHASE2A", job_p2="JSHARED")
+
+    for so in (100, 101, 200):
+        state_db.upsert_so4_line_snapshot(conn, so, 1, "FG-1", 10, "2026-01-01")
+        state_db.upsert_so4_to_po_map(conn, so, 1, 9000 + so, 1)
+    for job in ("J100", "J101", "JSHARED"):
+        state_db.upsert_req_snapshot_keyed(conn, job, "RG", "IT", 5, "2026-01-01")
+    state_db.record_snapshot_versions(conn, "SO4_LINES", [100, 101, 200], "RUN1")
+    state_db.record_snapshot_versions(conn, "REQ_JOB", ["J100", "J101", "JSHARED"], "RUN1")
+    conn.commit()
+
+    out = retention.cascade_archived_orders(conn, grace_days=7, chunk=1)
+
+    assert out["so4_line_snapshot"] == 1 and out["so4_to_po_map"] == 1
+    assert out["req_snapshot_keyed"] == 1
+    assert _count(conn, "so4_line_snapshot", "so4_sordernum = 100") == 0
+    assert _count(conn, "so4_line_snapshot", "so4_sordernum IN (101, 200)") == 2
+    assert [r[0] for r in conn.execute("SELECT jobcode FROM req_snapshot_keyed ORDER BY jobcode")] == ["J101", "JSHARED"]
+    for table in ("snapshot_hash", "snapshot_versions"):
+        keys = {r[0] for r in conn.execute(f"SELECT entity_key FROM {table}")}
+        assert keys == {"101", "200", "J101", "JSHARED"}
+
+
+def test_rollup_folds_old_rows_of_unmonitored_orders(state_db, conn):
+    state_db.upsert_order_state(200, "IN_PROGRESS", "PHASE2A")
+    rows = [
+        (100, "QTY", "1", "2", "2020-01-01T00:00:00+00:00"),
+        (100, "QTY", "2", "3", "2020-02-01T00:00:00+00:00"),
+        (100, "QTY", "3", "4", "2099-01-01T00:00:00+00:00"),  # recent: stays
+        (200, "QTY", "1", "2", "2020-01-01T00:00:00+00:00"),  # monitored: stays
+    ]
+    conn.executemany("""
+        INSERT INTO order_change_log(run_id, so4_sordernum, so4_linenum, change_type, old_value, new_value, created_ts)
+        VALUES ('RUN1', ?, 1, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+
+    assert retention.rollup_change_log(conn, days=30, chunk=1) == 2
+    assert retention.rollup_change_log(conn, days=30) == 0
+
+    assert _count(conn, "order_change_log") == 2
+    r = conn.execute("SELECT * FROM order_change_log_rollup").fetchall()
+    assert len(r) == 1
+    assert (r[0]["so4_sordernum"], r[0]["row_count"]) == (100, 2)
+    assert r[0]["first_ts"].startswith("2020-01-01")
+    assert (r[0]["last_ts"][:10], r[0]["last_old_value"], r[0]["last_new_value"]) == ("2020-02-01", "2", "3")
+
+
+def test_trim_keeps_newest_versions(state_db, conn):
+    for qty in range(5):
+        state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", qty, "2026-01-01")
+        state_db.record_snapshot_versions(conn, "SO4_LINES", [100], f"RUN{qty}")
+    conn.execute("UPDATE snapshot_versions SET created_ts = '2020-01-01T00:00:00+00:00'")
+    conn.commit()
+
+    assert retention.trim_snapshot_versions(conn, days=30, keep=2) == 3
+    assert [r[0] for r in conn.execute("SELECT version FROM snapshot_versions ORDER BY version")] == [4, 5]
+
+
+def test_reclaim_space_returns_free_pages(conn):
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.execute("CREATE TABLE filler (x TEXT)")
+    conn.executemany("INSERT INTO filler VALUES (?)", [("x" * 1000,) for _ in range(200)])
+    conn.commit()
+    conn.execute("DROP TABLE filler")
+    conn.commit()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+
+    out = retention.reclaim_space(conn, pages=10_000)
+    assert out["reclaimed_pages"] > 0
+    assert out["free_pages"] == 0
@@ -0,0 +1,107 @@
+# tests/test_run_context.py
+import pytest
+
+import db
+import run_context
+from services import polytex_po_update
+
+SQL_POLINE = 'SELECT * FROM "PUB"."PV_POrderLine" WHERE "POrderNum" = ?'
+SQL_SOLINE = 'SELECT * FROM "PUB"."PV_SOrderLine" WHERE "SOrderNum" = ?'
+SQL_ITEM = 'SELECT * FROM "PUB"."PM_Item" WHERE "ItemCode" = ?'
+
+
+@pytest.fixture
+def ctx(radius_conn):
+    """Active RunContext with a bound read-only connection that returns one row per query."""
+    conn = radius_conn(lambda sql, params: [{"Qty": 1}])
+    c = run_context.start_run_context("RUN1")
+    c.bind(conn)
+    yield c, conn
+    run_context.end_run_context(c)
+
+
+def _reads(conn, sql):
+    return sum(1 for s, _ in conn.executed if s == sql)
+
+
+def test_bound_reads_are_cached_and_unbound_are_not(ctx, radius_conn):
+    c, conn = ctx
+    db.rquery(conn, SQL_POLINE, (1,))
+    db.rquery(conn, SQL_POLINE, (1,))
+    assert _reads(conn, SQL_POLINE) == 1
+
+    rw = radius_conn(lambda sql, params: [{"Qty": 1}])
+    db.rquery(rw, SQL_POLINE, (1,))
+    db.rquery(rw, SQL_POLINE, (1,))
+    assert _reads(rw, SQL_POLINE) == 2
+
+    assert c.stats()["hits"] == 1
+
+
+def test_empty_results_are_not_cached(radius_conn):
+    conn = radius_conn(lambda sql, params: [])
+    c = run_context.start_run_context("RUN2")
+    c.bind(conn)
+    try:
+        db.rquery(conn, SQL_SOLINE, (5,))
+        db.rquery(conn, SQL_SOLINE, (5,))
+    finally:
+        run_context.end_run_context(c)
+    assert _reads(conn, SQL_SOLINE) == 2
+
+
+def test_rexec_invalidates_touched_tables(ctx):
+    _, conn = ctx
+    db.rquery(conn, SQL_POLINE, (1,))
+    db.rquery(conn, SQL_ITEM, ("A",))
+
+    db.rexec(conn, 'UPDATE "PUB"."PV_POrderLine" SET "Qty" = 2 WHERE "POrderNum" = ?', (1,))
+
+    db.rquery(conn, SQL_POLINE, (1,))
+    db.rquery(conn, SQL_ITEM, ("A",))
+    assert _reads(conn, SQL_POLINE) == 2
+    assert _reads(conn, SQL_ITEM) == 1
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_phase2_update_posts_invalidate_the_posted_entity(ctx, monkeypatch, fail):
+    _, conn = ctx
+    for sql in (SQL_POLINE, SQL_SOLINE, SQL_ITEM):
+        db.rquery(conn, sql, (1,))
+
+    class Resp:
+        status_code = 200
+        text = '{"efiRadiusResponse": {"statusCode": 1}}'
+
+        def json(self):
+            return {"efiRadiusResponse": {"statusCode": 1}}
+
+        def raise_for_status(self):
+            pass
+
+    def _post(*args, **kwargs):
+        if fail:
+            raise TimeoutError("adapter timed out")
+        return Resp()
+
+    monkeypatch.setattr(polytex_po_update.SESSION, "post", _post)
+
+    if fail:
+        with pytest.raises(TimeoutError):
+            polytex_po_update.update_po_line_qty_api(1, "PT-1", "4", 1, 10)
+    else:
+        polytex_po_update.update_po_line_qty_api(1, "PT-1", "4", 1, 10)
+
+    for sql in (SQL_POLINE, SQL_SOLINE, SQL_ITEM):
+        db.rquery(conn, sql, (1,))
+    assert _reads(conn, SQL_POLINE) == 2  # XLinkAPIPOrder touched PV_POrderLine
+    assert _reads(conn, SQL_SOLINE) == 1
+    assert _reads(conn, SQL_ITEM) == 1
+
+
+def test_unknown_entity_clears_everything(ctx):
+    _, conn = ctx
+    db.rquery(conn, SQL_ITEM, ("A",))
+    run_context.invalidate_for_entity("SomeNewEntity")
+    db.rquery(conn, SQL_ITEM, ("A",))
+    assert _reads(conn, SQL_ITEM) == 2
@@ -0,0 +1,62 @@
+# tests/test_run_lock.py
+import pytest
+
+from exceptions import RunLockLost
+from services import monitor_scheduler
+
+
+def _expire(state_db):
+    conn = state_db.state_conn()
+    conn.execute("UPDATE run_lock SET expires_ts='2000-01-01T00:00:00+00:00'")
+    conn.commit()
+    conn.close()
+
+
+def test_renew_extends_own_lease_only(state_db):
+    assert state_db.acquire_run_lock("a", 60)
+    assert not state_db.acquire_run_lock("b", 60)
+    assert state_db.renew_run_lock("a", 60)
+    assert not state_db.renew_run_lock("b", 60)
+
+    # a's lease ran out and b took over: a cannot renew any more
+    _expire(state_db)
+    assert state_db.acquire_run_lock("b", 60)
+    assert not state_db.renew_run_lock("a", 60)
+    assert state_db.get_run_lock()["owner"] == "b"
+
+
+def test_run_batched_stops_when_keepalive_fails(state_db, monkeypatch):
+    monkeypatch.setattr(monitor_scheduler, "PHASE2_BATCH_SIZE", 1)
+    seen = []
+
+    def keepalive():
+        raise RunLockLost("lost")
+
+    monitor_scheduler.start_run(keepalive=keepalive)
+    try:
+        with pytest.raises(RunLockLost):
+            monitor_scheduler.run_batched("2B", [1, 2, 3], seen.append, budget_s=0)
+    finally:
+        monitor_scheduler.start_run()
+    assert seen == [[1]]
+
+
+def test_run_once_stops_when_the_lock_is_taken_over(state_db, monkeypatch):
+    import app
+
+    steps = []
+
+    def _run_once(orders, qty_change_orders, include_maintenance, keepalive):
+        keepalive()
+        steps.append("phase 2")
+        _expire(state_db)
+        state_db.acquire_run_lock("other", 60)
+        keepalive()
+        steps.append("phase 1")
+
+    monkeypatch.setattr(app, "_run_once", _run_once)
+
+    assert app.run_once() is False
+    assert steps == ["phase 2"]
+    # the new owner keeps its lock
+    assert state_db.get_run_lock()["owner"] == "other"
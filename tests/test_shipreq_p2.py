@@ -0,0 +1,59 @@
+# tests/test_shipreq_p2.py
+import pytest
+
+import run_context
+from services import shipreq_p2
+
+
+@pytest.fixture
+def bound(radius_conn):
+    """Bound read-only connection whose replies come from a list (last one repeats)."""
+    replies = []
+
+    def _handler(sql, params):
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    conn = radius_conn(_handler)
+    ctx = run_context.start_run_context("RUN1")
+    ctx.bind(conn)
+    yield conn, replies
+    run_context.end_run_context(ctx)
+
+
+def test_line_counts_with_blank_itemcodes_are_not_cached(bound):
+    conn, replies = bound
+    replies += [
+        [{"SOrderNum": 7, "ItemCode": ""}],
+        [{"SOrderNum": 7, "ItemCode": "SP-1"}, {"SOrderNum": 7, "ItemCode": "SP-2"}],
+    ]
+
+    assert shipreq_p2.get_so_line_counts_p2(conn, [7]) == {}
+    assert shipreq_p2.get_so_line_counts_p2(conn, [7]) == {7: 2}
+    # complete now: served from the run cache
+    assert shipreq_p2.get_so_line_counts_p2(conn, [7]) == {7: 2}
+    assert len(conn.executed) == 2
+
+
+def test_line_counts_missing_one_so_are_not_cached(bound):
+    conn, replies = bound
+    replies += [
+        [{"SOrderNum": 7, "ItemCode": "SP-1"}],
+        [{"SOrderNum": 7, "ItemCode": "SP-1"}, {"SOrderNum": 8, "ItemCode": "SP-3"}],
+    ]
+
+    assert shipreq_p2.get_so_line_counts_p2(conn, [7, 8]) == {7: 1}
+    assert shipreq_p2.get_so_line_counts_p2(conn, [7, 8]) == {7: 1, 8: 1}
+
+
+def test_get_so_lines_retries_past_a_blank_itemcode(bound, monkeypatch):
+    conn, replies = bound
+    monkeypatch.setattr(shipreq_p2.time, "sleep", lambda s: None)
+    replies += [
+        [{"SOrderLineNum": 1, "ItemCode": " "}],
+        [{"SOrderLineNum": 1, "ItemCode": "SP-1"}],
+    ]
+
+    rows = shipreq_p2.get_so_lines_p2(conn, 7, retries=3, delay_s=0)
+
+    assert rows[0]["ItemCode"] == "SP-1"
+    assert len(conn.executed) == 2
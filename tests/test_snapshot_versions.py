@@ -0,0 +1,79 @@
+# tests/test_snapshot_versions.py
+import logging
+
+from services import phase2_qty_changes
+
+LOG = logging.getLogger("test_snapshot_versions")
+
+
+def _radius_lines(monkeypatch, lines_by_so):
+    monkeypatch.setattr(
+        phase2_qty_changes, "get_so_lines_p4_bulk",
+        lambda ro_conn, sos: {so: lines_by_so[so] for so in sos if so in lines_by_so},
+    )
+
+
+def _line(num, qty):
+    return {"SOrderLineNum": num, "ItemCode": "FG-1", "OrderedQty": qty, "ReqDate": "2026-01-01"}
+
+
+def test_versions_are_appended_only_when_content_moves(state_db):
+    conn = state_db.state_conn()
+    state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", 10, "2026-01-01")
+    assert state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN1") == 1
+    assert state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN2") == 0
+
+    state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", 12, "2026-01-01")
+    assert state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN3") == 1
+
+    history = state_db.get_snapshot_history("SO4_LINES", 100)
+    assert [h["version"] for h in history] == [2, 1]
+    assert state_db.get_snapshot_as_of("SO4_LINES", 100)["version"] == 2
+    conn.close()
+
+
+def test_equal_hash_skips_the_diff(state_db, monkeypatch):
+    conn = state_db.state_conn()
+    state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", 10, "2026-01-01")
+    state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN1")
+    conn.commit()
+
+    _radius_lines(monkeypatch, {100: [_line(1, 10)]})
+    _, changed = phase2_qty_changes.detect_so4_qty_changes_bulk(conn, None, [100], LOG)
+    assert changed == set()
+
+    _radius_lines(monkeypatch, {100: [_line(1, 11)]})
+    _, changed = phase2_qty_changes.detect_so4_qty_changes_bulk(conn, None, [100], LOG)
+    assert changed == {100}
+    conn.close()
+
+
+def test_snapshot_rewrite_without_new_version_does_not_hide_a_change(state_db, monkeypatch):
+    conn = state_db.state_conn()
+    state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", 10, "2026-01-01")
+    state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN1")
+
+    # Phase 2C COMPLETE refreshes the baseline to 12 ...
+    state_db.upsert_so4_line_snapshot(conn, 100, 1, "FG-1", 12, "2026-01-01")
+    conn.commit()
+
+    # ... and Radius goes back to 10: same hash as version 1, but a real change vs the snapshot
+    _radius_lines(monkeypatch, {100: [_line(1, 10)]})
+    _, changed = phase2_qty_changes.detect_so4_qty_changes_bulk(conn, None, [100], LOG)
+    assert changed == {100}
+
+    # Recording afterwards keeps the numbering going
+    assert state_db.record_snapshot_versions(conn, "SO4_LINES", [100], "RUN2") == 1
+    assert state_db.get_snapshot_history("SO4_LINES", 100)[0]["version"] == 2
+    conn.close()
+
+
+def test_req_snapshot_rewrite_invalidates_job_hash(state_db):
+    conn = state_db.state_conn()
+    state_db.upsert_req_snapshot_keyed(conn, "J1", "RG", "IT", 5, "2026-01-01")
+    state_db.record_snapshot_versions(conn, "REQ_JOB", ["J1"], "RUN1")
+    assert state_db.get_snapshot_hashes(conn, "REQ_JOB", ["J1"])["J1"]
+
+    state_db.upsert_req_snapshot_keyed(conn, "J1", "RG", "IT", 6, "2026-01-01")
+    assert state_db.get_snapshot_hashes(conn, "REQ_JOB", ["J1"])["J1"] == ""
+    conn.close()
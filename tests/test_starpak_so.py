@@ -0,0 +1,87 @@
+# tests/test_starpak_so.py
+import logging
+
+import pytest
+
+import api
+
+from exceptions import WorkflowApiError
+from services import starpak_so
+
+LOG = logging.getLogger("test_starpak_so")
+
+
+def _req(po):
+    return {
+        "pordernum": po, "custref_value": f"CR{po}", "itemcode_1600": "SP-1", "qty": 5,
+        "required_date": "2026-01-01", "so_item_type_code": "FG",
+    }
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    sent, replies = [], []
+
+    def _post(entity, b64_payload, logger):
+        sent.append(entity)
+        return replies.pop(0)
+
+    monkeypatch.setattr(starpak_so, "send_post_request", _post)
+    monkeypatch.setattr(api, "send_post_request", _post)  # XLinkClient posts
+    monkeypatch.setattr(starpak_so, "find_existing_sos_by_pos", lambda conn, pos: {})
+    return sent, replies
+
+
+def test_element_with_so_number_and_line_message_counts_as_created(posts, radius_response):
+    sent, replies = posts
+    replies.append(radius_response(1, {"XLSOrders": {"XLSOrder": [
+        {"AddtCustRef": "101", "SOrderNum": 8101,
+         "XLSOrderLine": [{"ItemCode": "SP-1", "ErrorMessage": "Price from list"}]},
+        {"AddtCustRef": "102", "SOrderNum": 8102},
+    ]}}))
+
+    out = starpak_so.create_starpak_sos(None, [_req(101), _req(102)], LOG)
+
+    assert out == {"101": 8101, "102": 8102}
+    assert sent == ["XLinkAPISOrder"]
+
+
+def test_element_error_without_so_number_fails_only_its_po(posts, radius_response):
+    sent, replies = posts
+    replies.append(radius_response(9, {"XLSOrders": {"XLSOrder": [
+        {"AddtCustRef": "101", "ErrorMessage": "Problem with Line #1",
+         "XLSOrderLine": [{"ItemCode": "SP-1", "ErrorMessage": "Item is inactive"}]},
+        {"AddtCustRef": "102", "SOrderNum": 8102},
+    ]}}, error="Problem with SO"))
+
+    out = starpak_so.create_starpak_sos(None, [_req(101), _req(102)], LOG)
+
+    assert isinstance(out["101"], WorkflowApiError)
+    assert out["101"].api_messages == ["SO : Problem with Line #1", "SO  Item SP-1: Item is inactive"]
+    assert out["101"].api_status == 9
+    assert out["102"] == 8102
+    assert sent == ["XLinkAPISOrder"]
+
+
+def test_missing_element_falls_back_to_single_call(posts, radius_response):
+    sent, replies = posts
+    replies.append(radius_response(1, {"XLSOrders": {"XLSOrder": [{"AddtCustRef": "101", "SOrderNum": 8101}]}}))
+    replies.append(radius_response(1, {"XLSOrders": {"XLSOrder": [{"SOrderNum": 8102}]}}))
+
+    out = starpak_so.create_starpak_sos(None, [_req(101), _req(102)], LOG)
+
+    assert out == {"101": 8101, "102": 8102}
+    assert sent == ["XLinkAPISOrder", "XLinkAPISOrder"]
+
+
+def test_single_create_raises_structured_error(posts, radius_response):
+    _, replies = posts
+    replies.append(radius_response(9, {"XLSOrders": {"XLSOrder": [{"SOrderNum": 0, "ErrorMessage": "Customer on hold"}]}},
+                                   error="SO rejected"))
+
+    with pytest.raises(WorkflowApiError) as ei:
+        starpak_so.create_starpak_so(None, 101, "CR101", "SP-1", 5, "2026-01-01", "FG", LOG)
+
+    assert ei.value.api_status == 9
+    assert ei.value.api_error_message == "SO rejected"
+    assert ei.value.api_messages == ["SO 0: Customer on hold"]
@@ -0,0 +1,102 @@
+# tests/test_state_store.py
+import threading
+
+import pytest
+
+from db import StateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = StateStore(str(tmp_path / "state.db"), cache_kb=1024, busy_timeout_ms=1000)
+    conn = s.connection()
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    conn.commit()
+    conn.close()
+    yield s
+    s.close_all()
+
+
+def _count(store):
+    conn = store.connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_one_wal_connection_per_thread(store):
+    a = store.connection()
+    b = store.connection()
+    assert a is b
+    assert a.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(store.connection()))
+    t.start()
+    t.join()
+    assert other[0] is not a
+    a.close()
+    b.close()
+
+
+def test_inner_close_keeps_the_outer_transaction(store):
+    outer = store.connection()
+    outer.execute("INSERT INTO t VALUES (1)")
+
+    inner = store.connection()
+    inner.close()  # a helper called in the middle of the caller's work
+    assert outer.in_transaction
+
+    outer.commit()
+    outer.close()
+    assert _count(store) == 1
+
+
+def test_last_close_rolls_back_uncommitted_work(store):
+    conn = store.connection()
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.close()
+
+    assert _count(store) == 0
+    # still open for the next caller
+    assert store.connection() is conn
+    conn.close()
+
+
+def test_failed_helper_writes_are_not_committed_by_the_next_helper(store):
+    outer = store.connection()  # e.g. _run_once holding sqlite_conn for the whole run
+
+    inner = store.connection()
+    try:
+        inner.execute("INSERT INTO t VALUES (1)")
+        raise RuntimeError("helper failed before commit")
+    except RuntimeError:
+        pass
+    finally:
+        inner.close()
+
+    third = store.connection()
+    third.execute("INSERT INTO t VALUES (2)")
+    third.commit()
+    third.close()
+    outer.close()
+
+    conn = store.connection()
+    try:
+        assert [r[0] for r in conn.execute("SELECT v FROM t")] == [2]
+    finally:
+        conn.close()
+
+
+def test_dead_thread_connections_are_closed(store):
+    seen = []
+    t = threading.Thread(target=lambda: seen.append(store.connection()))
+    t.start()
+    t.join()
+
+    store.close_thread()  # forces this thread to open a new one, which prunes dead threads
+    store.connection().close()
+
+    with pytest.raises(Exception):
+        seen[0].execute("SELECT 1")
@@ -0,0 +1,44 @@
+# tests/test_status_map.py
+import app
+
+STATES = {
+    1: ("IN_PROGRESS", "PO_P4"),
+    2: ("COMPLETE", "COMPLETE"),
+    3: ("REMOVED", "REMOVED"),
+    4: ("HOLD", "SO4_QTY_CHANGED_HOLD"),
+    5: ("HOLD", "JOB_P4_HOLD"),
+    6: ("HOLD", "P2_REQ_CHANGED"),
+}
+
+
+def _seed(db):
+    for so, (status, step) in STATES.items():
+        db.upsert_order_state(so, status, step)
+
+
+def test_status_map_is_chunked_and_skips_unknown_orders(state_db):
+    _seed(state_db)
+
+    out = state_db.get_order_status_map([6, 5, 4, 3, 2, 1, 99, 1], chunk_size=2)
+
+    assert out == {so: {"status": s, "last_step": st} for so, (s, st) in STATES.items()}
+
+
+def test_bulk_rules_match_the_per_order_queries(state_db):
+    _seed(state_db)
+    states = state_db.get_order_status_map(list(STATES))
+
+    held = {so for so, st in states.items() if state_db.is_phase2_hold_state(st)}
+    monitored = {so for so, st in states.items() if state_db.is_monitored_state(st)}
+
+    assert held == {4, 6}
+    assert monitored == set(state_db.get_orders_to_monitor())
+
+
+def test_phase1_candidates_use_the_status_map(state_db):
+    _seed(state_db)
+
+    out = app.filter_phase1_candidates([1, 2, 3, 4, 5, 6, 7], held_sos={1})
+
+    # 1 held this run, 2 complete, 3 removed, 4/6 Phase 2 holds; 5 (Phase 1 hold) and 7 (new) go on
+    assert out == [5, 7]
@@ -0,0 +1,44 @@
+# tests/test_xlink_slots.py
+import threading
+import time
+
+import api
+
+
+def _max_in_flight(entity, n):
+    lock = threading.Lock()
+    state = {"now": 0, "max": 0}
+
+    def _post():
+        with api.entity_slot(entity):
+            with lock:
+                state["now"] += 1
+                state["max"] = max(state["max"], state["now"])
+            time.sleep(0.05)
+            with lock:
+                state["now"] -= 1
+
+    threads = [threading.Thread(target=_post) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return state["max"]
+
+
+def test_entity_limit_caps_concurrent_posts(monkeypatch):
+    monkeypatch.setattr(api, "XLINK_ENTITY_LIMITS", {"AdvancedOrderProcessing": 2})
+    monkeypatch.setattr(api, "_ENTITY_SLOTS", {})
+    monkeypatch.setattr(api, "_TOTAL_SLOTS", threading.BoundedSemaphore(8))
+
+    assert _max_in_flight("AdvancedOrderProcessing", 6) == 2
+    # entities without a cap only share the total
+    assert _max_in_flight("XLinkAPIItem", 6) == 6
+
+
+def test_total_limit_applies_across_entities(monkeypatch):
+    monkeypatch.setattr(api, "XLINK_ENTITY_LIMITS", {})
+    monkeypatch.setattr(api, "_ENTITY_SLOTS", {})
+    monkeypatch.setattr(api, "_TOTAL_SLOTS", threading.BoundedSemaphore(3))
+
+    assert _max_in_flight("XLinkAPISOrder", 6) == 3